@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import signal
+import ssl
+import time
+from collections import namedtuple
+import MQTTPacket
+from MQTTClient import MQTTClient
+from LatencyHistogram import HistogramSet
+logger = logging.getLogger(__name__)
+
+    # asyncio engine behind the MQTTClient interface.
+    # Sockets are non-blocking and every client of a process runs on one event loop: connect, subscribe, publish
+    # and receive are coroutines and message timeouts are event loop timers, so thousands of simulated devices
+    # need no extra threads. Payloads, timeout handling and the results schema are shared with the paho engine.
+    # Supports MQTT over TCP, with or without TLS, and QoS 0, 1 and 2 in both directions.
+    # A lost connection is recorded as a disconnect event and ends the run of the client, there is no reconnect.
+
+KEEPALIVE = 60
+WRITE_BUFFER_LIMIT = 256 * 1024 # Wait for the socket to drain when more than this is buffered.
+
+# Same shape as the paho message object passed to on_message and the message info returned by publish.
+ReceivedMessage = namedtuple("ReceivedMessage", ["topic", "payload", "qos", "retain"])
+PublishInfo = namedtuple("PublishInfo", ["mid"])
+
+
+# Message timeouts on the event loop's timer heap, same schedule() as TimeoutScheduler.
+class LoopTimeoutScheduler:
+    def __init__(self, loop):
+        self.loop = loop
+
+    def schedule(self, delay, callback, *args):
+        return self.loop.call_later(delay, callback, *args)
+
+
+class AsyncMQTTClient(MQTTClient):
+    def __init__(self, args, db, client_index=None):
+        super().__init__(args, db, client_index)
+        self.reader = None
+        self.writer = None
+        self.subscribed = asyncio.Event() # send_messages_loop waits for the SUBACK.
+        self.closing = False
+        self.last_packet_id = 0
+        self.tasks = []
+
+    # There is no paho client, only the protocol and SSL settings are checked.
+    def initialize_client(self):
+        if self.args.protocol != 'mqtt':
+            self.exit_with_message(f"Unsupported protocol for the asyncio engine: {self.args.protocol}")
+        self.ssl_check()
+        return None
+
+    def ssl_context(self):
+        if not self.args.ssl_enabled:
+            return None
+        logging.info(f"SSL/TLS is disabled for {self.args.protocol} in test use.")
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE #Bypass certificate verification in test use.
+        return context
+
+    def next_packet_id(self):
+        self.last_packet_id = self.last_packet_id % 65535 + 1
+        return self.last_packet_id
+
+    # Same call as paho publish, so the shared MQTTClient code publishes through this client.
+    # Like paho, QoS 0 publishes are acknowledged with on_publish once they are written.
+    def publish(self, topic, payload, qos=0, retain=False):
+        mid = self.next_packet_id()
+        self.writer.write(MQTTPacket.publish_packet(topic, payload, qos, mid if qos else None, retain=retain))
+        if qos == 0:
+            asyncio.get_running_loop().call_soon(self.on_publish, self, None, mid)
+        return PublishInfo(mid)
+
+    # Open the connection, wait for CONNACK and subscribe.
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.args.host, self.args.port, ssl=self.ssl_context()), self.args.timeout)
+        self.writer.write(MQTTPacket.connect_packet(self.client_id, self.args.username, self.args.password, KEEPALIVE,
+                                                    getattr(self.args, 'clean_session', True)))
+        packet_type, flags, body = await asyncio.wait_for(MQTTPacket.read_packet(self.reader), self.args.timeout)
+        if packet_type != MQTTPacket.CONNACK or len(body) < 2 or body[1] != 0:
+            raise ConnectionError(f"Failed to connect to the broker with return code {body[1] if len(body) > 1 else None}")
+        logging.info("Connected successfully to the broker.")
+        if self.return_echo: # The broker handles both subscriptions before the first publish of this connection.
+            self.writer.write(MQTTPacket.subscribe_packet(self.next_packet_id(), self.return_topic, 0))
+        self.writer.write(MQTTPacket.subscribe_packet(self.next_packet_id(), self.topic, max(self.qos_levels)))
+
+    # Dispatch incoming packets until the connection closes.
+    async def read_loop(self):
+        try:
+            while True:
+                packet_type, flags, body = await MQTTPacket.read_packet(self.reader)
+                if packet_type == MQTTPacket.PUBLISH:
+                    topic, payload, qos, packet_id, retain = MQTTPacket.parse_publish(flags, body)
+                    if qos == 1:
+                        self.writer.write(MQTTPacket.ack_packet(MQTTPacket.PUBACK, packet_id))
+                    elif qos == 2:
+                        self.writer.write(MQTTPacket.ack_packet(MQTTPacket.PUBREC, packet_id))
+                    self.on_message(self, None, ReceivedMessage(topic, payload, qos, retain))
+                elif packet_type in (MQTTPacket.PUBACK, MQTTPacket.PUBCOMP):
+                    self.on_publish(self, None, MQTTPacket.parse_packet_id(body))
+                elif packet_type == MQTTPacket.PUBREC:
+                    self.writer.write(MQTTPacket.ack_packet(MQTTPacket.PUBREL, MQTTPacket.parse_packet_id(body)))
+                elif packet_type == MQTTPacket.PUBREL:
+                    self.writer.write(MQTTPacket.ack_packet(MQTTPacket.PUBCOMP, MQTTPacket.parse_packet_id(body)))
+                elif packet_type == MQTTPacket.SUBACK:
+                    self.subscribed.set()
+        except (asyncio.IncompleteReadError, ConnectionError, MQTTPacket.MQTTProtocolError) as e:
+            if not self.closing:
+                logging.error(f"Connection to the broker lost: {e}")
+                self.record_disconnect(None, f"{type(e).__name__}: {e}") # No reconnect in the asyncio engine, the run of this client ends.
+                self.stop_event.set()
+                self.subscribed.set() # Release a sender still waiting for the subscription.
+
+    async def keepalive_loop(self):
+        while True:
+            await asyncio.sleep(KEEPALIVE / 2)
+            self.writer.write(MQTTPacket.pingreq_packet())
+
+    # Sends messages on the open-loop schedule of the load profile, like MQTTClient.send_messages_loop.
+    async def send_messages_loop(self):
+        await self.subscribed.wait()
+        schedule_start = time.perf_counter()
+        if self.start_gate is not None:
+            schedule_start = await self.start_gate.wait_async()
+            await asyncio.sleep(max(0.0, schedule_start - time.perf_counter()))
+        for message_index, offset in self.load_profile.schedule():
+            if self.stop_event.is_set():
+                break
+            scheduled_time = schedule_start + offset
+            sleep_time = scheduled_time - time.perf_counter()
+            if sleep_time > 0:
+                await asyncio.sleep(sleep_time)
+            send_lag = (time.perf_counter() - scheduled_time) * 1000  # Milliseconds behind schedule.
+            self.send_message(self, self.topic, message_index, scheduled_time, send_lag)
+            self.sent_count += 1
+            if self.writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                await self.writer.drain()
+
+    # Received messages are stored right away, no processing thread.
+    def queue_result(self, item):
+        self.process_result(item)
+
+    # Run the whole test for this client on the running event loop.
+    async def run_async(self):
+        self.scheduler = LoopTimeoutScheduler(asyncio.get_running_loop())
+        self.start_time = time.perf_counter()
+        try:
+            await self.connect()
+            self.tasks = [asyncio.create_task(self.read_loop()), asyncio.create_task(self.keepalive_loop())]
+            await self.send_messages_loop()
+        except Exception as e:
+            logging.error(f"Client {self.client_id}: an error occurred: {e}")
+            self.stop_event.set()
+        finally:
+            await self.stop_async()
+
+    # Wait for messages in flight, check missing messages, cancel timeouts and disconnect.
+    async def stop_async(self):
+        deadline = time.perf_counter() + self.args.timeout
+        while self.tracker.in_flight and time.perf_counter() < deadline and not self.stop_event.is_set():
+            await asyncio.sleep(0.01)
+        self.verify_message_integrity()
+        if self.writer is not None and getattr(self.args, 'retain', False) and self.subscribed.is_set():
+            self.publish(self.topic, b"", retain=True) # Clear the retained message.
+        self.closing = True
+        for task in self.tasks:
+            task.cancel()
+        if self.writer is not None:
+            try:
+                self.writer.write(MQTTPacket.disconnect_packet())
+                await self.writer.drain()
+                self.writer.close()
+                await self.writer.wait_closed()
+            except (ConnectionError, ssl.SSLError) as e:
+                logging.debug(f"Error while disconnecting: {e}")
+        self.end_time = time.perf_counter()
+        logging.info("Disconnected from MQTT broker and cleaned up resources.")
+
+    def run(self):
+        asyncio.run(self.run_async())
+
+    # CTRL + C stops the sender, results collected so far are still stored.
+    def handle_signal(self, signal_number, frame):
+        print("Signal received, initiating graceful shutdown...")
+        self.stop_event.set()
+
+
+# Run many clients on one event loop and return their summaries and merged latency histograms.
+def run_async_clients(args, db, client_indices, collector=None, start_gate=None):
+    clients = [AsyncMQTTClient(args, db, client_index) for client_index in client_indices]
+    for mqtt_client in clients:
+        mqtt_client.start_gate = start_gate
+    if collector is not None:
+        collector.add_clients(clients)
+
+    # CTRL + C stops the sender loops, results collected so far are still stored.
+    def handle_signal(signal_number, frame):
+        for mqtt_client in clients:
+            mqtt_client.stop_event.set()
+    signal.signal(signal.SIGINT, handle_signal)
+
+    async def run_all():
+        await asyncio.gather(*(mqtt_client.run_async() for mqtt_client in clients))
+    asyncio.run(run_all())
+    histograms = HistogramSet()
+    for mqtt_client in clients:
+        histograms.merge(mqtt_client.histograms)
+    return [mqtt_client.summary() for mqtt_client in clients], histograms
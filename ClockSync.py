@@ -0,0 +1,49 @@
+import json
+import time
+from collections import deque
+
+    # Clock offset calibration between a subscriber and a publisher that may run on different hosts.
+    # The subscriber publishes a request with its clock (t0), the publisher answers with its own clock (t1)
+    # and the subscriber notes the arrival time (t2). Like NTP, the offset is t1 - (t0 + t2) / 2, and the
+    # sample with the shortest round trip of the recent ones is used, its error is at most half that round trip.
+    # Both sides use time.perf_counter, the clock of the send times in the message payloads.
+
+CLOCK_SAMPLES = 32 # Recent samples kept, so the estimate follows clock drift on long runs.
+
+
+def clock_request_payload():
+    return json.dumps({"t0": time.perf_counter()})
+
+
+def clock_response_payload(request_payload):
+    request = json.loads(bytes(request_payload).decode())
+    return json.dumps({"t0": request["t0"], "t1": time.perf_counter()})
+
+
+class ClockOffsetEstimator:
+    def __init__(self, samples=CLOCK_SAMPLES):
+        self.samples = deque(maxlen=samples) # (round trip, offset)
+        self.best = None
+
+    # Add the answer to a clock request, returns the current offset.
+    def add_response(self, response_payload):
+        receive_time = time.perf_counter()
+        response = json.loads(bytes(response_payload).decode())
+        round_trip = receive_time - response["t0"]
+        self.samples.append((round_trip, response["t1"] - (response["t0"] + receive_time) / 2))
+        self.best = min(self.samples)
+        return self.best[1]
+
+    @property
+    def calibrated(self):
+        return self.best is not None
+
+    # Seconds to add to a subscriber time to get the publisher time.
+    @property
+    def offset(self):
+        return self.best[1] if self.best is not None else 0.0
+
+    # Maximum error of the offset in seconds.
+    @property
+    def uncertainty(self):
+        return self.best[0] / 2 if self.best is not None else None
@@ -0,0 +1,235 @@
+import datetime
+import logging
+import random
+import signal
+import ssl
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import paho.mqtt.client as mqtt
+from MQTTClient import MQTTClient, generate_report, disable_nagle
+from LatencyHistogram import HistogramSet, histogram_path
+logger = logging.getLogger(__name__)
+
+    # Connection storm: opens and tears down --storm-connections connections at --storm-rate connections per second,
+    # --storm-burst connections at a time, like devices reconnecting after an outage. Nothing is published.
+    # Every connection is a paho client with the same protocol and TLS setup as MQTTClient (mqtt, mqtt over TLS on 8883,
+    # WebSockets), connected and driven with client.loop() on a pool thread, subscribed once and held --storm-hold seconds.
+    # Per connection the phases are timed:
+    #   transport:     connect() call until the socket is open (TCP connect, TLS handshake, WebSocket upgrade)
+    #   tls_handshake: the TLS handshake alone
+    #   connack:       CONNECT sent until CONNACK
+    #   connect_total: start of the connection until CONNACK
+    #   suback:        SUBSCRIBE until SUBACK
+    # Attempts are stored in the connections table with their CONNACK return code or error, phases go to the histogram file.
+
+STORM_PHASES = ("transport", "tls_handshake", "connack", "connect_total", "suback")
+LOOP_TIMEOUT = 0.01 # Seconds client.loop() waits for network events while waiting for an ack.
+
+handshake_times = threading.local() # Start and end of the last TLS handshake on this thread.
+
+
+# Times the handshake paho runs with sock.do_handshake() after wrapping the socket.
+class TimedSSLSocket(ssl.SSLSocket):
+    def do_handshake(self, block=False):
+        start = time.perf_counter()
+        super().do_handshake(block)
+        handshake_times.value = (start, time.perf_counter())
+
+
+class ConnectionAttempt:
+    __slots__ = ("index", "client_id", "scheduled_time", "start_lag", "socket_open", "connack", "suback", "return_code", "error", "times")
+
+    def __init__(self, index, client_id, scheduled_time):
+        self.index = index
+        self.client_id = client_id
+        self.scheduled_time = scheduled_time
+        self.start_lag = None
+        self.socket_open = None
+        self.connack = None
+        self.suback = None
+        self.return_code = None
+        self.error = None
+        self.times = {} # Phase -> ms
+
+    # CONNACK codes by name, other failures by exception name or timeout.
+    @property
+    def outcome(self):
+        if self.error is not None:
+            return self.error
+        return mqtt.connack_string(self.return_code)
+
+
+class ConnectionStorm:
+    ssl_check = MQTTClient.ssl_check # Same protocol and port checks as the message test.
+    exit_with_message = MQTTClient.exit_with_message
+
+    def __init__(self, args, db):
+        self.args = args
+        self.db = db
+        self.histograms = HistogramSet()
+        self.outcomes = Counter()
+        self.lock = threading.Lock()
+        self.rows = []
+        self.completed = 0
+        self.last_status_time = 0.0
+        self.stop_event = threading.Event()
+        self.ssl_check()
+        self.db.create_connections_table()
+
+    # Attempt index and offset from the start in seconds. Bursts of --storm-burst attempts, spaced to average --storm-rate.
+    def schedule(self):
+        burst = max(1, self.args.storm_burst)
+        for index in range(self.args.storm_connections):
+            yield index + 1, (index // burst) * burst / self.args.storm_rate
+
+    def create_client(self, attempt):
+        if self.args.protocol == 'ws':
+            client = mqtt.Client(attempt.client_id, clean_session=True, transport='websockets')
+            client.ws_set_options(path="/")
+        else:
+            client = mqtt.Client(attempt.client_id, clean_session=True)
+        if self.args.ssl_enabled:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE # Bypass certificate verification in test use, as MQTTClient does.
+            context.sslsocket_class = TimedSSLSocket
+            client.tls_set_context(context)
+            client.tls_insecure_set(True)
+        if self.args.username:
+            client.username_pw_set(self.args.username, self.args.password)
+
+        def on_socket_open(client, userdata, sock):
+            attempt.socket_open = time.perf_counter()
+            disable_nagle(client, userdata, sock)
+
+        def on_connect(client, userdata, flags, rc):
+            attempt.connack = time.perf_counter()
+            attempt.return_code = rc
+
+        def on_subscribe(client, userdata, mid, granted_qos):
+            attempt.suback = time.perf_counter()
+            if granted_qos and granted_qos[0] == 0x80:
+                attempt.error = "Subscribe refused"
+
+        client.on_socket_open = on_socket_open
+        client.on_connect = on_connect
+        client.on_subscribe = on_subscribe
+        return client
+
+    # Run client.loop() until the callback sets the field or the deadline passes.
+    def wait_for(self, client, attempt, field, deadline):
+        while getattr(attempt, field) is None and time.perf_counter() < deadline:
+            rc = client.loop(LOOP_TIMEOUT)
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                attempt.error = mqtt.error_string(rc)
+                return False
+        return getattr(attempt, field) is not None
+
+    # Runs on a pool thread. Nothing reads the futures, so every attempt is stored here, also when it raised.
+    def run_attempt(self, attempt, schedule_start):
+        try:
+            self.connect_attempt(attempt, schedule_start)
+        except Exception as e:
+            attempt.error = type(e).__name__
+            logging.debug(f"Connection {attempt.index} failed: {e}")
+        finally:
+            self.store_attempt(attempt)
+
+    # One connection: connect, CONNACK, subscribe, SUBACK, hold, disconnect.
+    def connect_attempt(self, attempt, schedule_start):
+        start = time.perf_counter()
+        attempt.start_lag = (start - schedule_start - attempt.scheduled_time) * 1000
+        handshake_times.value = None
+        client = self.create_client(attempt)
+        deadline = start + self.args.timeout
+        try:
+            client.connect(self.args.host, self.args.port, keepalive=60)
+        except Exception as e:
+            attempt.error = type(e).__name__
+            logging.debug(f"Connection {attempt.index} failed: {e}")
+        try:
+            if handshake_times.value is not None:
+                attempt.times["tls_handshake"] = (handshake_times.value[1] - handshake_times.value[0]) * 1000
+            if attempt.error is None:
+                attempt.times["transport"] = (attempt.socket_open - start) * 1000
+                if not self.wait_for(client, attempt, "connack", deadline):
+                    attempt.error = attempt.error or "CONNACK timeout"
+                elif attempt.return_code == 0:
+                    attempt.times["connack"] = (attempt.connack - attempt.socket_open) * 1000
+                    attempt.times["connect_total"] = (attempt.connack - start) * 1000
+                    subscribe_time = time.perf_counter()
+                    client.subscribe(f"{self.args.topic}/storm/{attempt.index}", 0)
+                    if self.wait_for(client, attempt, "suback", subscribe_time + self.args.timeout):
+                        attempt.times["suback"] = (attempt.suback - subscribe_time) * 1000
+                    else:
+                        attempt.error = attempt.error or "SUBACK timeout"
+                    hold_until = time.perf_counter() + self.args.storm_hold
+                    while time.perf_counter() < hold_until and not self.stop_event.is_set():
+                        if client.loop(max(0.0, min(0.1, hold_until - time.perf_counter()))) != mqtt.MQTT_ERR_SUCCESS:
+                            attempt.error = "Dropped during hold"
+                            break
+                    client.disconnect()
+        finally:
+            try:
+                client.loop(LOOP_TIMEOUT) # Flush DISCONNECT.
+            except Exception:
+                pass
+            if client.socket() is not None:
+                client.socket().close()
+
+    def store_attempt(self, attempt):
+        with self.lock:
+            for phase, value in attempt.times.items():
+                self.histograms.get(phase).record(value)
+            self.outcomes[attempt.outcome] += 1
+            self.rows.append((attempt.index, attempt.client_id, attempt.scheduled_time, attempt.start_lag,
+                              *(attempt.times.get(phase) for phase in STORM_PHASES), attempt.return_code, attempt.error))
+            self.completed += 1
+            if len(self.rows) >= 100:
+                self.db.insert_connections(self.rows)
+                self.rows = []
+            self.update_status(force=self.completed == self.args.storm_connections)
+
+    def update_status(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_status_time < self.args.status_interval:
+            return
+        self.last_status_time = now
+        sys.stdout.write(f"\r\033[KConnections {self.completed}/{self.args.storm_connections}, successful {self.outcomes[mqtt.connack_string(0)]}. ")
+        sys.stdout.flush()
+
+    def run(self):
+        start_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        print(f"Beginning connection storm at {start_time}: {self.args.storm_connections} {self.args.protocol} connections "
+              f"at {self.args.storm_rate:g} conn/s in bursts of {max(1, self.args.storm_burst)}, held {self.args.storm_hold:g} s.")
+        signal.signal(signal.SIGINT, lambda signal_number, frame: self.stop_event.set())
+        prefix = f"{self.args.client_id}{random.randint(100, 999)}-storm"
+        with ThreadPoolExecutor(max_workers=self.args.storm_concurrency, thread_name_prefix="Storm") as executor:
+            schedule_start = time.perf_counter()
+            for index, offset in self.schedule():
+                if self.stop_event.wait(max(0.0, schedule_start + offset - time.perf_counter())):
+                    break
+                executor.submit(self.run_attempt, ConnectionAttempt(index, f"{prefix}-{index}", offset), schedule_start)
+        duration = time.perf_counter() - schedule_start
+        with self.lock:
+            if self.rows:
+                self.db.insert_connections(self.rows)
+                self.rows = []
+        self.histograms.save(histogram_path(self.db.db_file))
+        print()
+        self.print_results(duration)
+        generate_report(self.args, self.db.db_file)
+        end_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        print(f"Ending connection storm at {end_time}.")
+
+    def print_results(self, duration):
+        print(f"{self.completed} connections in {duration:.1f} s ({self.completed / duration if duration > 0 else 0:.1f} conn/s).")
+        for phase in STORM_PHASES:
+            summary = self.histograms.get(phase).summary()
+            if summary:
+                print(f"{phase.replace('_', ' ').capitalize()} latency " + ", ".join(f"{key} {value:.3f}" for key, value in summary.items()))
+        for outcome, count in self.outcomes.most_common():
+            print(f"{count:>8}  {outcome}")
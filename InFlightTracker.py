@@ -0,0 +1,134 @@
+import logging
+logger = logging.getLogger(__name__)
+
+    # Tracks the messages of one client with memory that does not grow with the length of the run.
+    # Only outstanding messages (sent, not yet received or timed out) are kept in a dict.
+    # Resolved messages are remembered as one received bit and one timed out bit in two ring bitmaps that cover
+    # the last `window` message indices, which is enough to tell a duplicate from a late arrival.
+    # Loss (timeouts), duplicates, late arrivals after a timeout and reordering are counted as messages arrive,
+    # so no set difference is needed at the end of the run.
+    # Not thread-safe, MQTTClient calls it under its lock.
+
+DEFAULT_WINDOW = 65536 # Message indices, 16 KB of bitmaps.
+
+
+# Per-message state kept while the message is in flight.
+class InFlightMessage:
+    __slots__ = ('publish_datetime', 'scheduled_time', 'send_lag', 'timer', 'stages')
+
+    def __init__(self, publish_datetime, scheduled_time=None, send_lag=None, stages=None):
+        self.publish_datetime = publish_datetime
+        self.scheduled_time = scheduled_time
+        self.send_lag = send_lag
+        self.timer = None
+        self.stages = stages # [send time, encoded, publish() returned] with --stage-timing.
+
+
+class InFlightTracker:
+    def __init__(self, window=DEFAULT_WINDOW):
+        if window < 8 or window % 8:
+            raise ValueError(f"In-flight window must be a positive multiple of 8: {window}")
+        self.window = window
+        self.outstanding = {} # Message index -> InFlightMessage.
+        self.received_bits = bytearray(window // 8)
+        self.timed_out_bits = bytearray(window // 8)
+        self.base = 0 # Lowest message index covered by the bitmaps.
+        self.highest_sent = 0 # Message indices start at 1.
+        self.highest_received = -1
+        self.received = 0
+        self.timed_out = 0
+        self.duplicates = 0
+        self.late = 0 # Received after their timeout.
+        self.reordered = 0 # Received after a message with a higher index.
+
+    @property
+    def in_flight(self):
+        return len(self.outstanding)
+
+    def get(self, message_index):
+        return self.outstanding.get(message_index)
+
+    def add(self, message_index, message):
+        if message_index >= self.base + self.window:
+            self.slide(message_index - self.window + 1)
+        self.highest_sent = max(self.highest_sent, message_index)
+        self.outstanding[message_index] = message
+
+    # Track every index up to message_index as sent, for a subscriber that does not see the sends.
+    def expect(self, message_index):
+        for index in range(self.highest_sent + 1, message_index + 1):
+            self.add(index, InFlightMessage(None))
+
+    # Move the window so that it starts at new_base, clearing the bits of the indices that leave it.
+    def slide(self, new_base):
+        if new_base - self.base >= self.window:
+            self.received_bits[:] = bytes(len(self.received_bits))
+            self.timed_out_bits[:] = bytes(len(self.timed_out_bits))
+        else:
+            for message_index in range(self.base, new_base):
+                self.clear_bit(self.received_bits, message_index)
+                self.clear_bit(self.timed_out_bits, message_index)
+        self.base = new_base
+
+    # Returns the InFlightMessage of a first delivery, None for a duplicate, late or unknown message.
+    def receive(self, message_index):
+        message = self.outstanding.pop(message_index, None)
+        if message is not None:
+            self.received += 1
+            if message_index < self.highest_received:
+                self.reordered += 1
+            else:
+                self.highest_received = message_index
+            self.set_bit(self.received_bits, message_index)
+        elif message_index < self.base:
+            self.duplicates += 1 # Older than the window, a duplicate or a late arrival.
+        elif self.test_bit(self.received_bits, message_index):
+            self.duplicates += 1
+        elif self.test_bit(self.timed_out_bits, message_index):
+            self.late += 1
+        else:
+            logging.debug(f"Received message {message_index} that was not sent in this run.")
+        return message
+
+    # Returns the InFlightMessage when the message was still outstanding, None when it already arrived.
+    def time_out(self, message_index):
+        message = self.outstanding.pop(message_index, None)
+        if message is not None:
+            self.timed_out += 1
+            self.set_bit(self.timed_out_bits, message_index)
+        return message
+
+    # Forget a message that could not be published.
+    def discard(self, message_index):
+        return self.outstanding.pop(message_index, None)
+
+    # Remove and return every outstanding message, in index order. Arrivals after this are counted as late.
+    def drain(self):
+        missing = sorted(self.outstanding.items())
+        self.outstanding.clear()
+        for message_index, message in missing:
+            self.set_bit(self.timed_out_bits, message_index)
+        return missing
+
+    def counters(self):
+        return {
+            "received": self.received,
+            "timed_out": self.timed_out,
+            "in_flight": self.in_flight,
+            "duplicates": self.duplicates,
+            "late": self.late,
+            "reordered": self.reordered,
+        }
+
+    def set_bit(self, bits, message_index):
+        if message_index >= self.base:
+            slot = message_index % self.window
+            bits[slot >> 3] |= 1 << (slot & 7)
+
+    def clear_bit(self, bits, message_index):
+        slot = message_index % self.window
+        bits[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+
+    def test_bit(self, bits, message_index):
+        slot = message_index % self.window
+        return bool(bits[slot >> 3] & (1 << (slot & 7)))
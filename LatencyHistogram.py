@@ -0,0 +1,171 @@
+import json
+import math
+import os
+
+    # Log-bucketed (HDR-style) latency histogram with constant memory.
+    # Values are recorded in milliseconds and stored as integer microseconds. Every power of two range is split
+    # into 2^(sub_bucket_bits - 1) linear buckets, so the relative error of any reported value stays below
+    # 1 / 2^(sub_bucket_bits - 1) (under 1% with the default 8 bits) whatever the number of recorded values.
+    # A run saves a HistogramSet (named histograms, "delivery" for end-to-end delay) as JSON next to the SQLite results file.
+
+PERCENTILES = (50, 90, 99, 99.9, 99.99)
+
+
+# Histogram file that belongs to a results database.
+def histogram_path(db_path):
+    return f"{os.path.splitext(db_path)[0]}.hdr.json"
+
+
+class LatencyHistogram:
+    def __init__(self, sub_bucket_bits=8):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.half_bucket_count = 1 << (sub_bucket_bits - 1)
+        self.counts = []
+        self.count = 0
+        self.total = 0 # Sum of recorded microseconds, for the mean.
+        self.min = None
+        self.max = None
+
+    def bucket_index(self, value):
+        exponent = max(value.bit_length() - self.sub_bucket_bits, 0)
+        return exponent * self.half_bucket_count + (value >> exponent)
+
+    # Highest value in microseconds that falls into the bucket.
+    def bucket_value(self, index):
+        if index < 2 * self.half_bucket_count:
+            return index
+        exponent = index // self.half_bucket_count - 1
+        mantissa = index - exponent * self.half_bucket_count
+        return ((mantissa + 1) << exponent) - 1
+
+    def record(self, value_ms, count=1):
+        value = max(int(round(value_ms * 1000)), 0)
+        index = self.bucket_index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("Cannot merge histograms with different precision.")
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, bucket_count in enumerate(other.counts):
+            self.counts[index] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def reset(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    # Value in milliseconds below or at which the given percentage of recorded values fall.
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        target = max(math.ceil(percent / 100 * self.count), 1)
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return min(self.bucket_value(index), self.max) / 1000
+        return self.max / 1000
+
+    def mean(self):
+        return self.total / self.count / 1000 if self.count else None
+
+    # Min, max, mean and percentiles in milliseconds.
+    def summary(self):
+        if not self.count:
+            return {}
+        summary = {'Min (ms)': self.min / 1000, 'Max (ms)': self.max / 1000, 'Average (ms)': self.mean()}
+        for percent in PERCENTILES:
+            summary[f'p{percent:g} (ms)'] = self.percentile(percent)
+        return summary
+
+    # (upper bound in ms, count) for every non-empty bucket, for plotting.
+    def buckets(self):
+        return [(self.bucket_value(index) / 1000, bucket_count) for index, bucket_count in enumerate(self.counts) if bucket_count]
+
+    def to_dict(self):
+        return {
+            "sub_bucket_bits": self.sub_bucket_bits,
+            "unit": "us",
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "counts": [[index, bucket_count] for index, bucket_count in enumerate(self.counts) if bucket_count],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data["sub_bucket_bits"])
+        for index, bucket_count in data["counts"]:
+            if index >= len(histogram.counts):
+                histogram.counts.extend([0] * (index + 1 - len(histogram.counts)))
+            histogram.counts[index] = bucket_count
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+    def save(self, path):
+        with open(path, "w") as histogram_file:
+            json.dump(self.to_dict(), histogram_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as histogram_file:
+            return cls.from_dict(json.load(histogram_file))
+
+
+# Named histograms of one run, saved together in one file.
+class HistogramSet:
+    def __init__(self):
+        self.histograms = {}
+
+    # Histogram with the given name, created on first use.
+    def get(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram()
+        return self.histograms[name]
+
+    def names(self):
+        return sorted(self.histograms)
+
+    def merge(self, other):
+        for name, histogram in other.histograms.items():
+            self.get(name).merge(histogram)
+
+    def to_dict(self):
+        return {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram_set = cls()
+        for name, histogram_data in data.items():
+            histogram_set.histograms[name] = LatencyHistogram.from_dict(histogram_data)
+        return histogram_set
+
+    def save(self, path):
+        with open(path, "w") as histogram_file:
+            json.dump(self.to_dict(), histogram_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as histogram_file:
+            return cls.from_dict(json.load(histogram_file))
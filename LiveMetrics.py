@@ -0,0 +1,199 @@
+import json
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from LatencyHistogram import LatencyHistogram
+logger = logging.getLogger(__name__)
+
+    # Live metrics during a run.
+    # MetricsCollector gathers counters from the clients of this process and from snapshots sent by worker processes.
+    # LiveMetrics turns them into interval statistics every --stats-interval seconds: a console line, an optional
+    # JSONL line and an optional local HTTP endpoint in Prometheus text format (--metrics-port).
+    # Latency percentiles are rolling, computed from the messages received during the last interval.
+
+
+class MetricsCollector:
+    def __init__(self, db=None):
+        self.db = db
+        self.clients = []
+        self.remote_snapshots = {} # Latest cumulative snapshot of every worker process.
+        self.remote_histogram = LatencyHistogram() # Worker latency received since the last snapshot().
+        self.lock = threading.Lock()
+
+    def add_clients(self, clients):
+        with self.lock:
+            self.clients.extend(clients)
+
+    # Called in the parent process with a snapshot forwarded by a worker.
+    def update_remote(self, worker_id, snapshot):
+        with self.lock:
+            self.remote_histogram.merge(LatencyHistogram.from_dict(snapshot.pop("histogram")))
+            self.remote_snapshots[worker_id] = snapshot
+
+    # Cumulative counters of the worker processes. Leaves the interval histogram to snapshot().
+    def remote_totals(self):
+        with self.lock:
+            snapshots = list(self.remote_snapshots.values())
+        return {key: sum(snapshot[key] for snapshot in snapshots) for key in ("sent", "received", "timed_out", "in_flight")}
+
+    # Cumulative counters, current gauges and a histogram of the latency received since the previous call.
+    def snapshot(self):
+        totals = {"sent": 0, "received": 0, "timed_out": 0, "duplicates": 0, "late": 0, "reordered": 0, "in_flight": 0, "queue_depth": 0}
+        histogram = LatencyHistogram()
+        with self.lock:
+            clients = list(self.clients)
+            for snapshot in self.remote_snapshots.values():
+                for key in totals:
+                    totals[key] += snapshot[key]
+            histogram.merge(self.remote_histogram)
+            self.remote_histogram = LatencyHistogram()
+        for mqtt_client in clients:
+            client_snapshot = mqtt_client.metrics_snapshot()
+            histogram.merge(client_snapshot.pop("histogram"))
+            for key in totals:
+                totals[key] += client_snapshot[key]
+        if self.db is not None:
+            totals["queue_depth"] += self.db.queue_depth()
+        totals["histogram"] = histogram
+        return totals
+
+
+class LiveMetrics:
+    def __init__(self, collector, interval=5.0, print_stats=True, jsonl_path=None, port=None, host="127.0.0.1"):
+        self.collector = collector
+        self.interval = interval
+        self.elapsed_decimals = len(f"{interval:f}".rstrip("0").partition(".")[2]) # Sub-second intervals print distinct elapsed labels.
+        self.print_stats = print_stats
+        self.jsonl_path = jsonl_path
+        self.port = port
+        self.host = host
+        self.latest = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.server = None
+
+    @classmethod
+    def from_args(cls, collector, args):
+        if not args.stats_interval and not args.metrics_port:
+            return None
+        return cls(collector, interval=args.stats_interval or 5.0, print_stats=bool(args.stats_interval),
+                   jsonl_path=args.stats_file, port=args.metrics_port, host=args.metrics_host)
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.last_time = self.start_time
+        self.last_received = 0
+        self.last_sent = 0
+        if self.port:
+            self.start_server()
+        self.thread = threading.Thread(target=self.run, name="LiveMetrics", daemon=True)
+        self.thread.start()
+
+    # The run continues without the endpoint when the port is in use.
+    def start_server(self):
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), self.request_handler())
+        except OSError as e:
+            logging.error(f"Metrics port {self.host}:{self.port} in use or unavailable ({e}), running without the metrics endpoint.")
+            return
+        threading.Thread(target=self.server.serve_forever, name="MetricsHTTP", daemon=True).start()
+        logging.info(f"Metrics endpoint at http://{self.host}:{self.port}/metrics")
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.collect()
+
+    # Compute one interval of statistics and publish it.
+    def collect(self):
+        snapshot = self.collector.snapshot()
+        histogram = snapshot.pop("histogram")
+        now = time.monotonic()
+        elapsed = max(now - self.last_time, 1e-9)
+        stats = {
+            "timestamp": time.time(),
+            "elapsed": round(now - self.start_time, 3),
+            **snapshot,
+            "sent_per_second": round((snapshot["sent"] - self.last_sent) / elapsed, 2),
+            "received_per_second": round((snapshot["received"] - self.last_received) / elapsed, 2),
+            "p50_ms": histogram.percentile(50),
+            "p99_ms": histogram.percentile(99),
+        }
+        self.last_time = now
+        self.last_sent = snapshot["sent"]
+        self.last_received = snapshot["received"]
+        self.latest = stats
+        if self.print_stats:
+            self.print_line(stats)
+        if self.jsonl_path:
+            try:
+                with open(self.jsonl_path, "a") as stats_file:
+                    stats_file.write(json.dumps(stats) + "\n")
+            except OSError as e:
+                logging.error(f"Could not write statistics to {self.jsonl_path}: {e}")
+
+    # Written on its own line so the status line of SQLiteDB continues below it.
+    def print_line(self, stats):
+        p50 = "N/A" if stats["p50_ms"] is None else f"{stats['p50_ms']:.3f}"
+        p99 = "N/A" if stats["p99_ms"] is None else f"{stats['p99_ms']:.3f}"
+        sys.stdout.write('\r\033[K')
+        sys.stdout.write(f"[{stats['elapsed']:.{self.elapsed_decimals}f}s] sent {stats['sent']} received {stats['received']} timed out {stats['timed_out']} | "
+                         f"{stats['received_per_second']:.1f} msgs/s | in flight {stats['in_flight']} queue {stats['queue_depth']} | "
+                         f"p50 {p50} ms p99 {p99} ms\n")
+        sys.stdout.flush()
+
+    # Prometheus text exposition format.
+    def prometheus_text(self):
+        stats = self.latest
+        if not stats:
+            return ""
+        lines = []
+        def metric(name, metric_type, help_text, value, labels=""):
+            lines.append(f"# HELP mqtt_tester_{name} {help_text}")
+            lines.append(f"# TYPE mqtt_tester_{name} {metric_type}")
+            lines.append(f"mqtt_tester_{name}{labels} {value}")
+        metric("messages_sent_total", "counter", "Messages published.", stats["sent"])
+        metric("messages_received_total", "counter", "Messages received back.", stats["received"])
+        metric("messages_timed_out_total", "counter", "Messages that timed out.", stats["timed_out"])
+        metric("messages_duplicate_total", "counter", "Messages received more than once.", stats["duplicates"])
+        metric("messages_late_total", "counter", "Messages received after their timeout.", stats["late"])
+        metric("messages_reordered_total", "counter", "Messages received after a message sent later.", stats["reordered"])
+        metric("messages_per_second", "gauge", "Messages received per second during the last interval.", stats["received_per_second"])
+        metric("in_flight_messages", "gauge", "Messages waiting for their reply or timeout.", stats["in_flight"])
+        metric("queue_depth", "gauge", "Received messages and results waiting to be stored.", stats["queue_depth"])
+        lines.append("# HELP mqtt_tester_latency_ms Message delay during the last interval.")
+        lines.append("# TYPE mqtt_tester_latency_ms gauge")
+        for quantile, key in (("0.5", "p50_ms"), ("0.99", "p99_ms")):
+            value = "NaN" if stats[key] is None else stats[key]
+            lines.append(f'mqtt_tester_latency_ms{{quantile="{quantile}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def request_handler(self):
+        live_metrics = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = live_metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        return MetricsRequestHandler
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.collect() # Final totals.
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
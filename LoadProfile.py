@@ -0,0 +1,79 @@
+import math
+
+    # Open-loop send schedule for the load tester.
+    # Every message gets an absolute send deadline measured from the start of the run, independent of how long
+    # publishing the previous messages took. A sender that falls behind does not sleep until it has caught up,
+    # so the target rate is kept and the lag of every send can be recorded (no coordinated omission).
+    # Profiles: constant, ramp (start rate to rate over ramp-up), step (start rate plus step rate every step duration),
+    # spike (rate with spike rate during the spike window) and soak (constant rate for a fixed duration).
+
+PROFILES = ("constant", "ramp", "step", "spike", "soak")
+
+
+class LoadProfile:
+    def __init__(self, profile="constant", rate=1.0, message_count=10, duration=None, start_rate=1.0,
+                 ramp_up=0.0, step_rate=None, step_duration=10.0, spike_rate=None, spike_start=0.0, spike_duration=0.0):
+        if profile not in PROFILES:
+            raise ValueError(f"Unsupported load profile: {profile}")
+        if rate is None or rate <= 0:
+            raise ValueError("Rate must be greater than 0 messages per second.")
+        if profile == "soak" and not duration:
+            raise ValueError("Soak profile needs --duration.")
+        if profile == "step" and (not step_rate or step_duration <= 0):
+            raise ValueError("Step profile needs --step-rate and a positive --step-duration.")
+        if profile == "spike" and (not spike_rate or spike_duration <= 0):
+            raise ValueError("Spike profile needs --spike-rate and a positive --spike-duration.")
+        self.profile = profile
+        self.rate = rate
+        self.message_count = message_count
+        self.duration = duration # When set, the run lasts this many seconds and message_count is ignored.
+        self.start_rate = max(start_rate, 1e-3)
+        self.ramp_up = ramp_up
+        self.step_rate = step_rate
+        self.step_duration = step_duration
+        self.spike_rate = spike_rate
+        self.spike_start = spike_start
+        self.spike_duration = spike_duration
+
+    @classmethod
+    def from_args(cls, args):
+        rate = args.rate
+        if rate is None:
+            if args.interval <= 0:
+                raise ValueError("Interval must be greater than 0, use --rate for very high message rates.")
+            rate = 1.0 / args.interval
+        return cls(profile=args.profile, rate=rate, message_count=args.message_count, duration=args.duration,
+                   start_rate=args.start_rate, ramp_up=args.ramp_up, step_rate=args.step_rate, step_duration=args.step_duration,
+                   spike_rate=args.spike_rate, spike_start=args.spike_start, spike_duration=args.spike_duration)
+
+    # Target rate in messages per second at t seconds from the start of the run.
+    def rate_at(self, t):
+        if self.profile == "ramp":
+            if self.ramp_up > 0 and t < self.ramp_up:
+                return self.start_rate + (self.rate - self.start_rate) * t / self.ramp_up
+            return self.rate
+        if self.profile == "step":
+            return min(self.rate, self.start_rate + self.step_rate * math.floor(t / self.step_duration))
+        if self.profile == "spike":
+            if self.spike_start <= t < self.spike_start + self.spike_duration:
+                return self.spike_rate
+            return self.rate
+        return self.rate
+
+    # Yields (message index, send offset in seconds from the start of the run).
+    def schedule(self):
+        offset = 0.0
+        message_index = 1
+        while True:
+            if self.duration:
+                if offset >= self.duration:
+                    return
+            elif message_index > self.message_count:
+                return
+            yield message_index, offset
+            offset += 1.0 / self.rate_at(offset)
+            message_index += 1
+
+    def describe(self):
+        amount = f"for {self.duration} seconds" if self.duration else f"{self.message_count} messages"
+        return f"{amount} with {self.profile} profile at {self.rate:g} msgs/s"
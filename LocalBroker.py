@@ -0,0 +1,347 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import logging
+import signal
+import struct
+from paho.mqtt.client import topic_matches_sub
+import MQTTPacket
+logger = logging.getLogger(__name__)
+
+    # Local MQTT 3.1.1 broker stand-in, to measure the tester's own ceiling without the broker from .env.
+    # One asyncio event loop serves MQTT over TCP and, with a WebSocket port, MQTT over WebSockets (subprotocol "mqtt",
+    # binary frames). CONNECT, SUBSCRIBE / UNSUBSCRIBE with + and # filters, PUBLISH QoS 0, 1 and 2 in both directions,
+    # retained messages, PINGREQ and DISCONNECT are handled. Every session is a clean session, keepalive is not enforced,
+    # there is no authentication, will message or TLS and unacknowledged deliveries are not retried.
+    # delivery_delay holds every delivery for that many seconds, so messages stay in flight in the tester (memory benchmark).
+    # Run standalone with: python MQTTLoadTester.py broker --port 1883 --ws-port 8080
+
+WRITE_BUFFER_LIMIT = 256 * 1024 # A publisher waits while a subscriber has more than this buffered, like TCP backpressure.
+CONNECT_TIMEOUT = 10 # Seconds a new connection has to send CONNECT.
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+# MQTT packets over WebSocket frames, with the readexactly() of a StreamReader for MQTTPacket.read_packet.
+class WebSocketReader:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.buffer = bytearray()
+
+    async def readexactly(self, n):
+        while len(self.buffer) < n:
+            await self.read_frame()
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def read_frame(self):
+        header = await self.reader.readexactly(2)
+        opcode = header[0] & 0x0F
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+        mask = await self.reader.readexactly(4) if header[1] & 0x80 else None
+        payload = await self.reader.readexactly(length) if length else b""
+        if mask:
+            payload = unmask(payload, mask)
+        if opcode == 0x8:
+            raise ConnectionError("WebSocket closed by the client.")
+        if opcode == 0x9:
+            self.writer.write(websocket_frame(0xA, payload))
+        elif opcode in (0x0, 0x1, 0x2): # Continuation, text and binary frames all carry MQTT bytes.
+            self.buffer.extend(payload)
+
+
+# Writes every MQTT packet as one binary frame. Server frames are not masked.
+class WebSocketWriter:
+    def __init__(self, writer):
+        self.writer = writer
+        self.transport = writer.transport
+
+    def write(self, data):
+        self.writer.write(websocket_frame(0x2, data))
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+    async def wait_closed(self):
+        await self.writer.wait_closed()
+
+
+def websocket_frame(opcode, payload):
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        header = bytes([0x80 | opcode, 126]) + struct.pack("!H", length)
+    else:
+        header = bytes([0x80 | opcode, 127]) + struct.pack("!Q", length)
+    return header + payload
+
+
+# XOR with the 4 byte mask as one big integer, much faster than per byte for large payloads.
+def unmask(payload, mask):
+    length = len(payload)
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(length, "big")
+
+
+# Answer the HTTP upgrade request. Returns False when it is not a WebSocket request.
+async def websocket_handshake(reader, writer):
+    request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), CONNECT_TIMEOUT)
+    headers = {}
+    for line in request.decode("latin-1").split("\r\n")[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    key = headers.get("sec-websocket-key")
+    if headers.get("upgrade", "").lower() != "websocket" or not key:
+        writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+        return False
+    accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+    protocols = [protocol.strip() for protocol in headers.get("sec-websocket-protocol", "").split(",")]
+    writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Accept: {accept}\r\n"
+                  + ("Sec-WebSocket-Protocol: mqtt\r\n" if "mqtt" in protocols else "") + "\r\n").encode())
+    return True
+
+
+class BrokerSession:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = None
+        self.subscriptions = {} # Topic filter -> granted QoS.
+        self.awaiting_release = set() # Packet ids of incoming QoS 2 publishes until PUBREL, delivered only once.
+        self.last_packet_id = 0
+        self.closed = False
+
+    def next_packet_id(self):
+        self.last_packet_id = self.last_packet_id % 65535 + 1
+        return self.last_packet_id
+
+    def deliver(self, topic, payload, qos, retain=False):
+        if self.closed:
+            return
+        self.writer.write(MQTTPacket.publish_packet(topic, payload, qos, self.next_packet_id() if qos else None, retain=retain))
+        self.broker.messages_out += 1
+
+    def backlogged(self):
+        return not self.closed and self.writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT
+
+    async def run(self):
+        try:
+            packet_type, flags, body = await asyncio.wait_for(MQTTPacket.read_packet(self.reader), CONNECT_TIMEOUT)
+            if packet_type != MQTTPacket.CONNECT:
+                raise MQTTPacket.MQTTProtocolError("First packet is not CONNECT.")
+            protocol_name, protocol_level, connect_flags, keepalive, client_id = MQTTPacket.parse_connect(body)
+            if protocol_name != "MQTT" or protocol_level != 4:
+                self.writer.write(MQTTPacket.connack_packet(1)) # Unacceptable protocol version.
+                return
+            self.client_id = client_id or f"local-broker-{id(self)}"
+            self.broker.register(self)
+            self.writer.write(MQTTPacket.connack_packet(0))
+            while True:
+                packet_type, flags, body = await MQTTPacket.read_packet(self.reader)
+                if packet_type == MQTTPacket.PUBLISH:
+                    await self.handle_publish(flags, body)
+                elif packet_type == MQTTPacket.PUBREL:
+                    packet_id = MQTTPacket.parse_packet_id(body)
+                    self.awaiting_release.discard(packet_id)
+                    self.writer.write(MQTTPacket.ack_packet(MQTTPacket.PUBCOMP, packet_id))
+                elif packet_type == MQTTPacket.PUBREC: # Second step of a QoS 2 delivery to this client.
+                    self.writer.write(MQTTPacket.ack_packet(MQTTPacket.PUBREL, MQTTPacket.parse_packet_id(body)))
+                elif packet_type == MQTTPacket.SUBSCRIBE:
+                    packet_id, subscriptions = MQTTPacket.parse_subscribe(body)
+                    granted = [self.broker.subscribe(self, topic_filter, qos) for topic_filter, qos in subscriptions]
+                    self.writer.write(MQTTPacket.suback_packet(packet_id, granted))
+                    for topic_filter, qos in subscriptions:
+                        self.broker.send_retained(self, topic_filter, qos)
+                elif packet_type == MQTTPacket.UNSUBSCRIBE:
+                    packet_id, topic_filters = MQTTPacket.parse_unsubscribe(body)
+                    for topic_filter in topic_filters:
+                        self.broker.unsubscribe(self, topic_filter)
+                    self.writer.write(MQTTPacket.unsuback_packet(packet_id))
+                elif packet_type == MQTTPacket.PINGREQ:
+                    self.writer.write(MQTTPacket.pingresp_packet())
+                elif packet_type == MQTTPacket.DISCONNECT:
+                    return
+                # PUBACK and PUBCOMP of deliveries need no action, nothing is retried.
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, MQTTPacket.MQTTProtocolError, struct.error) as e:
+            logging.debug(f"Connection of {self.client_id} closed: {e}")
+        finally:
+            self.close()
+
+    async def handle_publish(self, flags, body):
+        topic, payload, qos, packet_id, retain = MQTTPacket.parse_publish(flags, body)
+        self.broker.messages_in += 1
+        if qos == 1:
+            self.writer.write(MQTTPacket.ack_packet(MQTTPacket.PUBACK, packet_id))
+        elif qos == 2:
+            self.writer.write(MQTTPacket.ack_packet(MQTTPacket.PUBREC, packet_id))
+            if packet_id in self.awaiting_release: # Resent before PUBREL, already delivered.
+                return
+            self.awaiting_release.add(packet_id)
+        for session in self.broker.publish(topic, bytes(payload), qos, retain):
+            if session.backlogged():
+                await session.writer.drain()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.broker.unregister(self)
+        self.writer.close()
+
+
+class LocalBroker:
+    def __init__(self, host="127.0.0.1", port=1883, ws_port=None, delivery_delay=0.0):
+        self.host = host
+        self.port = port # 0 binds a free port, the bound port is set by start().
+        self.ws_port = ws_port # None serves no WebSockets.
+        self.delivery_delay = delivery_delay
+        self.sessions = {} # Client id -> BrokerSession.
+        self.exact_subscriptions = {} # Topic -> {session: QoS}, looked up directly.
+        self.wildcard_subscriptions = {} # Filter with + or # -> {session: QoS}, matched against every topic.
+        self.retained = {} # Topic -> (payload, QoS).
+        self.servers = []
+        self.messages_in = 0
+        self.messages_out = 0
+
+    async def start(self):
+        server = await asyncio.start_server(self.handle_tcp, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self.servers.append(server)
+        if self.ws_port is not None:
+            ws_server = await asyncio.start_server(self.handle_websocket, self.host, self.ws_port)
+            self.ws_port = ws_server.sockets[0].getsockname()[1]
+            self.servers.append(ws_server)
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        for session in list(self.sessions.values()):
+            session.close()
+
+    def describe(self):
+        return f"mqtt://{self.host}:{self.port}" + (f" and ws://{self.host}:{self.ws_port}/" if self.ws_port is not None else "")
+
+    async def handle_tcp(self, reader, writer):
+        await BrokerSession(self, reader, writer).run()
+
+    async def handle_websocket(self, reader, writer):
+        try:
+            upgraded = await websocket_handshake(reader, writer)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError) as e:
+            logging.debug(f"WebSocket handshake failed: {e}")
+            upgraded = False
+        if not upgraded:
+            writer.close()
+            return
+        await BrokerSession(self, WebSocketReader(reader, writer), WebSocketWriter(writer)).run()
+
+    # A second connection with the same client id takes over, the old one is closed.
+    def register(self, session):
+        previous = self.sessions.get(session.client_id)
+        if previous is not None:
+            previous.close()
+        self.sessions[session.client_id] = session
+
+    def unregister(self, session):
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+        for topic_filter in list(session.subscriptions):
+            self.unsubscribe(session, topic_filter)
+
+    # Returns the granted QoS, 0x80 for an invalid filter.
+    def subscribe(self, session, topic_filter, qos):
+        if not valid_filter(topic_filter):
+            return 0x80
+        subscriptions = self.wildcard_subscriptions if any(character in topic_filter for character in "+#") else self.exact_subscriptions
+        subscriptions.setdefault(topic_filter, {})[session] = qos
+        session.subscriptions[topic_filter] = qos
+        return qos
+
+    def unsubscribe(self, session, topic_filter):
+        session.subscriptions.pop(topic_filter, None)
+        for subscriptions in (self.exact_subscriptions, self.wildcard_subscriptions):
+            sessions = subscriptions.get(topic_filter)
+            if sessions is not None:
+                sessions.pop(session, None)
+                if not sessions:
+                    del subscriptions[topic_filter]
+
+    def send_retained(self, session, topic_filter, qos):
+        for topic, (payload, retained_qos) in self.retained.items():
+            if topic_matches_sub(topic_filter, topic):
+                session.deliver(topic, payload, min(qos, retained_qos), retain=True)
+
+    # Route a message to every matching subscriber once, at the highest QoS of its matching filters. Returns the sessions.
+    def publish(self, topic, payload, qos, retain=False):
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None) # An empty retained message clears the topic.
+        receivers = dict(self.exact_subscriptions.get(topic, {}))
+        for topic_filter, sessions in self.wildcard_subscriptions.items():
+            if topic_matches_sub(topic_filter, topic):
+                for session, granted in sessions.items():
+                    receivers[session] = max(granted, receivers.get(session, 0))
+        if self.delivery_delay > 0:
+            loop = asyncio.get_running_loop()
+            for session, granted in receivers.items():
+                loop.call_later(self.delivery_delay, session.deliver, topic, payload, min(qos, granted))
+            return []
+        for session, granted in receivers.items():
+            session.deliver(topic, payload, min(qos, granted))
+        return receivers
+
+
+def valid_filter(topic_filter):
+    levels = topic_filter.split("/")
+    return bool(topic_filter) and all(("#" not in level or (level == "#" and position == len(levels) - 1)) and ("+" not in level or level == "+")
+                                      for position, level in enumerate(levels))
+
+
+# Serve until stopped. ready is called with the bound (port, ws port) once the broker accepts connections.
+async def serve(broker, ready=None):
+    await broker.start()
+    if ready is not None:
+        ready(broker.port, broker.ws_port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+    await stop.wait()
+    await broker.stop()
+
+
+# Entry point of the broker process the benchmark starts. The bound ports are put on ready_queue.
+def run_broker(host, port, ws_port, delivery_delay, ready_queue):
+    broker = LocalBroker(host, port, ws_port, delivery_delay)
+    asyncio.run(serve(broker, lambda port, ws_port: ready_queue.put((port, ws_port))))
+
+
+def broker_main(argv):
+    parser = argparse.ArgumentParser(prog="MQTTLoadTester.py broker", description="Run the local MQTT 3.1.1 broker stand-in until CTRL + C.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT over TCP port, 0 for a free port.")
+    parser.add_argument("--ws-port", type=int, default=None, help="MQTT over WebSockets port, 0 for a free port. Not served by default.")
+    parser.add_argument("--delivery-delay", type=float, default=0.0, help="Hold every delivery for this many seconds.")
+    args = parser.parse_args(argv)
+    if args.delivery_delay < 0:
+        parser.error("--delivery-delay must not be negative.")
+    broker = LocalBroker(args.host, args.port, args.ws_port, args.delivery_delay)
+    asyncio.run(serve(broker, lambda port, ws_port: print(f"Local broker listening on {broker.describe()}, CTRL + C stops.", flush=True)))
+    print(f"Local broker stopped: {broker.messages_in} messages in, {broker.messages_out} out.")
+    return 0
@@ -0,0 +1,214 @@
+import copy
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import threading
+import time
+import tracemalloc
+from MQTTClient import MQTTClient
+from AsyncMQTTClient import AsyncMQTTClient
+from MQTTSweep import MQTTSweep, format_rate
+from LocalBroker import run_broker
+logger = logging.getLogger(__name__)
+
+    # Benchmark of the tester itself against the local broker stand-in (python MQTTLoadTester.py benchmark).
+    # The broker runs in its own process, so the CPU time of this process is tester overhead only.
+    # 1. Throughput: constant-rate sweep steps at increasing --rates with the sweep's saturation check. The max sustainable
+    #    msgs/s is the highest delivered rate of a step that was not saturated, CPU per message is the process CPU time of
+    #    that step divided by its delivered messages (publish and receive of one message).
+    # 2. Memory: a second broker holds every delivery for --memory-hold seconds while one client sends at --memory-rate,
+    #    so the messages pile up in flight. The peak Python memory (tracemalloc) divided by the messages in flight at that
+    #    moment is the memory per in-flight message. C allocations (sockets, SQLite) are not counted.
+    # Every benchmark is appended as one JSON line to --benchmark-file and compared with the previous entry of the same
+    # configuration, so tool overhead can be tracked release to release.
+
+SAMPLE_INTERVAL = 0.05 # Seconds between in-flight memory samples.
+BROKER_START_TIMEOUT = 10
+COMPARED_KEYS = (("max_msgs_per_second", "Max sustainable msgs/s", 1), ("cpu_us_per_message", "CPU per message (us)", -1),
+                 ("bytes_per_in_flight_message", "Memory per in-flight message (bytes)", -1)) # Key, label, +1 when higher is better.
+
+
+# Start the broker process and wait for its ports. Returns (process, port, ws port).
+def start_broker(host, ws, delivery_delay=0.0):
+    ready_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_broker, args=(host, 0, 0 if ws else None, delivery_delay, ready_queue), daemon=True)
+    process.start()
+    port, ws_port = ready_queue.get(timeout=BROKER_START_TIMEOUT)
+    return process, port, ws_port
+
+
+def stop_broker(process):
+    process.terminate() # SIGTERM stops the broker event loop.
+    process.join(BROKER_START_TIMEOUT)
+
+
+# git describe of the checkout, None outside a git checkout.
+def source_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty", "--tags"], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class MQTTBenchmark(MQTTSweep):
+    def __init__(self, args, db):
+        super().__init__(args, db)
+        self.step_cpu = {} # Step -> CPU seconds of this process per delivered message.
+        self.broker = None
+
+    def connect_args(self, args, port, ws_port):
+        args.host = self.args.benchmark_broker_host
+        args.port = ws_port if args.protocol == "ws" else port
+        args.ssl_enabled = False
+
+    # Steps send the --data-string-length of a normal run, not a whole payload size like --sweep-sizes.
+    def step_args(self, step, size, rate):
+        step_args = super().step_args(step, size, rate)
+        step_args.data_string_length = self.args.data_string_length
+        return step_args
+
+    def run_step(self, step, size, rate):
+        cpu_start = time.process_time()
+        result = super().run_step(step, size, rate)
+        result["Size"] = result["PayloadBytes"] # The json header fields vary by a few bytes from the estimate in sweep_sizes.
+        self.step_cpu[step] = (time.process_time() - cpu_start) / result["Received"] if result["Received"] else None
+        return result
+
+    def run(self):
+        self.broker, port, ws_port = start_broker(self.args.benchmark_broker_host, self.args.protocol == "ws")
+        try:
+            self.connect_args(self.args, port, ws_port)
+            print(f"Local broker started on port {self.args.port} ({self.args.protocol}), {self.args.engine} engine.")
+            super().run()
+        finally:
+            stop_broker(self.broker)
+        bytes_per_message, in_flight = self.measure_memory() if not self.stop_event.is_set() else (None, 0)
+        result = self.result(bytes_per_message, in_flight)
+        previous = self.previous_result(result)
+        self.print_result(result, previous)
+        self.append_result(result)
+
+    # Peak traced memory over the messages in flight at that moment, with the broker holding every delivery.
+    def measure_memory(self):
+        hold = self.args.benchmark_memory_hold
+        broker, port, ws_port = start_broker(self.args.benchmark_broker_host, self.args.protocol == "ws", delivery_delay=hold)
+        memory_args = copy.copy(self.args)
+        self.connect_args(memory_args, port, ws_port)
+        memory_args.client_id = f"{self.args.client_id}memory-"
+        memory_args.rate = self.args.benchmark_memory_rate
+        memory_args.profile = "constant"
+        memory_args.duration = hold * 0.8 # Sending ends before the first delivery, the peak has every message in flight.
+        memory_args.timeout = max(self.args.timeout, int(hold) + 10)
+        memory_args.store_rows = False
+        memory_args.stats_interval = 0
+        memory_args.metrics_port = None
+        mqtt_client = AsyncMQTTClient(memory_args, self.db) if self.args.engine == "asyncio" else MQTTClient(memory_args, self.db)
+        self.current_client = mqtt_client
+        print(f"Memory: {memory_args.rate:g} msgs/s for {memory_args.duration:g} s, deliveries held {hold:g} s.")
+        samples = [] # (messages in flight, traced bytes)
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(SAMPLE_INTERVAL):
+                samples.append((mqtt_client.tracker.in_flight, tracemalloc.get_traced_memory()[0]))
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        tracemalloc.start()
+        sampler.start()
+        try:
+            mqtt_client.run()
+        finally:
+            done.set()
+            sampler.join()
+            tracemalloc.stop()
+            stop_broker(broker)
+        self.db.flush()
+        in_flight, traced = max(samples, default=(0, 0))
+        return (traced / in_flight if in_flight else None), in_flight
+
+    def result(self, bytes_per_message, in_flight):
+        sustained = [step for step in self.steps if not step["Saturated"] and step["MsgsPerSecond"]]
+        best = max(sustained, key=lambda step: step["MsgsPerSecond"]) if sustained else None
+        cpu = self.step_cpu.get(best["Step"]) if best else None
+        return {
+            "timestamp": time.time(),
+            "time_utc": datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC'),
+            "label": self.args.run_label,
+            "version": source_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "engine": self.args.engine,
+            "protocol": self.args.protocol,
+            "payload_format": self.args.payload_format,
+            "payload_bytes": self.steps[0]["PayloadBytes"] if self.steps else None,
+            "qos": self.args.qos,
+            "store_rows": self.args.store_rows,
+            "db_batch_size": self.args.db_batch_size,
+            "max_msgs_per_second": best["MsgsPerSecond"] if best else None,
+            "sustained_target_rate": best["TargetRate"] if best else None,
+            "cpu_us_per_message": cpu * 1e6 if cpu is not None else None,
+            "bytes_per_in_flight_message": bytes_per_message,
+            "in_flight_messages": in_flight,
+            "steps": [{"target_rate": step["TargetRate"], "msgs_per_second": step["MsgsPerSecond"], "p99_ms": step["P99"],
+                       "cpu_us_per_message": self.step_cpu[step["Step"]] * 1e6 if self.step_cpu.get(step["Step"]) is not None else None,
+                       "saturated": bool(step["Saturated"])} for step in self.steps],
+            "results_file": self.db.db_file,
+        }
+
+    # Configuration that must match for two benchmarks to be comparable.
+    @staticmethod
+    def configuration(result):
+        return tuple(result.get(key) for key in ("engine", "protocol", "payload_format", "payload_bytes", "qos", "store_rows", "db_batch_size"))
+
+    def previous_result(self, result):
+        path = self.args.benchmark_file
+        if not path or not os.path.exists(path):
+            return None
+        previous = None
+        try:
+            with open(path) as benchmark_file:
+                for line in benchmark_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if self.configuration(entry) == self.configuration(result):
+                        previous = entry
+        except OSError as e:
+            logging.error(f"Could not read {path}: {e}")
+        return previous
+
+    def append_result(self, result):
+        if not self.args.benchmark_file:
+            return
+        try:
+            with open(self.args.benchmark_file, "a") as benchmark_file:
+                benchmark_file.write(json.dumps(result) + "\n")
+            print(f"Benchmark appended to {self.args.benchmark_file}.")
+        except OSError as e:
+            logging.error(f"Could not write the benchmark to {self.args.benchmark_file}: {e}")
+
+    def print_result(self, result, previous):
+        print()
+        print(f"Benchmark: {result['engine']} engine, {result['protocol']}, {result['payload_format']} payload of {result['payload_bytes']} bytes, QoS {result['qos']}.")
+        print(f"{'Rate':>10}{'Msgs/s':>12}{'CPU/msg (us)':>14}{'p99 (ms)':>10}")
+        for step in result["steps"]:
+            print(f"{step['target_rate']:>10g}{format_rate(step['msgs_per_second']):>12}{format_rate(step['cpu_us_per_message']):>14}"
+                  f"{format_rate(step['p99_ms']):>10}{'  SATURATED' if step['saturated'] else ''}")
+        if result["max_msgs_per_second"] is None:
+            print("Every step was saturated, lower --rates.")
+        if previous is not None:
+            print(f"Compared with {previous.get('label') or previous.get('version') or 'the previous run'} of {previous.get('time_utc')}:")
+        for key, label, direction in COMPARED_KEYS:
+            line = f"{label}: {format_rate(result[key])}"
+            if previous is not None and result[key] is not None and previous.get(key):
+                change = (result[key] - previous[key]) / previous[key] * 100
+                line += f" (was {format_rate(previous[key])}, {change:+.1f}%{', worse' if change * direction < 0 else ''})"
+            print(line)
+        if result["in_flight_messages"]:
+            print(f"Memory measured with {result['in_flight_messages']} messages in flight.")
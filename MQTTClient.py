@@ -1,44 +1,112 @@
 import sys
 import paho.mqtt.client as mqtt
 import datetime
-import json
 import logging
 import ssl
+import socket
 import random
 import time
 import signal
 from queue import Queue
 import threading
 from dotenv import load_dotenv
-from Report import LoadTestReport
+from TimeoutScheduler import TimeoutScheduler
+from InFlightTracker import InFlightTracker, InFlightMessage, DEFAULT_WINDOW
+from LoadProfile import LoadProfile
+from PayloadCodec import create_codec
+from LatencyHistogram import LatencyHistogram, HistogramSet, histogram_path
+from LiveMetrics import LiveMetrics, MetricsCollector
 load_dotenv()
 logger = logging.getLogger(__name__)
 
     # Connects to MQTT Broker to publish messages to topic and receives messages from topic.
     # Calculates the message delay time in the process.
     # Saves the results to a database from every run and generates a visual report.
+    # With --stage-timing the delay is split into stages along the hot path, each recorded as a stage_<name> histogram:
+    #   encode:  payload encoding (json.dumps / struct.pack)
+    #   publish: client.publish() call, paho packet build and out queue
+    #   transit: publish() returned until on_message, socket write, network, broker and the paho read loop
+    #   decode:  payload decoding in on_message (json.loads / struct.unpack)
+    #   queue:   wait in the result Queue before processing, after the delay is measured
+    #   store:   database insert of the result row, after the delay is measured
+    # An unexpected disconnect pauses the sender and paho reconnects with exponential backoff (--reconnect-min-delay to
+    # --reconnect-max-delay seconds) and subscribes again in on_connect. Disconnects and reconnects are stored in the
+    # connection_events table. Messages sent or received from a disconnect until --recovery-window seconds after the
+    # reconnect are recorded in the recovery histogram, all others in steady_state.
+
+STAGES = ("encode", "publish", "transit", "decode", "queue", "store")
 
 class MQTTClient:
-    def __init__(self, args, db):
+    def __init__(self, args, db, client_index=None, scheduler=None):
         self.args = args
         self.db = db
+        self.client_index = client_index # Set when running as one of many clients in fan-out mode.
+        self.client_id = self.generate_client_id()
+        self.topic = self.generate_topic()
+        self.return_topic = self.topic + "/return"
+        self.return_echo = getattr(args, 'return_echo', False) # Echo received messages to the return topic and measure round trip.
+        self.codec = create_codec(getattr(args, 'payload_format', 'json'), self.client_id, args.data_string_length)
         self.q = Queue() # Stores sent and received message times.
         self.client = self.initialize_client()
         self.connected_event = threading.Event() # Message interval threading.
-        self.sent_message_ids = set() # Keep track of message ID.
-        self.received_message_ids = set() # Keep track of message ID.
-        self.timed_out_message_ids = set()
-        self.lock = threading.Lock()  # Lock for thread-safe operations on shared resources.
-        self.timers = {}  # Initialize the timers dictionary to manage message timeouts.
-        self.publish_times = {}  # Datetimes.
+        # Outstanding messages with their publish time, schedule and timeout timer. Memory stays flat on long runs.
+        self.tracker = InFlightTracker(getattr(args, 'inflight_window', DEFAULT_WINDOW))
+        self.lock = threading.RLock()  # Lock for thread-safe operations on shared resources.
+        # Message timeouts run on one scheduler thread. Fan-out clients share the scheduler of their process.
+        self.owns_scheduler = scheduler is None
+        self.scheduler = TimeoutScheduler() if scheduler is None else scheduler
+        self.load_profile = LoadProfile.from_args(args)
+        self.sent_count = 0 # Messages the sender attempted to publish.
+        self.failed_sends = 0
+        self.received_bytes = 0 # Payload bytes of the measured messages, with the receive window for throughput.
+        self.first_receive_time = None
+        self.last_receive_time = None
+        self.histograms = HistogramSet() # Delivery delay, per-QoS delivery delay and publish ack delay, constant memory.
+        self.histogram = self.histograms.get("delivery") # Delay of every received message.
+        self.qos_levels = parse_qos_levels(getattr(args, 'qos', '0'))
+        self.pending_acks = {} # Publish mid -> (QoS, send time) until PUBACK / PUBCOMP.
+        self.early_acks = {} # Acks that arrived before publish() returned the mid.
+        self.ignored_acks = set() # Mids of /return publishes, their acks are not measured.
+        self.interval_histogram = LatencyHistogram() # Delay since the last live metrics snapshot.
+        self.track_sends = True # Sent messages wait for their delivery or timeout.
+        self.sender_key = self.codec.client_key # Only messages of this sender are measured, None accepts every sender.
+        self.clock_offset = 0.0 # Added to receive times to convert them to the clock of the sender.
+        self.stage_timing = getattr(args, 'stage_timing', False) # Time every stage of the hot path, see STAGES.
+        self.stop_event = threading.Event() # Stops the sender loop early on shutdown.
+        self.start_gate = None # Shared start of every worker process in a multi-process fan-out, see MQTTFanOut.StartGate.
+        self.recovery_window = getattr(args, 'recovery_window', 5.0) # Seconds after a reconnect that count as recovery.
+        self.outages = [] # [disconnect time, reconnect time or None] of every unexpected disconnect.
+        self.reconnect_attempts = 0 # Failed attempts of the current outage.
+        self.sender_thread = None
+        self.processing_thread = None
+        self.start_time = None
+        self.end_time = None
+
+    # Unique client ID per connection. Fan-out clients also carry their index.
+    # A persistent session needs the same client ID on every connection, so no random part is added.
+    def generate_client_id(self):
+        if getattr(self.args, 'clean_session', True):
+            client_id = f"{self.args.client_id}{random.randint(100, 999)}" #Generate unic ID.
+        else:
+            client_id = self.args.client_id
+        if self.client_index is not None:
+            client_id = f"{client_id}-{self.client_index}"
+        return client_id
+
+    # Fan-out clients publish to their own sub-topic unless a shared topic is requested.
+    def generate_topic(self):
+        if self.client_index is None or getattr(self.args, 'shared_topic', False):
+            return self.args.topic
+        return f"{self.args.topic}/{self.client_index}"
 
     # MQTT Client Initialization and Connection Management based on chosen protocol.
     def initialize_client(self):
-        client_id_with_random = f"{self.args.client_id}{random.randint(100, 999)}" #Generate unic ID.
+        clean_session = getattr(self.args, 'clean_session', True)
+        reconnect = getattr(self.args, 'reconnect', True)
         if self.args.protocol == 'mqtt':
-            client = mqtt.Client(client_id_with_random)
+            client = mqtt.Client(self.client_id, clean_session=clean_session, reconnect_on_failure=reconnect)
         elif self.args.protocol == 'ws':
-            client = mqtt.Client(client_id_with_random, transport='websockets')
+            client = mqtt.Client(self.client_id, clean_session=clean_session, transport='websockets', reconnect_on_failure=reconnect)
             client.ws_set_options(path="/")
         else:
             self.exit_with_message(f"Unsupported protocol: {self.args.protocol}")
@@ -48,10 +116,16 @@ class MQTTClient:
             logging.info(f"SSL/TLS is disabled for {self.args.protocol} in test use.")
             client.tls_set(cert_reqs=ssl.CERT_NONE) #Bypass certificate verification in test use.
 
+        client.reconnect_delay_set(getattr(self.args, 'reconnect_min_delay', 1.0), getattr(self.args, 'reconnect_max_delay', 30.0))
+
         # Broker callback and subscribe
+        client.on_socket_open = disable_nagle
         client.on_connect = self.on_connect
-        # The callback called when a message has been received on a topic that the client subscribes to.
+        client.on_connect_fail = self.on_connect_fail
+        client.on_disconnect = self.on_disconnect
         client.on_message = self.on_message
+        # Called when a QoS 0 publish is written, on PUBACK for QoS 1 and on PUBCOMP for QoS 2.
+        client.on_publish = self.on_publish
         return client
 
     # Check protocol and SSL
@@ -73,119 +147,311 @@ class MQTTClient:
         else:
             self.exit_with_message(f"Unsupported protocol: {self.args}")
     
-    # Connect to a remote broker and subscribe.
+    # Connect to a remote broker and subscribe. Also called on every reconnect, which subscribes again.
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             logging.info("Connected successfully to the broker.")
-            client.subscribe(self.args.topic, 0)
-            self.connected_event.set() # send_messages_loop waits for connection.
+            self.subscribe_topics(client)
+            self.mark_connected() # send_messages_loop waits for connection.
         else:
             logging.error(f"Failed to connect to the broker with return code {rc}")
+            self.reconnect_attempts += 1
+
+    # Subscriptions of every (re)connect.
+    def subscribe_topics(self, client):
+        if self.return_echo:
+            client.subscribe(self.return_topic, 0)
+        client.subscribe(self.topic, max(self.qos_levels)) # Delivery QoS is the lower of publish and subscribe QoS.
+
+    # A reconnect attempt that did not reach CONNACK.
+    def on_connect_fail(self, client, userdata):
+        self.reconnect_attempts += 1
+
+    # Connected and subscribed. Closes the open outage with a reconnect event.
+    def mark_connected(self):
+        reconnect_time = time.perf_counter()
+        with self.lock:
+            outage = self.outages[-1] if self.outages and self.outages[-1][1] is None else None
+            if outage is not None:
+                outage[1] = reconnect_time
+        if outage is not None:
+            downtime = reconnect_time - outage[0]
+            logging.warning(f"Client {self.client_id} reconnected after {downtime:.3f} s and {self.reconnect_attempts + 1} attempts.")
+            self.db.insert_connection_event(self.client_id, "reconnect", reconnect_time, duration=downtime * 1000, return_code=0,
+                                            attempts=self.reconnect_attempts + 1, recovery_until=reconnect_time + self.recovery_window)
+        self.connected_event.set()
+
+    # rc 0 is a disconnect() of this client, anything else an unexpected loss of the connection.
+    def on_disconnect(self, client, userdata, rc):
+        if rc == 0:
+            return
+        self.record_disconnect(rc, mqtt.error_string(rc))
+        if not getattr(self.args, 'reconnect', True):
+            self.stop_event.set() # In-flight messages are marked as failed at the end of the run.
+
+    # A reconnect attempt whose connection is dropped before CONNACK also ends here, it belongs to the open outage.
+    def record_disconnect(self, rc, reason):
+        disconnect_time = time.perf_counter()
+        self.connected_event.clear()
+        with self.lock:
+            if self.outages and self.outages[-1][1] is None:
+                self.reconnect_attempts += 1
+                return
+            self.outages.append([disconnect_time, None])
+            self.reconnect_attempts = 0
+        logging.warning(f"Client {self.client_id} lost the connection to the broker: {reason}")
+        self.db.insert_connection_event(self.client_id, "disconnect", disconnect_time, return_code=rc, reason=reason)
+
+    # True when a message was sent or received from a disconnect until --recovery-window seconds after its reconnect.
+    def in_recovery(self, *times):
+        for disconnect_time, reconnect_time in self.outages:
+            end = float("inf") if reconnect_time is None else reconnect_time + self.recovery_window
+            if any(disconnect_time <= moment <= end for moment in times):
+                return True
+        return False
  
-    # Sends messages repeatedly at defined intervals.
+    # Sends messages on the open-loop schedule of the load profile.
+    # Each send has an absolute deadline, a late sender publishes immediately and the lag is recorded.
     def send_messages_loop(self):
         self.connected_event.wait()  # Wait until the client is connected and subscribed.
-        for message_index in range(1, self.args.message_count + 1):
-            self.send_message(self.client, self.args.topic, message_index, self.args.data_string_length)
-            time.sleep(self.args.interval)
+        schedule_start = self.wait_for_start()
+        for message_index, offset in self.load_profile.schedule():
+            if self.stop_event.is_set():
+                break
+            scheduled_time = schedule_start + offset
+            sleep_time = scheduled_time - time.perf_counter()
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+            if not self.connected_event.is_set() and not self.wait_for_reconnect():
+                break
+            send_lag = (time.perf_counter() - scheduled_time) * 1000  # Milliseconds behind schedule.
+            self.send_message(self.client, self.topic, message_index, scheduled_time, send_lag)
+            self.sent_count += 1
+
+    # The sender pauses while the connection is down instead of publishing into the paho buffer. Messages due in the
+    # meantime are sent on reconnect, late by their send lag. False when the run is stopped first.
+    def wait_for_reconnect(self):
+        while not self.connected_event.wait(0.1):
+            if self.stop_event.is_set():
+                return False
+        return True
+
+    # Start of the send schedule: now, or the start time every worker process of a multi-process fan-out shares.
+    def wait_for_start(self):
+        if self.start_gate is None:
+            return time.perf_counter()
+        schedule_start = self.start_gate.wait()
+        sleep_time = schedule_start - time.perf_counter()
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+        return schedule_start
 
     # Publish message to topic and sending timeout.
-    def send_message(self, client, topic, message_index, data_string_length):
-        try:          
-            publish_datetime_utc = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds')
-            data = "Lorem ipsum dolor sit amet"[:data_string_length]
-            message = {
-                "PublishDateTimeUTC": publish_datetime_utc,
-                "SendTime": time.perf_counter(),
-                "MessageIndex": message_index,
-                "Data": data
-            }
-            json_message = json.dumps(message)
-            client.publish(topic, json_message)
-            self.sent_message_ids.add(message_index)
-            self.publish_times[message_index] = publish_datetime_utc
+    def send_message(self, client, topic, message_index, scheduled_time=None, send_lag=None):
+        publish_datetime_utc = None
+        try:
+            payload, send_time, publish_datetime_utc = self.codec.encode(message_index)
+            stages = [send_time, time.perf_counter(), None] if self.stage_timing else None
+            if self.track_sends:
+                with self.lock:
+                    # Tracked before publish, the reply can arrive first.
+                    self.tracker.add(message_index, InFlightMessage(publish_datetime_utc, scheduled_time, send_lag, stages))
+            qos = self.message_qos(message_index)
+            message_info = client.publish(topic, payload, qos=qos, retain=getattr(self.args, 'retain', False))
+            if stages is not None:
+                stages[2] = time.perf_counter()
+            self.register_publish(message_info.mid, qos, send_time)
+            if not self.track_sends:
+                return
             # Timeout
             timeout_seconds = self.args.timeout
             # Set up a timer for the message
-            timer = threading.Timer(timeout_seconds, self.message_timeout, [message_index])
-            timer.start()
+            timer = self.scheduler.schedule(timeout_seconds, self.message_timeout, message_index)
             with self.lock:
-                self.timers[message_index] = timer
+                message = self.tracker.get(message_index)
+                if message is None: # Already received.
+                    timer.cancel()
+                else:
+                    message.timer = timer
 
         except Exception as e:
             logging.error(f"Failed to publish message {message_index}: {e}")
             # Directly use the captured publish datetime for logging the failure
-            self.db.insert_result(message_index, publish_datetime_utc, None, None, None, failed=True)
-            self.sent_message_ids.discard(message_index)
+            with self.lock:
+                self.tracker.discard(message_index)
+                self.failed_sends += 1
+            self.store_failure(message_index, publish_datetime_utc, scheduled_time, send_lag)
+
+    # Messages cycle through the --qos levels by index, so the QoS of a message is known on both ends.
+    def message_qos(self, message_index):
+        return self.qos_levels[message_index % len(self.qos_levels)]
+
+    # Publish ack latency: from send time to PUBACK (QoS 1), PUBCOMP (QoS 2) or socket write (QoS 0).
+    def register_publish(self, mid, qos, send_time):
+        with self.lock:
+            ack_time = self.early_acks.pop(mid, None)
+            if ack_time is None:
+                self.pending_acks[mid] = (qos, send_time)
+        if ack_time is not None:
+            self.record_ack(qos, send_time, ack_time)
+
+    # The ack of a /return publish is not measured.
+    def ignore_publish(self, mid):
+        with self.lock:
+            if self.early_acks.pop(mid, None) is None:
+                self.ignored_acks.add(mid)
+
+    def on_publish(self, client, userdata, mid):
+        ack_time = time.perf_counter()
+        with self.lock:
+            if mid in self.ignored_acks:
+                self.ignored_acks.discard(mid)
+                return
+            pending = self.pending_acks.pop(mid, None)
+            if pending is None:
+                self.early_acks[mid] = ack_time # publish() has not returned the mid yet.
+                return
+        self.record_ack(pending[0], pending[1], ack_time)
+
+    def record_ack(self, qos, send_time, ack_time):
+        with self.lock:
+            self.histograms.get(f"publish_ack_qos_{qos}").record((ack_time - send_time) * 1000)
 
     # The callback called when a message has been received on a topic that the client subscribes to.
-    # Creates a return topic for received message times.
     def on_message(self, client, userdata, message):
         receive_time = time.perf_counter()  # High-resolution timestamp on message receive.       
-        message_data = json.loads(message.payload.decode())
-        original_send_time = message_data["SendTime"]
-        message_index = message_data["MessageIndex"]
-        publish_date_time_utc = message_data["PublishDateTimeUTC"]
-        self.received_message_ids.add(message_index) # Update tracking of received messages
+        # Retained messages from earlier runs are delivered on subscribe, and an empty payload clears the retained message.
+        if message.retain or not message.payload:
+            return
+        if message.topic == self.return_topic:
+            self.on_return(message.payload, receive_time)
+        else:
+            self.on_data(client, message.payload, receive_time)
+
+    # A load test message. Echoed through the return topic when --return-echo is enabled.
+    def on_data(self, client, payload, receive_time):
+        local_receive_time = receive_time
+        receive_time += self.clock_offset
+        message_index, original_send_time, publish_date_time_utc, sender = self.codec.decode(payload)
+        decoded_time = time.perf_counter() if self.stage_timing else None
+        # On a shared topic every client also receives the other clients' messages.
+        if self.sender_key is not None and sender != self.sender_key:
+            return
+        # Update tracking of received messages. Duplicates and messages that already timed out are only counted.
+        in_flight_message = self.track_receive(message_index)
+        if in_flight_message is None:
+            return
+        # Manage timers for message timeout
+        if in_flight_message.timer is not None:
+            in_flight_message.timer.cancel()
+        if self.first_receive_time is None:
+            self.first_receive_time = receive_time
+        self.last_receive_time = receive_time
+        self.received_bytes += len(payload)
 
         # Re-publish with new timestamp through /return topic.
-        if "return" not in message.topic:
-            new_payload = json.dumps({
-                "SendTime": receive_time,
-                "OriginalPayload": message.payload.decode(),
-                "RoundTrip": True
-            })
-            client.publish(self.args.topic + "/return", new_payload)
+        if self.return_echo:
+            message_info = client.publish(self.return_topic, self.codec.return_payload(payload, receive_time))
+            self.ignore_publish(message_info.mid)
 
-        # Manage timers for message timeout
-        with self.lock:
-            if message_index in self.timers:
-                self.timers[message_index].cancel()
-                del self.timers[message_index]
+        stages = None
+        if in_flight_message.stages is not None: # Only the sender knows the send side stages.
+            send_time, encoded_time, published_time = in_flight_message.stages
+            stages = {"encode": encoded_time - send_time, "decode": decoded_time - local_receive_time}
+            if published_time is not None: # None when the message arrived before publish() returned.
+                stages["publish"] = published_time - encoded_time
+                stages["transit"] = receive_time - published_time
 
         # Add timestamps and indexes to Queue for message processing.    
-        self.q.put((publish_date_time_utc ,original_send_time, receive_time, message_index))
+        self.queue_result((publish_date_time_utc ,original_send_time, receive_time, message_index,
+                           in_flight_message.scheduled_time, in_flight_message.send_lag, stages,
+                           time.perf_counter() if stages is not None else None))
+
+    def track_receive(self, message_index):
+        with self.lock:
+            return self.tracker.receive(message_index)
+
+    # An echoed message: round trip from the original send time, both on the clock of this client.
+    def on_return(self, payload, receive_time):
+        echo_time, original_payload = self.codec.decode_return(payload)
+        message_index, original_send_time, publish_date_time_utc, sender = self.codec.decode(original_payload)
+        if self.sender_key is not None and sender != self.sender_key:
+            return None
+        with self.lock:
+            self.histograms.get("round_trip").record((receive_time - original_send_time) * 1000)
+        return message_index
+
+    def queue_result(self, item):
+        self.q.put(item)
 
     # Logic to get sent/received messages from Queue.
-    # Calculate message delay and add to database.
     def process_messages(self, q):
         while True:
             item = q.get()
             if item is None:  # Exit signal
                 break
-            publish_date_time_utc ,original_send_time, receive_time, message_index = item
-            delay = (receive_time - original_send_time) * 1000  # Convert delay to milliseconds.
-            self.db.insert_result(message_index, publish_date_time_utc, original_send_time, receive_time, delay, failed=False) # Add to database.
+            self.process_result(item)
+
+    # Calculate message delay and add to database.
+    def process_result(self, item):
+        publish_date_time_utc ,original_send_time, receive_time, message_index, scheduled_time, send_lag, stages, queued_time = item
+        if stages is not None:
+            stages["queue"] = time.perf_counter() - queued_time
+        qos = self.message_qos(message_index)
+        publish_date_time_utc = self.codec.format_publish_time(publish_date_time_utc)
+        delay = (receive_time - original_send_time) * 1000  # Convert delay to milliseconds.
+        self.histogram.record(delay)
+        self.histograms.get(f"delivery_qos_{qos}").record(delay)
+        self.histograms.get("recovery" if self.outages and self.in_recovery(original_send_time - self.clock_offset, receive_time - self.clock_offset)
+                            else "steady_state").record(delay)
+        with self.lock: # metrics_snapshot swaps the interval histogram under the lock, no sample is lost.
+            self.interval_histogram.record(delay)
+        if getattr(self.args, 'store_rows', True): # Otherwise only failed messages are stored, latency is kept in the histogram.
+            store_time = time.perf_counter()
+            self.db.insert_result(message_index, publish_date_time_utc, original_send_time, receive_time, delay, failed=False, client_id=self.client_id,
+                                  scheduled_time=scheduled_time, send_lag=send_lag, qos=qos) # Add to database.
+            if stages is not None:
+                stages["store"] = time.perf_counter() - store_time
+        if stages is not None:
+            self.record_stages(stages)
+
+    def record_stages(self, stages):
+        with self.lock:
+            for stage, seconds in stages.items():
+                self.histograms.get(f"stage_{stage}").record(seconds * 1000)
 
     # If a message timeout occurs.
     def message_timeout(self, message_index):
         with self.lock:
-            publish_datetime_utc = self.publish_times.get(message_index, "Unknown Time")
-            if message_index not in self.received_message_ids:
-                logging.error(f"Timeout exceeded for message {message_index}. Marking as failed.")
-                self.timed_out_message_ids.add(message_index)
-                self.sent_message_ids.discard(message_index)
-                self.db.insert_result(message_index, publish_datetime_utc, None, None, None, failed=True)
-            if message_index in self.timers:
-                self.timers[message_index].cancel()
-                del self.timers[message_index]
-            self.cleanup_message_index(message_index)
-
-    # Check missing messages.
+            message = self.tracker.time_out(message_index)
+        if message is None: # Received just before the timeout fired.
+            return
+        logging.error(f"Timeout exceeded for message {message_index}. Marking as failed.")
+        self.store_failure(message_index, message.publish_datetime, message.scheduled_time, message.send_lag)
+
+    def store_failure(self, message_index, publish_datetime, scheduled_time, send_lag):
+        self.db.insert_result(message_index, self.codec.format_publish_time(publish_datetime), None, None, None, failed=True,
+                              client_id=self.client_id, scheduled_time=scheduled_time, send_lag=send_lag, qos=self.message_qos(message_index))
+
+    # Wait until every sent message is received or timed out, at most --timeout seconds. Skipped on CTRL + C.
+    def wait_for_in_flight(self):
+        deadline = time.perf_counter() + self.args.timeout
+        while self.tracker.in_flight and time.perf_counter() < deadline and not self.stop_event.is_set():
+            time.sleep(0.01)
+
+    # Messages still in flight at the end of the run are stored as failed.
     def verify_message_integrity(self):
-        missing_messages = self.sent_message_ids.difference(self.received_message_ids)
-        if missing_messages:
-            logging.error(f"Missing message IDs: {sorted(missing_messages)}")
-            for message_index in sorted(missing_messages):
-                publish_datetime_utc = self.publish_times.get(message_index, "Unknown Time")
-                self.db.insert_result(message_index, publish_datetime_utc, None, None, None, failed=True)
-                self.cleanup_message_index(message_index)
-                
-    # Datetime index cleanup
-    def cleanup_message_index(self, message_index):
         with self.lock:
-            if message_index in self.publish_times:
-                del self.publish_times[message_index]
+            missing_messages = self.tracker.drain()
+        if missing_messages:
+            logging.error(f"Missing message IDs: {[message_index for message_index, message in missing_messages]}")
+        for message_index, message in missing_messages:
+            if message.timer is not None:
+                message.timer.cancel()
+            self.store_failure(message_index, message.publish_datetime, message.scheduled_time, message.send_lag)
+        counters = self.tracker.counters()
+        if counters["duplicates"] or counters["late"]:
+            logging.warning(f"Client {self.client_id}: {counters['duplicates']} duplicate and {counters['late']} late messages.")
 
     # CTRL + C
     def handle_signal(self, signal_number, frame):
@@ -195,63 +461,158 @@ class MQTTClient:
 
     # Start non-blocking connection to broker
     # Start threading sent and received messages
-    def connect_and_loop(self):
-        signal.signal(signal.SIGINT, self.handle_signal) # CTRL + C.
-        try:
-            self.client.username_pw_set(self.args.username, self.args.password)
-            self.client.connect(self.args.host, self.args.port, 60)
-            self.client.loop_start()
-            # Starting print for user.
-            start_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
-            print(f"Beginning loadtest at {start_time}: Sending {self.args.message_count} messages with {self.args.interval} second interval.")
-
-            # Message publish intervall.
-            self.sender_thread = threading.Thread(target=self.send_messages_loop)
-            self.sender_thread.start()
-            
-            # Published and subscribed Queue threading.
-            processing_thread = threading.Thread(target=self.process_messages, args=(self.q,))
-            processing_thread.start()
+    def start(self):
+        if self.owns_scheduler:
+            self.scheduler.start()
+        self.client.username_pw_set(self.args.username, self.args.password)
+        self.client.connect(self.args.host, self.args.port, 60)
+        self.client.loop_start()
+        self.start_time = time.perf_counter()
 
-        except Exception as e:
-            logging.error(f"An error occurred: {e}")
+        # Message publish intervall.
+        self.sender_thread = threading.Thread(target=self.send_messages_loop)
+        self.sender_thread.start()
 
-        finally:
-            # Wait for sending thread to complete --messsage-count.
+        # Published and subscribed Queue threading.
+        self.processing_thread = threading.Thread(target=self.process_messages, args=(self.q,))
+        self.processing_thread.start()
+
+    # Wait for the sender to finish, drain the Queue and disconnect.
+    def stop(self):
+        # Wait for sending thread to complete --messsage-count.
+        if self.sender_thread is not None:
             self.sender_thread.join()
-            print()
-            logging.info("Sender thread completed.")
+        logging.info("Sender thread completed.")
+        self.wait_for_in_flight()
 
-            # End thread after all pubs/subs processed from Queue.
+        # End thread after all pubs/subs processed from Queue.
+        if self.processing_thread is not None:
             self.q.put(None)
-            processing_thread.join()
-            logging.info("Queue processing thread completed.")            
-            # Check for any missing messages before stopping everything
-            self.verify_message_integrity()
+            self.processing_thread.join()
+        logging.info("Queue processing thread completed.")
+        # Check for any missing messages before stopping everything
+        self.verify_message_integrity()
 
-            # Stop MQTT loop and disconnect
-            with self.lock:
-                for timer in self.timers.values():
-                    timer.cancel()
-            self.client.loop_stop()
-            self.client.disconnect()
-            logging.info("Disconnected from MQTT broker and cleaned up resources.")
+        # Stop MQTT loop and disconnect
+        if self.owns_scheduler:
+            self.scheduler.stop()
+        if getattr(self.args, 'retain', False) and self.connected_event.is_set():
+            self.client.publish(self.topic, b"", retain=True).wait_for_publish(timeout=5) # Clear the retained message.
+        self.client.loop_stop()
+        self.client.disconnect()
+        self.end_time = time.perf_counter()
+        logging.info("Disconnected from MQTT broker and cleaned up resources.")
 
-            # Report and summary
-            self.generate_report(self.db.db_file)
-            successful_messages = len(self.sent_message_ids)
-            failed_messages = self.args.message_count - successful_messages - len(self.timed_out_message_ids)
-            timeout_messages = len(self.timed_out_message_ids)
+    # Counters for live metrics. The interval histogram is swapped for an empty one on every call.
+    def metrics_snapshot(self):
+        with self.lock:
+            interval_histogram, self.interval_histogram = self.interval_histogram, LatencyHistogram()
+            counters = self.tracker.counters()
+        return {
+            "sent": self.sent_count,
+            **counters,
+            "received": self.histogram.count,
+            "queue_depth": self.q.qsize(),
+            "histogram": interval_histogram,
+        }
+
+    # Message counts of this client for the end of run summary.
+    def summary(self):
+        counters = self.tracker.counters()
+        return {
+            "ClientId": self.client_id,
+            "Successful": counters["received"],
+            "Failed": self.sent_count - counters["received"] - counters["timed_out"],
+            "Timeout": counters["timed_out"],
+            "Duplicates": counters["duplicates"],
+            "Late": counters["late"],
+            "Reordered": counters["reordered"],
+            "Disconnects": len(self.outages),
+        }
+
+    # Run the whole test: start, wait for the sender and stop.
+    def run(self):
+        try:
+            self.start()
+        except Exception as e:
+            logging.error(f"An error occurred: {e}")
+            self.stop_event.set()
+        finally:
+            self.stop()
+
+    def connect_and_loop(self):
+        signal.signal(signal.SIGINT, self.handle_signal) # CTRL + C.
+        # Starting print for user.
+        start_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        print(f"Beginning loadtest at {start_time}: Sending {self.load_profile.describe()}.")
+        collector = MetricsCollector(self.db)
+        collector.add_clients([self])
+        live_metrics = LiveMetrics.from_args(collector, self.args)
+        if live_metrics is not None:
+            live_metrics.start()
+        self.run()
+        if live_metrics is not None:
+            live_metrics.stop()
+        self.db.flush() # Every result must be in the database before the report reads it.
+        self.histograms.save(histogram_path(self.db.db_file))
+        print()
+        print_percentiles(self.histograms)
 
-            # Display summary
-            end_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
-            print(f"Ending loadtest at {end_time} - Sent {successful_messages} messages successfully, {failed_messages} failed and {timeout_messages} timeout messages.")
-            logging.info("All messages processed. Exiting...")
+        # Report and summary
+        self.generate_report(self.db.db_file)
+        summary = self.summary()
+
+        # Display summary
+        end_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        print(f"Ending loadtest at {end_time} - Sent {summary['Successful']} messages successfully, {summary['Failed']} failed and {summary['Timeout']} timeout messages.")
+        print(f"Duplicate messages {summary['Duplicates']}, late messages (after timeout) {summary['Late']}, reordered messages {summary['Reordered']}.")
+        if summary["Disconnects"]:
+            print(f"Disconnects {summary['Disconnects']}, see the connection_events table.")
+        logging.info("All messages processed. Exiting...")
 
     def generate_report(self, db_path):
-        report_generator = LoadTestReport(db_path)
-        report_generator.generate_charts_and_tables()
+        generate_report(self.args, db_path)
 
     def exit_with_message(self, message):
         logging.error(message)
-        exit(1)
\ No newline at end of file
+        exit(1)
+
+
+# One line with the latency percentiles of a run, the round trip with --return-echo, then delivery and publish ack latency per QoS level,
+# steady state and recovery latency after a disconnect and the hot path stages with --stage-timing.
+def print_percentiles(histograms):
+    names = histograms.names()
+    recovery = ["steady_state", "recovery"] if "recovery" in names else []
+    for name in (["delivery", "round_trip"] + [name for name in names if name.startswith(("delivery_qos_", "publish_ack_qos_"))]
+                 + recovery + [f"stage_{stage}" for stage in STAGES]):
+        summary = histograms.get(name).summary() if name in names else None
+        if summary:
+            print(f"{name.replace('_', ' ').capitalize()} latency " + ", ".join(f"{key} {value:.3f}" for key, value in summary.items()))
+
+
+# paho never sets TCP_NODELAY, so small PUBLISH and ack packets would wait for delayed ACKs (Nagle's algorithm) and
+# inflate QoS 1 and 2 latency. on_socket_open of every paho client. WebSockets run on the same TCP socket.
+def disable_nagle(client, userdata, sock):
+    if isinstance(sock, mqtt.WebsocketWrapper):
+        sock = sock._socket
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError as e:
+        logging.debug(f"Could not set TCP_NODELAY: {e}")
+
+
+# Report needs pandas, seaborn and matplotlib, so it is imported only when a report is generated, never with --no-report.
+def generate_report(args, db_path):
+    if getattr(args, 'no_report', False):
+        print(f"Report skipped, render it later with: python MQTTLoadTester.py report {db_path}")
+        return
+    from Report import generate_reports
+    generate_reports(db_path)
+
+
+# "0,1,2" -> [0, 1, 2]. Messages cycle through the listed QoS levels.
+def parse_qos_levels(value):
+    levels = [int(level) for level in str(value).split(",") if level.strip()]
+    if not levels or any(level not in (0, 1, 2) for level in levels):
+        raise ValueError(f"QoS levels must be 0, 1 or 2: {value}")
+    return levels
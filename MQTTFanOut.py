@@ -0,0 +1,277 @@
+import asyncio
+import datetime
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from MQTTClient import MQTTClient, print_percentiles, generate_report
+from AsyncMQTTClient import run_async_clients
+from TimeoutScheduler import TimeoutScheduler
+from LoadProfile import LoadProfile
+from LatencyHistogram import HistogramSet, histogram_path
+from LiveMetrics import LiveMetrics, MetricsCollector
+from SQLiteDB import SQLiteDB
+logger = logging.getLogger(__name__)
+
+    # Simulates many devices by running --clients MQTTClient connections at once.
+    # Clients are spread over --processes worker processes (0: one per CPU core) and run as threads inside each process,
+    # or as coroutines on one event loop per process with the asyncio engine.
+    # With several processes the parent is the coordinator: every worker runs its own client loops, stores its results in
+    # its own shard database and streams live metrics snapshots and, at the end, its latency histograms to the parent
+    # over a multiprocessing queue. Once the clients of every worker are connected the coordinator sets one start time,
+    # so all send schedules begin together. The shards are merged into one database tagged by client ID for the report.
+
+START_DELAY = 0.5 # Seconds between the coordinator setting the start time and the start, for every worker to see it.
+
+
+# Stand-in for SQLiteDB inside the publisher and subscriber processes of --role split. Forwards every result row to the parent process.
+class ResultQueueWriter:
+    def __init__(self, result_queue):
+        self.result_queue = result_queue
+        self.db_file = None
+
+    def insert_result(self, *args, **kwargs):
+        self.result_queue.put(("result", args, kwargs))
+
+    def insert_connection_event(self, *args, **kwargs):
+        self.result_queue.put(("event", args, kwargs))
+
+    # Results are written by the parent process.
+    def flush(self):
+        pass
+
+
+# Common start of the send schedules of every worker process. Each client waits on it once it is connected, the worker
+# reports ready when all its clients are waiting and the coordinator sets the start as a wall clock time.
+class StartGate:
+    def __init__(self, worker_id, client_count, result_queue, start_event, start_time):
+        self.worker_id = worker_id
+        self.client_count = client_count
+        self.result_queue = result_queue
+        self.start_event = start_event # multiprocessing.Event, set by the coordinator.
+        self.start_time = start_time # multiprocessing.Value, time.time() of the start.
+        self.waiting = 0
+        self.lock = threading.Lock()
+        self.started = None # Future of the one start_event.wait() of an asyncio worker.
+
+    def arrive(self):
+        with self.lock:
+            self.waiting += 1
+            if self.waiting == self.client_count:
+                self.result_queue.put(("ready", None, self.worker_id))
+
+    # The start on the perf_counter clock of this process.
+    def start(self):
+        return time.perf_counter() + (self.start_time.value - time.time())
+
+    # Blocks the sender thread of a paho client.
+    def wait(self):
+        self.arrive()
+        self.start_event.wait()
+        return self.start()
+
+    # Clients on an event loop share one executor thread waiting for the start.
+    async def wait_async(self):
+        self.arrive()
+        if self.started is None:
+            self.started = asyncio.get_running_loop().run_in_executor(None, self.start_event.wait)
+        await self.started
+        return self.start()
+
+
+# Start all clients, wait until every client has sent its messages and return their summaries and merged latency histograms.
+def run_clients(args, db, client_indices, collector=None, start_gate=None):
+    if args.engine == "asyncio":
+        return run_async_clients(args, db, client_indices, collector, start_gate) # One event loop per process.
+    # One timeout scheduler thread serves every client of this process.
+    scheduler = TimeoutScheduler()
+    scheduler.start()
+    clients = [MQTTClient(args, db, client_index, scheduler) for client_index in client_indices]
+    for mqtt_client in clients:
+        mqtt_client.start_gate = start_gate
+    if collector is not None:
+        collector.add_clients(clients)
+
+    # CTRL + C stops the sender loops, results collected so far are still stored.
+    def handle_signal(signal_number, frame):
+        for mqtt_client in clients:
+            mqtt_client.stop_event.set()
+    signal.signal(signal.SIGINT, handle_signal)
+
+    for mqtt_client in clients:
+        try:
+            mqtt_client.start()
+        except Exception as e:
+            logging.error(f"Client {mqtt_client.client_id} failed to start: {e}")
+            mqtt_client.stop_event.set()
+    for mqtt_client in clients:
+        mqtt_client.stop()
+    scheduler.stop()
+    histograms = HistogramSet()
+    for mqtt_client in clients:
+        histograms.merge(mqtt_client.histograms)
+    return [mqtt_client.summary() for mqtt_client in clients], histograms
+
+
+# Send live metrics snapshots of this worker to the parent process until stopped.
+def forward_metrics(collector, worker_id, result_queue, interval, stop_event):
+    while not stop_event.wait(interval):
+        snapshot = collector.snapshot()
+        snapshot["histogram"] = snapshot["histogram"].to_dict()
+        result_queue.put(("metrics", snapshot, worker_id))
+
+
+# Entry point of a worker process. Results go to the shard database of the worker, live totals and histograms to the coordinator.
+def worker_main(args, worker_id, client_indices, result_queue, shard_file, start_event, start_time):
+    summaries = []
+    histograms = HistogramSet()
+    stop_event = threading.Event()
+    collector = MetricsCollector()
+    threading.Thread(target=forward_metrics, args=(collector, worker_id, result_queue, args.stats_interval or args.status_interval, stop_event),
+                     daemon=True).start()
+    db = None
+    try:
+        db = SQLiteDB(batch_size=args.db_batch_size, flush_interval=args.db_flush_interval, journal_mode=args.db_journal_mode,
+                      synchronous=args.db_synchronous, status_interval=None, db_file=shard_file)
+        start_gate = StartGate(worker_id, len(client_indices), result_queue, start_event, start_time)
+        summaries, histograms = run_clients(args, db, client_indices, collector, start_gate)
+    except Exception as e:
+        logging.error(f"Worker for clients {client_indices} failed: {e}")
+    finally:
+        stop_event.set()
+        if db is not None:
+            db.close_connection() # Every result is in the shard before the coordinator merges it.
+        result_queue.put(("done", summaries, histograms.to_dict()))
+
+
+class MQTTFanOut:
+    def __init__(self, args, db):
+        self.args = args
+        self.db = db
+        self.summaries = []
+        self.histograms = HistogramSet() # Merged from every client.
+
+    # Spread client indices evenly over the worker processes.
+    def partition_clients(self):
+        process_count = max(1, min(self.args.processes or os.cpu_count() or 1, self.args.clients))
+        client_indices = list(range(1, self.args.clients + 1))
+        return [client_indices[i::process_count] for i in range(process_count)]
+
+    def run(self):
+        start_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        partitions = self.partition_clients()
+        print(f"Beginning loadtest at {start_time}: {self.args.clients} clients in {len(partitions)} processes, "
+              f"each sending {LoadProfile.from_args(self.args).describe()}.")
+
+        collector = MetricsCollector(self.db)
+        live_metrics = LiveMetrics.from_args(collector, self.args)
+        if live_metrics is not None:
+            live_metrics.start()
+        if len(partitions) == 1:
+            self.summaries, self.histograms = run_clients(self.args, self.db, partitions[0], collector)
+        else:
+            self.run_processes(partitions, collector, print_status=not self.args.stats_interval)
+        if live_metrics is not None:
+            live_metrics.stop()
+        self.db.flush() # Every result must be in the database before statistics and the report read it.
+        self.histograms.save(histogram_path(self.db.db_file))
+        print()
+
+        self.print_statistics()
+        print_percentiles(self.histograms)
+        self.generate_report(self.db.db_file)
+        successful_messages = sum(summary["Successful"] for summary in self.summaries)
+        failed_messages = sum(summary["Failed"] for summary in self.summaries)
+        timeout_messages = sum(summary["Timeout"] for summary in self.summaries)
+        end_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        print(f"Ending loadtest at {end_time} - Sent {successful_messages} messages successfully, {failed_messages} failed and {timeout_messages} timeout messages.")
+        duplicate_messages, late_messages, reordered_messages = (sum(summary[key] for summary in self.summaries) for key in ("Duplicates", "Late", "Reordered"))
+        print(f"Duplicate messages {duplicate_messages}, late messages (after timeout) {late_messages}, reordered messages {reordered_messages}.")
+        disconnects = sum(summary.get("Disconnects", 0) for summary in self.summaries)
+        if disconnects:
+            print(f"Disconnects {disconnects}, see the connection_events table.")
+        logging.info("All messages processed. Exiting...")
+
+    # Coordinate the worker processes: start them together, aggregate their live totals and histograms until every
+    # worker is done and merge their shard databases into the run database.
+    def run_processes(self, partitions, collector, print_status=True):
+        result_queue = multiprocessing.Queue()
+        start_event = multiprocessing.Event()
+        start_time = multiprocessing.Value('d', 0.0)
+        shard_files = [f"{os.path.splitext(self.db.db_file)[0]}_worker{worker_id}.sqlite" for worker_id in range(len(partitions))]
+        processes = [multiprocessing.Process(target=worker_main, args=(self.args, worker_id, client_indices, result_queue,
+                                                                      shard_files[worker_id], start_event, start_time))
+                     for worker_id, client_indices in enumerate(partitions)]
+        # Workers handle CTRL + C themselves, the parent keeps collecting until they finish.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            process.start()
+
+        workers_ready = 0
+        workers_done = 0
+        ready_deadline = time.monotonic() + self.args.timeout
+        last_status_time = 0.0
+        while workers_done < len(processes):
+            # Start once the clients of every worker are connected, or after --timeout without the missing ones.
+            if not start_event.is_set() and (workers_ready == len(processes) or time.monotonic() > ready_deadline):
+                if workers_ready < len(processes):
+                    logging.warning(f"{len(processes) - workers_ready} of {len(processes)} workers not connected after {self.args.timeout} s, starting without waiting for them.")
+                start_time.value = time.time() + START_DELAY
+                start_event.set()
+            try:
+                kind, payload, extra = result_queue.get(timeout=0.1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    logging.error("Worker processes exited without reporting results.")
+                    break
+                continue
+            if kind == "ready":
+                workers_ready += 1
+            elif kind == "metrics":
+                collector.update_remote(extra, payload)
+                if print_status and time.monotonic() - last_status_time >= self.args.status_interval:
+                    last_status_time = time.monotonic()
+                    self.print_status(collector)
+            elif kind == "done":
+                self.summaries.extend(payload)
+                self.histograms.merge(HistogramSet.from_dict(extra))
+                workers_done += 1
+
+        for process in processes:
+            process.join()
+        for shard_file in shard_files:
+            if os.path.exists(shard_file):
+                self.db.merge_results(shard_file)
+                for path in (shard_file, f"{shard_file}-wal", f"{shard_file}-shm"):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    # Live totals of every worker on one line, when --stats-interval does not print them.
+    def print_status(self, collector):
+        totals = collector.remote_totals()
+        sys.stdout.write(f"\r\033[KSent {totals['sent']}, received {totals['received']}, in flight {totals['in_flight']}, "
+                         f"timed out {totals['timed_out']}. ")
+        sys.stdout.flush()
+
+    # Per-client and aggregate latency and throughput.
+    def print_statistics(self):
+        if not self.args.store_rows:
+            print("Per-client statistics need per-message rows, use --store-rows true.")
+            return
+        header = f"{'ClientId':<40}{'Received':>10}{'Failed':>8}{'Min (ms)':>12}{'Average (ms)':>14}{'Max (ms)':>12}{'Msgs/s':>10}"
+        print(header)
+        for row in self.db.client_statistics() + self.db.client_statistics(per_client=False):
+            print(f"{row['ClientId']:<40}{row['Received']:>10}{row['Failed']:>8}"
+                  f"{format_number(row['Min (ms)']):>12}{format_number(row['Average (ms)']):>14}"
+                  f"{format_number(row['Max (ms)']):>12}{format_number(row['Msgs/s']):>10}")
+
+    def generate_report(self, db_path):
+        generate_report(self.args, db_path)
+
+
+def format_number(value):
+    return "N/A" if value is None else f"{value:.3f}"
@@ -1,18 +1,88 @@
 import os
+import sys
 import logging
 import argparse
-from MQTTClient import MQTTClient
+import datetime
+from MQTTClient import MQTTClient, parse_qos_levels
+from AsyncMQTTClient import AsyncMQTTClient
+from MQTTFanOut import MQTTFanOut
+from MQTTSplit import MQTTSplit, ROLE_CLIENTS
+from ConnectionStorm import ConnectionStorm
+from MQTTScenario import MQTTScenario
+from Scenario import Scenario
+from MQTTSweep import MQTTSweep, parse_sizes, parse_rates
+from MQTTBenchmark import MQTTBenchmark
+from LocalBroker import broker_main
 from SQLiteDB import SQLiteDB
+from LoadProfile import LoadProfile, PROFILES
+from PayloadCodec import PAYLOAD_FORMATS, BinaryPayloadCodec, parse_size, payload_size
+from InFlightTracker import InFlightTracker, DEFAULT_WINDOW
+from RunHistory import RunHistory, LATENCY_COLUMNS
 from dotenv import load_dotenv
 load_dotenv()
 
     # This script sets up and runs a MQTT client to send messages to an MQTT broker and stores message delay results in a SQLite database.
     # Ensure all required environment variables are set in your .env file or are available in your environment.
     # Use the provided command-line arguments to override any default settings or environment variables.
+    # "compare" as the first argument compares two runs of a --history-db instead of running a test.
+    # "report" as the first argument renders the report of existing results databases.
+    # "broker" runs the local MQTT broker stand-in, "benchmark" measures the tester's own ceiling against it.
+    # The reporting stack (pandas, seaborn, matplotlib) is only imported when a report is generated.
 
 def main():
-    #Command-Line Argument Configuration.
-    parser = argparse.ArgumentParser(description="Use the provided command-line arguments to override any default settings or environment variables.")
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        sys.exit(compare_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "report":
+        sys.exit(report_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "broker":
+        sys.exit(broker_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        sys.exit(benchmark_main(sys.argv[2:]))
+
+    parser = build_parser()
+    args = parser.parse_args()
+    configure_logging(args.verbose)
+    validate_args(parser, args)
+    scenario = None
+    if args.scenario:
+        if args.role != "both" or args.clients > 1 or args.engine != "paho" or args.storm_connections:
+            parser.error("--scenario defines its own clients, without --role, --clients, --engine asyncio or --storm-connections.")
+        try:
+            scenario = Scenario.load(args.scenario)
+        except (OSError, ValueError) as e:
+            parser.error(f"Invalid scenario {args.scenario}: {e}")
+
+    # Initialize SQLite database.
+    db = SQLiteDB(batch_size=args.db_batch_size, flush_interval=args.db_flush_interval, journal_mode=args.db_journal_mode,
+                  synchronous=args.db_synchronous, status_interval=args.status_interval)
+    start_time = datetime.datetime.now(datetime.timezone.utc)
+    # Initialize MQTT client, or many of them in fan-out mode.
+    if scenario is not None:
+        MQTTScenario(args, db, scenario).run()
+    elif args.sweep_sizes:
+        MQTTSweep(args, db).run()
+    elif args.storm_connections:
+        ConnectionStorm(args, db).run()
+    elif args.role == "split":
+        MQTTSplit(args, db).run()
+    elif args.role in ROLE_CLIENTS:
+        ROLE_CLIENTS[args.role](args, db).connect_and_loop()
+    elif args.clients > 1:
+        MQTTFanOut(args, db).run()
+    else:
+        mqtt_client = AsyncMQTTClient(args, db) if args.engine == "asyncio" else MQTTClient(args, db)
+        mqtt_client.connect_and_loop()
+    db.close_connection()
+    if args.history_db:
+        history = RunHistory(args.history_db)
+        run_id = history.record_run(args, db.db_file, start_time, datetime.datetime.now(datetime.timezone.utc), args.run_label)
+        history.close()
+        print(f"Run {run_id} recorded in {args.history_db}.")
+
+
+# Command-Line Argument Configuration, shared by test runs and the benchmark.
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Use the provided command-line arguments to override any default settings or environment variables.")
     parser.add_argument("--username", type=str, default=os.getenv('MQTT_TESTERI_USERNAME'), help="Give an username")
     parser.add_argument("--password", type=str, default=os.getenv('MQTT_TESTERI_PASSWORD'), help="Give a password")
     parser.add_argument("--host", type=str, default=os.getenv('MQTT_TESTERI_HOST'), help="Give an adress")
@@ -26,17 +96,231 @@ def main():
     # Message configuration and verbose.
     parser.add_argument("--message-count", type=int, default=10, help="Number of messages to send.")
     parser.add_argument("--interval", type=float, default=1.0, help="Interval between messages in seconds.")
-    parser.add_argument("--data-string-length", type=int, default=55, help="Length of the data string to send.")
+    parser.add_argument("--data-string-length", type=parse_size, default=55, help="Length of the data string to send, in bytes or with a KB / MB suffix (for example 64KB or 1MB).")
+    parser.add_argument("--payload-format", type=str, default="json", choices=PAYLOAD_FORMATS, help="Message payload format: json or a compact fixed-layout binary header.")
+    # QoS and session configuration.
+    parser.add_argument("--qos", type=str, default="0", help="Publish QoS 0, 1 or 2. A list such as 0,1,2 cycles the messages through the levels for a per-QoS comparison.")
+    parser.add_argument("--clean-session", type=str_to_bool, default=True, help="Clean session (true) or persistent session (false). A persistent session uses --client-id without a random suffix.")
+    parser.add_argument("--retain", type=str_to_bool, default=False, help="Publish messages with the retain flag (true/false). The retained message is cleared at the end of the run.")
     parser.add_argument("--timeout", type=int, default=60, help=("Sets the maximum number of seconds to wait between messages to be sent and received before timing out." 
                         "This helps prevent indefinite hangs if the network or broker becomes unresponsive during load testing."))
-    args = parser.parse_args()
+    # Connection loss.
+    parser.add_argument("--reconnect", type=str_to_bool, default=True, help="Reconnect and subscribe again when the broker drops the connection (true/false). With false the run ends. paho engine only.")
+    parser.add_argument("--reconnect-min-delay", type=float, default=1.0, help="Seconds before the first reconnect attempt, doubled on every failed attempt.")
+    parser.add_argument("--reconnect-max-delay", type=float, default=30.0, help="Longest wait between reconnect attempts in seconds.")
+    parser.add_argument("--recovery-window", type=float, default=5.0, help="Seconds after a reconnect whose latency counts as recovery instead of steady state.")
+    # One-way latency with a separate publisher and subscriber.
+    parser.add_argument("--role", type=str, default="both", choices=["both", "split", "publisher", "subscriber"],
+                        help="both: one client publishes and subscribes. split: publisher and subscriber in two processes. "
+                             "publisher / subscriber: one side only, to run the two sides on different hosts.")
+    parser.add_argument("--return-echo", type=str_to_bool, default=False, help="Echo every received message to <topic>/return and measure the round trip (true/false).")
+    parser.add_argument("--clock-sync", type=str_to_bool, default=True, help="Calibrate the subscriber clock offset to the publisher (true/false). Disable only when both sides share a monotonic clock.")
+    parser.add_argument("--inflight-window", type=int, default=DEFAULT_WINDOW, help="Message indices per client remembered for duplicate and late message detection (multiple of 8).")
+    # Load profile. Sends follow an open-loop schedule of absolute deadlines.
+    parser.add_argument("--rate", type=float, default=None, help="Target messages per second. Defaults to 1 / --interval.")
+    parser.add_argument("--profile", type=str, default="constant", choices=PROFILES, help="Load profile: constant, ramp, step, spike or soak.")
+    parser.add_argument("--duration", type=float, default=None, help="Run for this many seconds instead of --message-count messages. Required for soak.")
+    parser.add_argument("--start-rate", type=float, default=1.0, help="Rate at the start of ramp and step profiles (msgs/s).")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds to ramp from --start-rate to --rate.")
+    parser.add_argument("--step-rate", type=float, default=None, help="Rate added every --step-duration seconds in the step profile (msgs/s).")
+    parser.add_argument("--step-duration", type=float, default=10.0, help="Length of one step in seconds.")
+    parser.add_argument("--spike-rate", type=float, default=None, help="Rate during the spike (msgs/s).")
+    parser.add_argument("--spike-start", type=float, default=0.0, help="Seconds from the start of the run when the spike begins.")
+    parser.add_argument("--spike-duration", type=float, default=0.0, help="Length of the spike in seconds.")
+    parser.add_argument("--engine", type=str, default="paho", choices=["paho", "asyncio"], help="Client engine: paho threads or one asyncio event loop per process (mqtt protocol only).")
+    # Live metrics during the run.
+    parser.add_argument("--stats-interval", type=float, default=0, help="Print interval statistics every N seconds. 0 disables.")
+    parser.add_argument("--stats-file", type=str, default=None, help="Append the interval statistics as JSON lines to this file.")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve live metrics in Prometheus text format on this port at /metrics.")
+    parser.add_argument("--metrics-host", type=str, default="127.0.0.1", help="Address the metrics endpoint listens on.")
+    # Fan-out configuration.
+    parser.add_argument("--clients", type=int, default=1, help="Number of concurrent MQTT clients to simulate.")
+    parser.add_argument("--processes", type=int, default=1, help="Number of worker processes the clients are spread across, 0 for one per CPU core. Workers start sending together and their results are merged.")
+    parser.add_argument("--shared-topic", type=str_to_bool, default=False, help="All clients publish to --topic instead of their own --topic/<client index> (true/false).")
+    # Message size and rate sweep.
+    parser.add_argument("--sweep-sizes", type=str, default=None, help="Run one step per payload size and rate, for example 64,1KB,64KB,1MB, and report latency and MB/s per step.")
+    parser.add_argument("--sweep-rates", type=str, default=None, help="Rates of the sweep in msgs/s, for example 10,100,1000. Defaults to --rate.")
+    parser.add_argument("--sweep-step-duration", type=float, default=10.0, help="Seconds every sweep step sends for.")
+    parser.add_argument("--sweep-efficiency", type=float, default=0.9, help="A step is saturated when it delivers less than this fraction of its rate or loses messages.")
+    parser.add_argument("--sweep-stop-on-saturation", type=str_to_bool, default=True, help="Skip the higher rates of a payload size once it is saturated (true/false).")
+    # Topic fan-in / fan-out workload.
+    parser.add_argument("--scenario", type=str, default=None, help="JSON or YAML scenario file with topic trees, publishers per topic, subscriber counts and wildcard filters, relative to --topic.")
+    # Connection storm instead of a message test.
+    parser.add_argument("--storm-connections", type=int, default=0, help="Open and close this many connections and measure connect, TLS handshake, CONNACK and SUBACK latency instead of sending messages. 0 disables.")
+    parser.add_argument("--storm-rate", type=float, default=10.0, help="Connections opened per second in the connection storm.")
+    parser.add_argument("--storm-burst", type=int, default=1, help="Connections opened at once, bursts are spaced to average --storm-rate.")
+    parser.add_argument("--storm-hold", type=float, default=0.0, help="Seconds every storm connection stays open before it disconnects.")
+    parser.add_argument("--storm-concurrency", type=int, default=200, help="Threads opening and holding storm connections, the maximum number of connections open at once.")
+    # Results database configuration.
+    parser.add_argument("--db-batch-size", type=int, default=1, help="Results written per transaction by a background writer thread. 1 writes every result immediately.")
+    parser.add_argument("--db-flush-interval", type=float, default=0.5, help="Maximum seconds a result waits in the writer queue before its batch is written.")
+    parser.add_argument("--db-journal-mode", type=str, default="WAL", choices=["WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF"], help="SQLite journal mode.")
+    parser.add_argument("--db-synchronous", type=str, default="NORMAL", choices=["OFF", "NORMAL", "FULL", "EXTRA"], help="SQLite synchronous setting. OFF is fastest but not crash safe.")
+    parser.add_argument("--store-rows", type=str_to_bool, default=True, help="Store a row for every message (true/false). With false only failed messages are stored and latency is kept in the histogram file.")
+    parser.add_argument("--stage-timing", type=str_to_bool, default=False, help="Time every stage of the message path (encode, publish, transit, decode, queue, store) to tell broker latency from tester overhead (true/false).")
+    parser.add_argument("--status-interval", type=float, default=0.5, help="Minimum seconds between status line updates during the run.")
+    parser.add_argument("--no-report", action="store_true", help="Only store the raw results, do not generate the report. Render it later with the report command.")
+    # Run history.
+    parser.add_argument("--history-db", type=str, default=None, help="Also record the run, its latency aggregates and its results in this consolidated database.")
+    parser.add_argument("--run-label", type=str, default=None, help="Label of the run in --history-db, for example the broker version.")
+    return parser
+
+
+# Longest client ID the clients of a run generate: random suffix, fan-out index, split side and sweep or benchmark step.
+def longest_client_id(args):
+    step_prefixes = ["memory-"] if getattr(args, 'benchmark_memory_rate', None) else []
+    if args.sweep_sizes:
+        steps = len(parse_sizes(args.sweep_sizes)) * (len(parse_rates(args.sweep_rates)) if args.sweep_rates else 1)
+        step_prefixes.append(f"step{steps}-")
+    client_id = f"{args.client_id}{max(step_prefixes, key=len, default='')}"
+    if args.clean_session:
+        client_id += "000"
+    if args.clients > 1:
+        client_id += f"-{args.clients}"
+    if args.role != "both":
+        client_id += "-pub"
+    return client_id
+
+
+def validate_args(parser, args):
+    try:
+        LoadProfile.from_args(args)
+        parse_qos_levels(args.qos)
+        InFlightTracker(args.inflight_window)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.storm_connections and (args.storm_rate <= 0 or args.storm_burst < 1 or args.storm_concurrency < 1 or args.storm_hold < 0):
+        parser.error("--storm-rate must be above 0, --storm-burst and --storm-concurrency at least 1 and --storm-hold not negative.")
+    if args.sweep_sizes:
+        try:
+            if not parse_sizes(args.sweep_sizes):
+                raise ValueError("--sweep-sizes needs at least one size.")
+            if args.sweep_rates:
+                parse_rates(args.sweep_rates)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.role != "both" or args.clients > 1 or args.scenario or args.storm_connections or args.sweep_step_duration <= 0:
+            parser.error("--sweep-sizes runs one client per step, without --role, --clients, --scenario or --storm-connections, and needs a positive --sweep-step-duration.")
+    if args.payload_format == "binary" and len(longest_client_id(args).encode()) > BinaryPayloadCodec.CLIENT_ID_BYTES:
+        parser.error(f"--payload-format binary carries client IDs of up to {BinaryPayloadCodec.CLIENT_ID_BYTES} bytes, this run generates IDs like "
+                     f"{longest_client_id(args)}. Shorten --client-id.")
+    if args.reconnect_min_delay <= 0 or args.reconnect_max_delay < args.reconnect_min_delay or args.recovery_window < 0:
+        parser.error("--reconnect-min-delay must be above 0, --reconnect-max-delay at least --reconnect-min-delay and --recovery-window not negative.")
+    if args.processes < 0:
+        parser.error("--processes must be 0 (one per CPU core) or more.")
+    if args.role != "both" and (args.clients > 1 or args.engine != "paho"):
+        parser.error("--role split, publisher and subscriber run one paho client per side, without --clients or --engine asyncio.")
+
+
+# Benchmark of the tester against the local broker stand-in. Options not listed here are passed to the test run,
+# for example --engine asyncio, --qos 1, --payload-format binary, --data-string-length 1KB or --db-batch-size 500.
+def benchmark_main(argv):
+    parser = argparse.ArgumentParser(prog="MQTTLoadTester.py benchmark", description="Measure max sustainable msgs/s, CPU per message and memory per in-flight message "
+                                     "of the tester against the local broker. Other options are the options of a test run.")
+    parser.add_argument("--rates", type=str, default="500,1000,2000,4000,8000,16000", help="Rates of the throughput steps in msgs/s, lowest first. Stops at the first saturated step.")
+    parser.add_argument("--step-duration", type=float, default=5.0, help="Seconds every throughput step sends for.")
+    parser.add_argument("--efficiency", type=float, default=0.95, help="A step is saturated when it delivers less than this fraction of its rate or loses messages.")
+    parser.add_argument("--memory-rate", type=float, default=1000.0, help="Send rate of the memory step in msgs/s.")
+    parser.add_argument("--memory-hold", type=float, default=5.0, help="Seconds the broker holds every delivery in the memory step, messages in flight are about --memory-rate times this.")
+    parser.add_argument("--broker-host", type=str, default="127.0.0.1", help="Address the local broker listens on, on free ports.")
+    parser.add_argument("--benchmark-file", type=str, default="mqtt_testeri_benchmarks.jsonl", help="Append the benchmark as a JSON line to this file and compare with its previous entry.")
+    benchmark_args, test_argv = parser.parse_known_args(argv)
+    test_parser = build_parser(prog="MQTTLoadTester.py benchmark")
+    args = test_parser.parse_args(["--host", benchmark_args.broker_host, "--client-id", "benchmark-", "--topic", "mqtt_testeri/benchmark",
+                                   "--ssl-enabled", "false"] + test_argv)
     configure_logging(args.verbose)
+    try:
+        args.sweep_rates = ",".join(f"{rate:g}" for rate in parse_rates(benchmark_args.rates))
+    except ValueError as e:
+        parser.error(str(e))
+    if benchmark_args.step_duration <= 0 or not 0 < benchmark_args.efficiency <= 1 or benchmark_args.memory_rate <= 0 or benchmark_args.memory_hold <= 0:
+        parser.error("--step-duration, --memory-rate and --memory-hold must be above 0 and --efficiency between 0 and 1.")
+    if args.role != "both" or args.clients > 1 or args.processes != 1 or args.scenario or args.storm_connections or args.sweep_sizes:
+        parser.error("The benchmark runs one client per step, without --role, --clients, --processes, --scenario, --storm-connections or --sweep-sizes.")
+    # Steps send --data-string-length like a normal run, their size is the whole encoded payload as in the sweep.
+    args.sweep_sizes = str(payload_size(args.payload_format, f"{args.client_id}step1-000", args.data_string_length))
+    args.sweep_step_duration = benchmark_args.step_duration
+    args.sweep_efficiency = benchmark_args.efficiency
+    args.sweep_stop_on_saturation = True
+    args.benchmark_broker_host = benchmark_args.broker_host
+    args.benchmark_memory_rate = benchmark_args.memory_rate
+    args.benchmark_memory_hold = benchmark_args.memory_hold
+    args.benchmark_file = benchmark_args.benchmark_file
+    validate_args(test_parser, args)
+    db = SQLiteDB(batch_size=args.db_batch_size, flush_interval=args.db_flush_interval, journal_mode=args.db_journal_mode,
+                  synchronous=args.db_synchronous, status_interval=args.status_interval)
+    MQTTBenchmark(args, db).run()
+    db.close_connection()
+    return 0
 
-    # Initialize SQLite database.
-    db = SQLiteDB()
-    # Initialize MQTT client.
-    mqtt_client = MQTTClient(args, db)
-    mqtt_client.connect_and_loop()
+
+# Compare a candidate run with a baseline run of a history database. Returns 1 when a threshold is breached.
+def compare_main(argv):
+    parser = argparse.ArgumentParser(prog="MQTTLoadTester.py compare", description="Compare the latency and throughput of two runs recorded with --history-db.")
+    parser.add_argument("--history-db", type=str, required=True, help="History database the runs were recorded in.")
+    parser.add_argument("--candidate", type=str, default=None, help="Run ID or label (latest run with that label). Defaults to the latest run.")
+    parser.add_argument("--baseline", type=str, default=None, help="Run ID or label. Defaults to the run before the candidate.")
+    parser.add_argument("--metric", type=str, default="delivery", help="Latency histogram to compare, for example delivery, round_trip or publish_ack_qos_1.")
+    parser.add_argument("--percentiles", type=str, default="50,99", help="Percentiles checked against --max-latency-increase.")
+    parser.add_argument("--max-latency-increase", type=float, default=10.0, help="Regression when a checked percentile grows by more than this many percent.")
+    parser.add_argument("--max-throughput-decrease", type=float, default=10.0, help="Regression when msgs/s drops by more than this many percent.")
+    args = parser.parse_args(argv)
+    configure_logging(False)
+    percentiles = [f"p{float(percent):g} (ms)" for percent in args.percentiles.split(",") if percent.strip()]
+    if any(percentile not in LATENCY_COLUMNS for percentile in percentiles):
+        parser.error(f"--percentiles must be from {', '.join(column[1:-5] for column in LATENCY_COLUMNS if column.startswith('p'))}.")
+    if not os.path.exists(args.history_db):
+        parser.error(f"History database {args.history_db} does not exist.")
+
+    history = RunHistory(args.history_db)
+    candidate = history.resolve_run(args.candidate)
+    baseline = history.resolve_run(args.baseline) if args.baseline else history.resolve_run(None, before=candidate)
+    if candidate is None or baseline is None:
+        history.close()
+        parser.error("Two recorded runs are needed, check --baseline and --candidate.")
+    missing = [role for role, run_id in (("baseline", baseline), ("candidate", candidate)) if not history.latency(run_id, args.metric)]
+    if missing: # Without latency rows no regression could be flagged, a CI gate would pass silently.
+        common = sorted(set(history.metrics(baseline)) & set(history.metrics(candidate)))
+        history.close()
+        parser.error(f"No {args.metric} latency recorded for the {' and '.join(missing)} run. --metric of both runs: {', '.join(common) or 'none'}.")
+    for role, run_id in (("Baseline", baseline), ("Candidate", candidate)):
+        info = history.run_info(run_id)
+        print(f"{role:<10} run {info['RunId']} {info['Label'] or ''} {info['Broker']} {info['StartTimeUTC']}")
+    rows = history.compare(baseline, candidate, args.metric, percentiles, args.max_latency_increase, args.max_throughput_decrease)
+    history.close()
+
+    print(f"{'Metric':<16}{'Baseline':>14}{'Candidate':>14}{'Change (%)':>12}")
+    for row in rows:
+        print(f"{row['Metric']:<16}{format_value(row['Baseline']):>14}{format_value(row['Candidate']):>14}"
+              f"{format_value(row['Change (%)'], '+.1f'):>12}{'  REGRESSION' if row['Regression'] else ''}")
+    regressions = [row for row in rows if row["Regression"]]
+    if regressions:
+        print(f"{len(regressions)} regression(s) above the thresholds: {', '.join(row['Metric'] for row in regressions)}.")
+        return 1
+    print("No regressions above the thresholds.")
+    return 0
+
+
+# Render the report of results databases written earlier, for example by runs with --no-report.
+def report_main(argv):
+    parser = argparse.ArgumentParser(prog="MQTTLoadTester.py report", description="Generate the report of existing results databases.")
+    parser.add_argument("db_files", nargs="+", help="Results database (mqtt_testeri_results_<timestamp>.sqlite). The histogram file next to it is used when it exists.")
+    args = parser.parse_args(argv)
+    configure_logging(False)
+    missing = [db_file for db_file in args.db_files if not os.path.exists(db_file)]
+    if missing:
+        parser.error(f"Results database {', '.join(missing)} does not exist.")
+    from Report import generate_reports
+    for db_file in args.db_files:
+        generate_reports(db_file)
+        print(f"Report of {db_file} generated.")
+    return 0
+
+
+def format_value(value, spec=".3f"):
+    if value is None:
+        return "N/A"
+    return f"{value:{spec}}" if isinstance(value, float) else str(value)
 
     # Verbose settings.
 def configure_logging(verbose):
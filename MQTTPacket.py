@@ -0,0 +1,177 @@
+import struct
+
+    # Minimal MQTT 3.1.1 packet encoding and decoding for the asyncio engine and the local broker (LocalBroker.py).
+    # Only the packets the load tester and the broker stand-in need are implemented.
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+class MQTTProtocolError(Exception):
+    pass
+
+
+def encode_remaining_length(length):
+    encoded = bytearray()
+    while True:
+        digit = length % 128
+        length //= 128
+        if length:
+            digit |= 0x80
+        encoded.append(digit)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value):
+    if isinstance(value, str):
+        value = value.encode()
+    return struct.pack("!H", len(value)) + value
+
+
+def decode_string(body, offset):
+    length = struct.unpack_from("!H", body, offset)[0]
+    start = offset + 2
+    return bytes(body[start:start + length]).decode(), start + length
+
+
+def fixed_header(packet_type, flags, remaining_length):
+    return bytes([(packet_type << 4) | flags]) + encode_remaining_length(remaining_length)
+
+
+def connect_packet(client_id, username=None, password=None, keepalive=60, clean_session=True):
+    flags = 0x02 if clean_session else 0x00
+    payload = encode_string(client_id)
+    if username is not None:
+        flags |= 0x80
+        payload += encode_string(username)
+        if password is not None:
+            flags |= 0x40
+            payload += encode_string(password)
+    variable_header = encode_string("MQTT") + bytes([4, flags]) + struct.pack("!H", keepalive)
+    body = variable_header + payload
+    return fixed_header(CONNECT, 0, len(body)) + body
+
+
+def subscribe_packet(packet_id, topic, qos=0):
+    body = struct.pack("!H", packet_id) + encode_string(topic) + bytes([qos])
+    return fixed_header(SUBSCRIBE, 0x02, len(body)) + body
+
+
+def publish_packet(topic, payload, qos=0, packet_id=None, retain=False, dup=False):
+    if isinstance(payload, str):
+        payload = payload.encode()
+    variable_header = encode_string(topic)
+    if qos > 0:
+        variable_header += struct.pack("!H", packet_id)
+    flags = (0x08 if dup else 0) | (qos << 1) | (0x01 if retain else 0)
+    return fixed_header(PUBLISH, flags, len(variable_header) + len(payload)) + variable_header + payload
+
+
+# PUBACK, PUBREC, PUBREL and PUBCOMP only carry the packet identifier.
+def ack_packet(packet_type, packet_id):
+    flags = 0x02 if packet_type == PUBREL else 0
+    return fixed_header(packet_type, flags, 2) + struct.pack("!H", packet_id)
+
+
+def pingreq_packet():
+    return fixed_header(PINGREQ, 0, 0)
+
+
+def connack_packet(return_code, session_present=False):
+    return fixed_header(CONNACK, 0, 2) + bytes([0x01 if session_present else 0x00, return_code])
+
+
+def suback_packet(packet_id, granted_qos):
+    body = struct.pack("!H", packet_id) + bytes(granted_qos)
+    return fixed_header(SUBACK, 0, len(body)) + body
+
+
+def unsuback_packet(packet_id):
+    return fixed_header(UNSUBACK, 0, 2) + struct.pack("!H", packet_id)
+
+
+def pingresp_packet():
+    return fixed_header(PINGRESP, 0, 0)
+
+
+def disconnect_packet():
+    return fixed_header(DISCONNECT, 0, 0)
+
+
+# Read one packet from an asyncio StreamReader. Returns (packet type, flags, body).
+async def read_packet(reader):
+    first_byte = (await reader.readexactly(1))[0]
+    multiplier = 1
+    remaining_length = 0
+    for _ in range(4):
+        digit = (await reader.readexactly(1))[0]
+        remaining_length += (digit & 0x7F) * multiplier
+        if not digit & 0x80:
+            break
+        multiplier *= 128
+    else:
+        raise MQTTProtocolError("Malformed remaining length.")
+    body = await reader.readexactly(remaining_length) if remaining_length else b""
+    return first_byte >> 4, first_byte & 0x0F, body
+
+
+# Returns (topic, payload, qos, packet id, retain).
+def parse_publish(flags, body):
+    qos = (flags >> 1) & 0x03
+    topic, offset = decode_string(body, 0)
+    packet_id = None
+    if qos > 0:
+        packet_id = struct.unpack_from("!H", body, offset)[0]
+        offset += 2
+    return topic, body[offset:], qos, packet_id, bool(flags & 0x01)
+
+
+def parse_packet_id(body):
+    return struct.unpack_from("!H", body, 0)[0]
+
+
+# Returns (protocol name, protocol level, connect flags, keepalive, client id). Will, username and password are not needed.
+def parse_connect(body):
+    protocol_name, offset = decode_string(body, 0)
+    protocol_level, connect_flags = body[offset], body[offset + 1]
+    keepalive = struct.unpack_from("!H", body, offset + 2)[0]
+    client_id, offset = decode_string(body, offset + 4)
+    return protocol_name, protocol_level, connect_flags, keepalive, client_id
+
+
+# Returns (packet id, [(topic filter, requested QoS), ...]).
+def parse_subscribe(body):
+    packet_id = struct.unpack_from("!H", body, 0)[0]
+    offset = 2
+    subscriptions = []
+    while offset < len(body):
+        topic_filter, offset = decode_string(body, offset)
+        subscriptions.append((topic_filter, body[offset] & 0x03))
+        offset += 1
+    if not subscriptions:
+        raise MQTTProtocolError("SUBSCRIBE without topic filters.")
+    return packet_id, subscriptions
+
+
+# Returns (packet id, [topic filter, ...]).
+def parse_unsubscribe(body):
+    packet_id = struct.unpack_from("!H", body, 0)[0]
+    offset = 2
+    topic_filters = []
+    while offset < len(body):
+        topic_filter, offset = decode_string(body, offset)
+        topic_filters.append(topic_filter)
+    return packet_id, topic_filters
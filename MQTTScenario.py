@@ -0,0 +1,278 @@
+import copy
+import datetime
+import heapq
+import logging
+import random
+import signal
+import ssl
+import threading
+import time
+import paho.mqtt.client as mqtt
+from LoadProfile import LoadProfile
+from PayloadCodec import create_codec
+from LatencyHistogram import HistogramSet, histogram_path
+from MQTTClient import MQTTClient, print_percentiles, generate_report, disable_nagle
+logger = logging.getLogger(__name__)
+
+    # Runs a topic fan-in / fan-out workload from a scenario file (Scenario.py).
+    # Subscribers connect and subscribe first, then every publisher sends on its own copy of the load profile,
+    # all schedules merged into one open-loop sender thread. Message indices are unique over the whole run.
+    # Before a message is published it is registered as outstanding with every subscriber whose filter matches the
+    # topic; a receive removes it, so messages left at the end are missing and messages received twice are duplicates.
+    # Delivery latency is recorded per subscription and per topic group, the result rows are stored with the subscriber
+    # client ID, and the totals per group (published, expected, delivered, amplification) in the scenario_groups table.
+
+
+class ScenarioSubscriber:
+    def __init__(self, group, client_id):
+        self.group = group
+        self.client_id = client_id
+        self.outstanding = {} # Message index -> (topic group, publish time, publish datetime, scheduled time, send lag)
+        self.lock = threading.Lock()
+        self.delivered = 0
+        self.duplicates = 0
+        self.client = None
+
+
+class ScenarioPublisher:
+    def __init__(self, group, topic, client_id, subscribers):
+        self.group = group
+        self.topic = topic
+        self.client_id = client_id
+        self.subscribers = subscribers # ScenarioSubscribers whose filter matches the topic.
+        self.client = None
+
+
+class GroupTotals:
+    def __init__(self):
+        self.published = 0
+        self.expected = 0
+        self.delivered = 0
+        self.missing = 0
+        self.duplicates = 0
+
+
+class MQTTScenario:
+    ssl_check = MQTTClient.ssl_check # Same protocol and port checks as the message test.
+    exit_with_message = MQTTClient.exit_with_message
+
+    def __init__(self, args, db, scenario):
+        self.args = args
+        self.db = db
+        self.scenario = scenario
+        self.root = args.topic
+        self.histograms = HistogramSet()
+        self.lock = threading.Lock() # Histograms and totals, updated from every network thread.
+        self.totals = {group.name: GroupTotals() for group in scenario.topic_groups + scenario.subscription_groups}
+        self.stop_event = threading.Event()
+        self.subscribed = threading.Semaphore(0) # Released on every SUBACK.
+        self.ssl_check()
+        prefix = f"{args.client_id}{random.randint(100, 999)}"
+        self.codec = create_codec(getattr(args, 'payload_format', 'json'), prefix, args.data_string_length) # Decodes every sender.
+        self.subscribers = [ScenarioSubscriber(group, f"{prefix}-sub-{group.name}-{number}")
+                            for group in scenario.subscription_groups for number in range(1, group.count + 1)]
+        self.publishers = []
+        for group in scenario.topic_groups:
+            for topic in group.topics:
+                matching = [subscriber for subscriber in self.subscribers if subscriber.group.matches(topic)]
+                for number in range(1, group.publishers + 1):
+                    self.publishers.append(ScenarioPublisher(group, topic, f"{prefix}-pub-{len(self.publishers) + 1}", matching))
+        self.db.create_scenario_table()
+
+    def full_topic(self, topic):
+        return f"{self.root}/{topic}" if self.root else topic
+
+    # Same protocol and TLS setup as MQTTClient.initialize_client.
+    def create_client(self, client_id):
+        if self.args.protocol == 'ws':
+            client = mqtt.Client(client_id, transport='websockets')
+            client.ws_set_options(path="/")
+        else:
+            client = mqtt.Client(client_id)
+        client.on_socket_open = disable_nagle
+        if self.args.ssl_enabled:
+            client.tls_set(cert_reqs=ssl.CERT_NONE) # Bypass certificate verification in test use.
+        client.username_pw_set(self.args.username, self.args.password)
+        return client
+
+    # Connect, subscribe and wait for the SUBACK of every subscriber. Callbacks get the subscriber as user data.
+    def connect_subscribers(self):
+        for subscriber in self.subscribers:
+            client = self.create_client(subscriber.client_id)
+            client.user_data_set(subscriber)
+            client.on_connect = self.on_subscriber_connect
+            client.on_subscribe = self.on_subscribe
+            client.on_message = self.on_message
+            client.connect(self.args.host, self.args.port, 60)
+            client.loop_start()
+            subscriber.client = client
+        deadline = time.perf_counter() + self.args.timeout
+        for subscriber in self.subscribers:
+            if not self.subscribed.acquire(timeout=max(0.0, deadline - time.perf_counter())):
+                raise TimeoutError("Not every subscriber was subscribed within --timeout seconds.")
+
+    def on_subscriber_connect(self, client, subscriber, flags, rc):
+        if rc == 0:
+            client.subscribe(self.full_topic(subscriber.group.filter), subscriber.group.qos)
+        else:
+            logging.error(f"Subscriber {subscriber.client_id} failed to connect with return code {rc}")
+
+    def on_subscribe(self, client, subscriber, mid, granted_qos):
+        self.subscribed.release()
+
+    def connect_publishers(self):
+        for publisher in self.publishers:
+            publisher.client = self.create_client(publisher.client_id)
+            publisher.client.connect(self.args.host, self.args.port, 60)
+            publisher.client.loop_start()
+
+    def profile(self, group):
+        profile = copy.copy(LoadProfile.from_args(self.args))
+        if group.rate is not None:
+            profile.rate = group.rate
+        if self.scenario.duration:
+            profile.duration = self.scenario.duration
+        return profile
+
+    # (offset, publisher number) for every send of every publisher, in time order.
+    def schedule(self):
+        return heapq.merge(*(self.publisher_schedule(number) for number in range(len(self.publishers))))
+
+    # Publishers are spread evenly over one send interval so they do not send in lockstep.
+    def publisher_schedule(self, number):
+        profile = self.profile(self.publishers[number].group)
+        phase = (number / len(self.publishers)) / profile.rate
+        for message_index, offset in profile.schedule():
+            yield offset + phase, number
+
+    def send_messages_loop(self):
+        schedule_start = time.perf_counter()
+        for message_index, (offset, number) in enumerate(self.schedule(), start=1):
+            if self.stop_event.is_set():
+                break
+            delay = schedule_start + offset - time.perf_counter()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+            send_lag = max(0.0, time.perf_counter() - schedule_start - offset) * 1000
+            self.publish(self.publishers[number], message_index, offset, send_lag)
+
+    def publish(self, publisher, message_index, scheduled_time, send_lag):
+        payload, send_time, publish_datetime = self.codec.encode(message_index)
+        group = publisher.group
+        # Registered before the publish, the first subscriber may receive the message before publish() returns.
+        for subscriber in publisher.subscribers:
+            with subscriber.lock:
+                subscriber.outstanding[message_index] = (group, send_time, publish_datetime, scheduled_time, send_lag)
+        try:
+            publisher.client.publish(self.full_topic(publisher.topic), payload, qos=group.qos)
+        except Exception as e:
+            logging.error(f"Publish to {publisher.topic} failed: {e}")
+        with self.lock:
+            self.totals[group.name].published += 1
+            self.totals[group.name].expected += len(publisher.subscribers)
+            for subscriber in publisher.subscribers:
+                self.totals[subscriber.group.name].expected += 1
+
+    def on_message(self, client, subscriber, message):
+        receive_time = time.perf_counter()
+        try:
+            message_index = self.codec.decode(message.payload)[0]
+        except Exception as e:
+            logging.error(f"Undecodable message on {message.topic}: {e}")
+            return
+        with subscriber.lock:
+            outstanding = subscriber.outstanding.pop(message_index, None)
+            if outstanding is None:
+                subscriber.duplicates += 1
+            else:
+                subscriber.delivered += 1
+        if outstanding is None:
+            with self.lock:
+                self.totals[subscriber.group.name].duplicates += 1
+            return
+        group, send_time, publish_datetime, scheduled_time, send_lag = outstanding
+        delay = (receive_time - send_time) * 1000
+        with self.lock:
+            for name in ("delivery", f"subscription_{subscriber.group.name}", f"topic_{group.name}"):
+                self.histograms.get(name).record(delay)
+            self.totals[group.name].delivered += 1
+            self.totals[subscriber.group.name].delivered += 1
+        if self.args.store_rows:
+            self.db.insert_result(message_index, self.codec.format_publish_time(publish_datetime), send_time, receive_time, delay,
+                                  client_id=subscriber.client_id, scheduled_time=scheduled_time, send_lag=send_lag, qos=group.qos)
+
+    # Wait up to --timeout seconds until every subscriber received every expected message.
+    def wait_for_in_flight(self):
+        deadline = time.perf_counter() + self.args.timeout
+        while time.perf_counter() < deadline and not self.stop_event.is_set():
+            if not any(subscriber.outstanding for subscriber in self.subscribers):
+                return
+            time.sleep(0.05)
+
+    # Store the messages still outstanding as failed.
+    def store_missing(self):
+        for subscriber in self.subscribers:
+            with subscriber.lock:
+                missing, subscriber.outstanding = subscriber.outstanding, {}
+            for message_index, (group, send_time, publish_datetime, scheduled_time, send_lag) in missing.items():
+                self.totals[group.name].missing += 1
+                self.totals[subscriber.group.name].missing += 1
+                self.db.insert_result(message_index, self.codec.format_publish_time(publish_datetime), None, None, None, failed=True,
+                                      client_id=subscriber.client_id, scheduled_time=scheduled_time, send_lag=send_lag, qos=group.qos)
+
+    def disconnect(self):
+        clients = [client for client in [publisher.client for publisher in self.publishers] + [subscriber.client for subscriber in self.subscribers]
+                   if client is not None]
+        for client in clients: # Disconnect first, so the network threads stop without waiting for their select timeout.
+            client.disconnect()
+        for client in clients:
+            client.loop_stop()
+
+    def run(self):
+        start_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        print(f"Beginning scenario at {start_time}: {self.scenario.describe()}.")
+        signal.signal(signal.SIGINT, lambda signal_number, frame: self.stop_event.set())
+        try:
+            self.connect_subscribers()
+            self.connect_publishers()
+            self.send_messages_loop()
+            self.wait_for_in_flight()
+        except (OSError, TimeoutError) as e:
+            logging.error(f"Scenario stopped: {e}")
+        finally:
+            self.disconnect()
+        self.store_missing()
+        self.db.flush()
+        self.db.insert_scenario_groups(self.group_rows())
+        self.histograms.save(histogram_path(self.db.db_file))
+        print()
+        print_percentiles(self.histograms)
+        self.print_groups()
+        generate_report(self.args, self.db.db_file)
+        end_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        published = sum(self.totals[group.name].published for group in self.scenario.topic_groups)
+        delivered = sum(self.totals[group.name].delivered for group in self.scenario.topic_groups)
+        print(f"Ending scenario at {end_time} - Published {published} messages, delivered {delivered} "
+              f"({delivered / published if published else 0:.2f} deliveries per message).")
+
+    # (kind, name, pattern or filter, clients, published, expected, delivered, missing, duplicates, amplification)
+    def group_rows(self):
+        rows = []
+        for group in self.scenario.topic_groups:
+            totals = self.totals[group.name]
+            rows.append(("topic", group.name, group.pattern, len(group.topics) * group.publishers, totals.published, totals.expected,
+                         totals.delivered, totals.missing, totals.duplicates, totals.delivered / totals.published if totals.published else None))
+        for group in self.scenario.subscription_groups:
+            totals = self.totals[group.name]
+            rows.append(("subscription", group.name, group.filter, group.count, None, totals.expected,
+                         totals.delivered, totals.missing, totals.duplicates, None))
+        return rows
+
+    def print_groups(self):
+        print(f"{'Group':<28}{'Pattern / filter':<36}{'Published':>10}{'Expected':>10}{'Delivered':>10}{'Missing':>9}"
+              f"{'Dup':>6}{'Ampl.':>7}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+        for kind, name, pattern, clients, published, expected, delivered, missing, duplicates, amplification in self.group_rows():
+            histogram = self.histograms.get(f"{kind}_{name}")
+            p50, p99 = (f"{histogram.percentile(50):.3f}", f"{histogram.percentile(99):.3f}") if histogram.count else ("N/A", "N/A")
+            print(f"{kind[0].upper() + ' ' + name:<28}{pattern:<36}{'' if published is None else published:>10}{expected:>10}{delivered:>10}"
+                  f"{missing:>9}{duplicates:>6}{'' if amplification is None else f'{amplification:.2f}':>7}{p50:>10}{p99:>10}")
@@ -0,0 +1,241 @@
+import datetime
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+from MQTTClient import MQTTClient, print_percentiles, generate_report
+from LoadProfile import LoadProfile
+from MQTTFanOut import ResultQueueWriter, forward_metrics
+from ClockSync import ClockOffsetEstimator, CLOCK_SAMPLES, clock_request_payload, clock_response_payload
+from LatencyHistogram import HistogramSet, histogram_path
+from LiveMetrics import LiveMetrics, MetricsCollector
+logger = logging.getLogger(__name__)
+
+    # One-way latency with a dedicated publisher and subscriber, in two processes (--role split) or on two hosts
+    # (--role publisher on one, --role subscriber on the other, same --topic).
+    # The subscriber calibrates the offset between its clock and the publisher clock over MQTT (ClockSync) and
+    # converts receive times to the publisher clock, so the stored delay is the one-way delay.
+    # The publisher starts sending when the first clock request of the subscriber arrives, and tells the subscriber
+    # how many messages it sent on the control topic when it is done.
+    # With --return-echo the subscriber echoes every message and the publisher measures the round trip.
+
+CLOCK_SYNC_INTERVAL = 1.0 # Seconds between clock requests once the first CLOCK_SAMPLES samples are taken.
+CALIBRATION_INTERVAL = 0.05
+
+
+class PublisherClient(MQTTClient):
+    def __init__(self, args, db, client_index=None, scheduler=None):
+        super().__init__(args, db, client_index, scheduler)
+        self.track_sends = self.return_echo # Without the echo nothing comes back to wait for.
+        self.subscriber_ready = threading.Event()
+
+    def generate_client_id(self):
+        return super().generate_client_id() + "-pub"
+
+    # The publisher does not receive its own messages, only clock requests and echoes.
+    def subscribe_topics(self, client):
+        client.subscribe(self.topic + "/clock/request", 0)
+        if self.return_echo:
+            client.subscribe(self.return_topic, 0)
+
+    def on_message(self, client, userdata, message):
+        if message.topic == self.topic + "/clock/request":
+            message_info = client.publish(self.topic + "/clock/response", clock_response_payload(message.payload))
+            self.ignore_publish(message_info.mid)
+            self.subscriber_ready.set()
+            return
+        super().on_message(client, userdata, message)
+
+    # The echo of a message is its delivery for the in-flight tracking of the publisher.
+    def on_return(self, payload, receive_time):
+        message_index = super().on_return(payload, receive_time)
+        if message_index is not None:
+            in_flight_message = self.track_receive(message_index)
+            if in_flight_message is not None and in_flight_message.timer is not None:
+                in_flight_message.timer.cancel()
+
+    def send_messages_loop(self):
+        self.connected_event.wait()
+        if not self.subscriber_ready.wait(self.args.timeout):
+            logging.warning("No clock request from a subscriber, sending anyway.")
+        super().send_messages_loop()
+        message_info = self.client.publish(self.topic + "/control", json.dumps({"sent": self.sent_count}), qos=1)
+        self.ignore_publish(message_info.mid)
+
+    # Delivery is stored by the subscriber. Failed publishes and lost echoes are only counted.
+    def store_failure(self, message_index, publish_datetime, scheduled_time, send_lag):
+        pass
+
+    def summary(self):
+        summary = super().summary()
+        if not self.return_echo:
+            summary.update({"Successful": self.sent_count - self.failed_sends, "Failed": self.failed_sends})
+        return summary
+
+    def generate_report(self, db_path):
+        print("Delivery latency is stored by the subscriber, run the report on its database.")
+
+
+class SubscriberClient(MQTTClient):
+    def __init__(self, args, db, client_index=None, scheduler=None):
+        super().__init__(args, db, client_index, scheduler)
+        self.sender_key = None # Messages come from the publisher client.
+        self.clock = ClockOffsetEstimator()
+        self.clock_sync = getattr(args, 'clock_sync', True)
+        self.publisher_done = threading.Event()
+
+    def generate_client_id(self):
+        return super().generate_client_id() + "-sub"
+
+    # The echo goes out on the return topic, only the publisher subscribes to it.
+    def subscribe_topics(self, client):
+        client.subscribe(self.topic, max(self.qos_levels))
+        client.subscribe(self.topic + "/clock/response", 0)
+        client.subscribe(self.topic + "/control", 1)
+
+    def on_message(self, client, userdata, message):
+        if message.topic == self.topic + "/clock/response":
+            offset = self.clock.add_response(message.payload)
+            if self.clock_sync:
+                self.clock_offset = offset
+            return
+        if message.topic == self.topic + "/control":
+            sent = json.loads(bytes(message.payload).decode())["sent"]
+            with self.lock:
+                self.tracker.expect(sent) # Indices 1 to sent.
+            self.sent_count = sent
+            self.publisher_done.set()
+            return
+        super().on_message(client, userdata, message)
+
+    # Indices up to the received one were sent by the publisher, so gaps are in flight until they arrive.
+    def track_receive(self, message_index):
+        with self.lock:
+            self.tracker.expect(message_index)
+            return self.tracker.receive(message_index)
+
+    # Receive only: sends clock requests until the publisher reports that it is done.
+    def send_messages_loop(self):
+        self.connected_event.wait()
+        while not self.publisher_done.is_set() and not self.stop_event.is_set():
+            message_info = self.client.publish(self.topic + "/clock/request", clock_request_payload())
+            self.ignore_publish(message_info.mid)
+            self.publisher_done.wait(CALIBRATION_INTERVAL if len(self.clock.samples) < CLOCK_SAMPLES else CLOCK_SYNC_INTERVAL)
+
+    # Sends are counted by the publisher.
+    def metrics_snapshot(self):
+        snapshot = super().metrics_snapshot()
+        snapshot["sent"] = 0
+        return snapshot
+
+    def summary(self):
+        summary = super().summary()
+        summary["Clock offset (ms)"] = self.clock.offset * 1000 if self.clock_sync else 0.0
+        summary["Clock uncertainty (ms)"] = self.clock.uncertainty * 1000 if self.clock.calibrated else None
+        return summary
+
+    def connect_and_loop(self):
+        super().connect_and_loop()
+        print_clock(self.summary())
+
+
+def print_clock(summary):
+    if summary.get("Clock uncertainty (ms)") is None:
+        print("Clock offset was not calibrated, no clock response from the publisher.")
+    else:
+        print(f"Clock offset to the publisher {summary['Clock offset (ms)']:.3f} ms, uncertainty ±{summary['Clock uncertainty (ms)']:.3f} ms.")
+
+
+ROLE_CLIENTS = {"publisher": PublisherClient, "subscriber": SubscriberClient}
+
+
+# Entry point of the publisher and subscriber processes.
+def split_worker(args, role, result_queue):
+    summary = {}
+    histograms = HistogramSet()
+    collector = None
+    stop_event = threading.Event()
+    try:
+        mqtt_client = ROLE_CLIENTS[role](args, ResultQueueWriter(result_queue))
+        signal.signal(signal.SIGINT, lambda signal_number, frame: mqtt_client.stop_event.set())
+        if args.stats_interval or args.metrics_port:
+            collector = MetricsCollector()
+            collector.add_clients([mqtt_client])
+            threading.Thread(target=forward_metrics, args=(collector, role, result_queue, args.stats_interval or 5.0, stop_event),
+                             daemon=True).start()
+        mqtt_client.run()
+        summary, histograms = mqtt_client.summary(), mqtt_client.histograms
+    except Exception as e:
+        logging.error(f"The {role} process failed: {e}")
+    finally:
+        stop_event.set()
+        result_queue.put(("done", (role, summary), histograms.to_dict()))
+
+
+class MQTTSplit:
+    def __init__(self, args, db):
+        self.args = args
+        self.db = db
+        self.summaries = {}
+        self.histograms = HistogramSet() # Delivery from the subscriber, publish acks and round trip from the publisher.
+
+    def run(self):
+        start_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        print(f"Beginning loadtest at {start_time}: publisher and subscriber processes, one-way latency, "
+              f"sending {LoadProfile.from_args(self.args).describe()}.")
+        collector = MetricsCollector(self.db)
+        live_metrics = LiveMetrics.from_args(collector, self.args)
+        if live_metrics is not None:
+            live_metrics.start()
+        self.run_processes(collector)
+        if live_metrics is not None:
+            live_metrics.stop()
+        self.db.flush()
+        self.histograms.save(histogram_path(self.db.db_file))
+        print()
+        print_percentiles(self.histograms)
+        generate_report(self.args, self.db.db_file)
+
+        publisher = self.summaries.get("publisher", {})
+        subscriber = self.summaries.get("subscriber", {})
+        end_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        print(f"Ending loadtest at {end_time} - Published {publisher.get('Successful', 0)} messages, "
+              f"received {subscriber.get('Successful', 0)}, {subscriber.get('Failed', 0)} missing.")
+        print(f"Duplicate messages {subscriber.get('Duplicates', 0)}, reordered messages {subscriber.get('Reordered', 0)}.")
+        if subscriber:
+            print_clock(subscriber)
+
+    # The subscriber is started first, the publisher waits for its first clock request.
+    def run_processes(self, collector):
+        result_queue = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=split_worker, args=(self.args, role, result_queue))
+                     for role in ("subscriber", "publisher")]
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            process.start()
+
+        workers_done = 0
+        while workers_done < len(processes):
+            try:
+                kind, payload, extra = result_queue.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    logging.error("Publisher and subscriber processes exited without reporting results.")
+                    break
+                continue
+            if kind == "result":
+                self.db.insert_result(*payload, **extra)
+            elif kind == "event":
+                self.db.insert_connection_event(*payload, **extra)
+            elif kind == "metrics":
+                collector.update_remote(extra, payload)
+            elif kind == "done":
+                role, summary = payload
+                self.summaries[role] = summary
+                self.histograms.merge(HistogramSet.from_dict(extra))
+                workers_done += 1
+
+        for process in processes:
+            process.join()
@@ -0,0 +1,139 @@
+import copy
+import datetime
+import logging
+import signal
+import threading
+from MQTTClient import MQTTClient, print_percentiles, generate_report
+from AsyncMQTTClient import AsyncMQTTClient
+from PayloadCodec import parse_size, format_size, data_length_for_payload
+from LatencyHistogram import HistogramSet, histogram_path
+logger = logging.getLogger(__name__)
+
+    # Message size and rate sweep (--sweep-sizes, --sweep-rates).
+    # Every payload size is run at every rate, lowest first, as a separate constant-rate step of --sweep-step-duration
+    # seconds with a fresh client. A size is the whole encoded payload: the data of the step is shortened by the header
+    # fields of the payload format, a size below the header sends the header only. Per step the delivered msgs/s and MB/s are measured over the receive window, and
+    # compared with the offered load. A step is saturated when it delivers less than --sweep-efficiency of the offered
+    # rate or loses messages: the throughput stopped scaling with the load. Higher rates of a saturated size are skipped
+    # unless --sweep-stop-on-saturation false. Steps are stored in the sweep_steps table, their latency in the histogram
+    # file as sweep_step_<n>.
+
+MB = 1024 ** 2
+
+
+def parse_sizes(value):
+    return [parse_size(size) for size in str(value).split(",") if size.strip()]
+
+
+def parse_rates(value):
+    rates = [float(rate) for rate in str(value).split(",") if rate.strip()]
+    if not rates or any(rate <= 0 for rate in rates):
+        raise ValueError(f"Sweep rates must be greater than 0 msgs/s: {value}")
+    return sorted(rates)
+
+
+class MQTTSweep:
+    def __init__(self, args, db):
+        self.args = args
+        self.db = db
+        self.sizes = parse_sizes(args.sweep_sizes)
+        self.rates = parse_rates(args.sweep_rates) if args.sweep_rates else [args.rate or 1.0 / args.interval]
+        self.histograms = HistogramSet()
+        self.steps = []
+        self.current_client = None
+        self.stop_event = threading.Event()
+        self.db.create_sweep_table()
+
+    def step_args(self, step, size, rate):
+        step_args = copy.copy(self.args)
+        step_args.client_id = f"{self.args.client_id}step{step}-"
+        # Random suffix of the client ID as a placeholder, only its length matters for the header.
+        step_args.data_string_length = data_length_for_payload(getattr(self.args, 'payload_format', 'json'), f"{step_args.client_id}000", size)
+        step_args.rate = rate
+        step_args.profile = "constant"
+        step_args.duration = self.args.sweep_step_duration
+        return step_args
+
+    def run_step(self, step, size, rate):
+        step_args = self.step_args(step, size, rate)
+        mqtt_client = AsyncMQTTClient(step_args, self.db) if self.args.engine == "asyncio" else MQTTClient(step_args, self.db)
+        self.current_client = mqtt_client
+        print(f"Step {step}: {format_size(size)} payloads at {rate:g} msgs/s for {self.args.sweep_step_duration:g} s.")
+        mqtt_client.run()
+        self.db.flush()
+        summary = mqtt_client.summary()
+        histogram = mqtt_client.histogram
+        self.histograms.merge(mqtt_client.histograms)
+        self.histograms.get(f"sweep_step_{step}").merge(histogram)
+
+        message_bytes = len(mqtt_client.codec.encode(1)[0]) # Whole payload, including the header fields.
+        received = summary["Successful"]
+        window = (mqtt_client.last_receive_time - mqtt_client.first_receive_time) if received > 1 else 0
+        msgs_per_second = (received - 1) / window if window > 0 else None
+        mb_per_second = msgs_per_second * mqtt_client.received_bytes / received / MB if msgs_per_second else None
+        offered_mb_per_second = rate * message_bytes / MB
+        lost = summary["Failed"] + summary["Timeout"]
+        saturated = lost > 0 or msgs_per_second is None or msgs_per_second < self.args.sweep_efficiency * rate
+        return {
+            "Step": step, "Size": size, "PayloadBytes": message_bytes, "TargetRate": rate, "Sent": mqtt_client.sent_count, "Received": received, "Lost": lost,
+            "MsgsPerSecond": msgs_per_second, "MBPerSecond": mb_per_second, "OfferedMBPerSecond": offered_mb_per_second,
+            "P50": histogram.percentile(50) if histogram.count else None, "P99": histogram.percentile(99) if histogram.count else None,
+            "Saturated": int(saturated),
+        }
+
+    def run(self):
+        start_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        print(f"Beginning sweep at {start_time}: payloads {', '.join(format_size(size) for size in self.sizes)} "
+              f"at {', '.join(f'{rate:g}' for rate in self.rates)} msgs/s.")
+        signal.signal(signal.SIGINT, self.handle_signal)
+        step = 0
+        for size in self.sizes:
+            for rate in self.rates:
+                if self.stop_event.is_set():
+                    break
+                step += 1
+                result = self.run_step(step, size, rate)
+                self.steps.append(result)
+                self.db.insert_sweep_step(result)
+                print()
+                print_step(result)
+                if result["Saturated"] and self.args.sweep_stop_on_saturation:
+                    break
+        self.histograms.save(histogram_path(self.db.db_file))
+        print()
+        print_percentiles(self.histograms)
+        self.print_steps()
+        generate_report(self.args, self.db.db_file)
+        end_time = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        print(f"Ending sweep at {end_time} - {len(self.steps)} steps.")
+
+    # CTRL + C ends the running step early and skips the rest.
+    def handle_signal(self, signal_number, frame):
+        print("Signal received, finishing the current step...")
+        self.stop_event.set()
+        if self.current_client is not None:
+            self.current_client.stop_event.set()
+
+    def print_steps(self):
+        print(f"{'Step':>4}{'Size':>10}{'Payload':>12}{'Rate':>10}{'Msgs/s':>12}{'MB/s':>10}{'Offered MB/s':>14}{'Lost':>7}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+        for result in self.steps:
+            print(f"{result['Step']:>4}{format_size(result['Size']):>10}{result['PayloadBytes']:>12}{result['TargetRate']:>10g}{format_rate(result['MsgsPerSecond']):>12}"
+                  f"{format_rate(result['MBPerSecond']):>10}{format_rate(result['OfferedMBPerSecond']):>14}{result['Lost']:>7}"
+                  f"{format_rate(result['P50']):>10}{format_rate(result['P99']):>10}{'  SATURATED' if result['Saturated'] else ''}")
+        for size in sorted({result["Size"] for result in self.steps}):
+            size_steps = [result for result in self.steps if result["Size"] == size]
+            scaling = [result for result in size_steps if not result["Saturated"]]
+            saturated = [result for result in size_steps if result["Saturated"]]
+            best = max(scaling, key=lambda result: result["MBPerSecond"] or 0) if scaling else None
+            print(f"{format_size(size)}: " + (f"highest scaling step {best['TargetRate']:g} msgs/s ({format_rate(best['MBPerSecond'])} MB/s)" if best else "no scaling step")
+                  + (f", saturated at {saturated[0]['TargetRate']:g} msgs/s." if saturated else ", not saturated."))
+
+
+def print_step(result):
+    print(f"Step {result['Step']}: delivered {format_rate(result['MsgsPerSecond'])} msgs/s, {format_rate(result['MBPerSecond'])} MB/s "
+          f"of {format_rate(result['OfferedMBPerSecond'])} MB/s offered, {result['Lost']} lost, p99 {format_rate(result['P99'])} ms"
+          f"{', saturated' if result['Saturated'] else ''}.")
+
+
+def format_rate(value):
+    return "N/A" if value is None else f"{value:.3f}"
@@ -0,0 +1,137 @@
+import datetime
+import json
+import os
+import re
+import struct
+import time
+
+    # Message payload formats.
+    # json:   the original human readable format, encoded with json.dumps and decoded with json.loads.
+    #         The Data field is --data-string-length characters of repeated lorem ipsum text, serialized once and
+    #         appended to the header fields, so megabyte payloads do not add a json.dumps of the data to every send.
+    # binary: fixed-layout struct header (message index, perf_counter send time, wall clock ns, client ID)
+    #         followed by random padding up to --data-string-length bytes. The header is packed into a preallocated
+    #         buffer and decoded in place from a memoryview, publish datetimes are formatted only when stored.
+
+PAYLOAD_FORMATS = ("json", "binary")
+FILLER_TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore. "
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "K": 1024, "MB": 1024 ** 2, "M": 1024 ** 2}
+
+
+# "512", "64KB", "1MB" -> bytes.
+def parse_size(value):
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KkMm]?[Bb]?)\s*", str(value))
+    if not match:
+        raise ValueError(f"Invalid size: {value}, use bytes or a KB / MB suffix.")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+# Payload size for output, 1024 based like parse_size.
+def format_size(size):
+    for unit in ("MB", "KB"):
+        if size >= SIZE_UNITS[unit]:
+            return f"{size / SIZE_UNITS[unit]:g} {unit}"
+    return f"{size} B"
+
+
+def filler_text(length):
+    return (FILLER_TEXT * (length // len(FILLER_TEXT) + 1))[:length]
+
+
+# --data-string-length that makes the whole encoded payload about size bytes. The json header fields vary by a few
+# bytes with the send time and message index, the binary header is part of the padding.
+def data_length_for_payload(payload_format, client_id, size):
+    if payload_format == "binary":
+        return size
+    return max(size - len(JSONPayloadCodec(client_id, 0).encode(1)[0]), 0)
+
+
+# Whole encoded payload size of a run with this --data-string-length, the inverse of data_length_for_payload.
+def payload_size(payload_format, client_id, data_string_length):
+    return len(create_codec(payload_format, client_id, data_string_length).encode(1)[0])
+
+
+def create_codec(payload_format, client_id, data_string_length):
+    if payload_format == "binary":
+        return BinaryPayloadCodec(client_id, data_string_length)
+    return JSONPayloadCodec(client_id, data_string_length)
+
+
+class JSONPayloadCodec:
+    def __init__(self, client_id, data_string_length):
+        self.client_id = client_id
+        self.client_key = client_id # Compared with the sender returned by decode().
+        self.data = filler_text(data_string_length)
+        self.data_field = ', "Data": ' + json.dumps(self.data) + '}'
+
+    # Returns (payload, send time, publish datetime).
+    def encode(self, message_index):
+        publish_datetime_utc = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds')
+        send_time = time.perf_counter()
+        message = {
+            "PublishDateTimeUTC": publish_datetime_utc,
+            "SendTime": send_time,
+            "MessageIndex": message_index,
+            "ClientId": self.client_id
+        }
+        return json.dumps(message)[:-1] + self.data_field, send_time, publish_datetime_utc
+
+    # Returns (message index, send time, publish datetime, sender).
+    def decode(self, payload):
+        message_data = json.loads(payload.decode() if isinstance(payload, (bytes, bytearray)) else bytes(payload).decode())
+        return message_data["MessageIndex"], message_data["SendTime"], message_data["PublishDateTimeUTC"], message_data.get("ClientId", self.client_id)
+
+    # Re-published through the /return topic with the receive timestamp.
+    def return_payload(self, payload, receive_time):
+        return json.dumps({
+            "SendTime": receive_time,
+            "OriginalPayload": bytes(payload).decode(),
+            "RoundTrip": True
+        })
+
+    # Returns (echo receive time, original payload) of a /return message.
+    def decode_return(self, payload):
+        message_data = json.loads(bytes(payload).decode())
+        return message_data["SendTime"], message_data["OriginalPayload"].encode()
+
+    def format_publish_time(self, publish_datetime_utc):
+        return publish_datetime_utc
+
+
+class BinaryPayloadCodec:
+    HEADER = struct.Struct("!Qdq32s") # Message index, perf_counter send time, wall clock ns, client ID.
+    RETURN_HEADER = struct.Struct("!d") # Receive time prepended to the original payload on the /return topic.
+    CLIENT_ID_BYTES = 32
+
+    def __init__(self, client_id, data_string_length):
+        client_key = client_id.encode()
+        # A truncated ID would let clients with a common 32 byte prefix take each other's messages as their own.
+        if len(client_key) > self.CLIENT_ID_BYTES:
+            raise ValueError(f"Client ID {client_id} is longer than the {self.CLIENT_ID_BYTES} bytes of the binary payload header.")
+        self.client_key = client_key.ljust(self.CLIENT_ID_BYTES, b"\0") # The header field is null padded.
+        # Random padding, so compression on the way does not shrink large payloads. Only the header is rewritten.
+        self.buffer = bytearray(os.urandom(max(self.HEADER.size, data_string_length)))
+
+    def encode(self, message_index):
+        wall_clock_ns = time.time_ns()
+        send_time = time.perf_counter()
+        self.HEADER.pack_into(self.buffer, 0, message_index, send_time, wall_clock_ns, self.client_key)
+        # paho keeps a reference to the payload until it is written to the socket, so the buffer is copied once here.
+        return bytes(self.buffer), send_time, wall_clock_ns
+
+    def decode(self, payload):
+        message_index, send_time, wall_clock_ns, sender = self.HEADER.unpack_from(memoryview(payload), 0)
+        return message_index, send_time, wall_clock_ns, sender
+
+    def return_payload(self, payload, receive_time):
+        return self.RETURN_HEADER.pack(receive_time) + payload
+
+    def decode_return(self, payload):
+        payload = memoryview(payload)
+        return self.RETURN_HEADER.unpack_from(payload, 0)[0], payload[self.RETURN_HEADER.size:]
+
+    # Wall clock nanoseconds to the ISO format used by the json payload.
+    def format_publish_time(self, wall_clock_ns):
+        if not isinstance(wall_clock_ns, int):
+            return wall_clock_ns
+        return datetime.datetime.fromtimestamp(wall_clock_ns / 1e9, datetime.timezone.utc).isoformat(timespec='milliseconds')
@@ -1,71 +1,139 @@
 import pandas as pd
 import seaborn as sns
+import matplotlib
+matplotlib.use("Agg") # Reports are only saved to files, no display backend is probed.
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import sqlite3
 import os
 import logging
 import numpy as np
+from LatencyHistogram import HistogramSet, histogram_path, PERCENTILES
+from PayloadCodec import format_size
 logging.getLogger('matplotlib').setLevel(logging.WARNING)
 logging.getLogger('PIL').setLevel(logging.WARNING)
 
+LARGE_RUN_THRESHOLD = 1000 # Above this many messages one bar per message is unreadable.
+TIME_BUCKETS = 200
+READ_CHUNK_SIZE = 50000 # Rows per chunk when delays are read without a histogram file.
+
     # Generates a visual report for MQTT load tester. 
     # Bar chart with delay (ms) on y-axis and message index on x-axis.
-    # Table chart with delay summary (min, max, avg, median) and message succesratio.
+    # Runs with more than LARGE_RUN_THRESHOLD messages are downsampled into time buckets instead (min/p50/p99/max
+    # per bucket) and drawn as a latency-over-time band with a latency histogram and CDF. The buckets, counts, rates
+    # and fallback percentiles are computed in SQL, only the rows of small runs are read into pandas, so rendering
+    # time and memory do not grow with the message count.
+    # Table chart with delay summary (min, max, avg, p50 ... p99.99) and message succesratio.
+    # Latency statistics come from the histogram file of the run when it exists, so they are exact for every message
+    # even when per-message rows were not stored. Without stored rows the bar chart shows the latency distribution.
+    # Table chart with target send rate vs achieved send rate and send lag behind the schedule.
+    # Table chart with delivery latency and publish ack latency per QoS level.
 
 class LoadTestReport:
     def __init__(self, db_path):
         self.db_path = db_path
         self.db_filename = os.path.splitext(os.path.basename(db_path))[0]
+        self.histograms = self.read_histograms()
+        self.histogram = self.histograms.get("delivery") if self.histograms is not None else None
+
+    def read_histograms(self):
+        path = histogram_path(self.db_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            return HistogramSet.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Could not read latency histograms {path}: {e}")
+            return None
+
+    # False when only failed messages were stored (--store-rows false) and successful ones are only in the histogram.
+    def rows_stored(self, successful_rows):
+        return self.histogram is None or self.histogram.count <= successful_rows
+
+    # (rows, failed rows, successful rows) of the results table.
+    def read_totals(self, conn):
+        return conn.execute("SELECT COUNT(*), IFNULL(SUM(Failed = 1), 0), IFNULL(SUM(Failed = 0), 0) FROM results").fetchone()
 
     # Connect to SQLite database and query the necessary data.
     def read_data(self):
         conn = sqlite3.connect(self.db_path)
-        query = "SELECT MessageIndex, HighResPublishTime, Delay, Failed FROM results"
+        # Cast in SQL so pandas gets float columns directly, NULL becomes NaN.
+        query = """SELECT MessageIndex, CAST(HighResPublishTime AS REAL) AS HighResPublishTime, CAST(Delay AS REAL) AS Delay,
+                          Failed, ScheduledSendTime, SendLag, Qos FROM results ORDER BY COALESCE(ScheduledSendTime, HighResPublishTime)"""
         df = pd.read_sql_query(query, conn)
         conn.close()
-        
-        # Handling NULL values for better data manipulation and visualization
-        df['Delay'] = pd.to_numeric(df['Delay'], errors='coerce')  # Convert delay to numeric, making NULL to NaN
-        df.replace('N/A', np.nan, inplace=True)  # Replace 'N/A' with NaN
         return df
 
-    def generate_summary_statistics(self):
-        df = self.read_data()
-        # Filter to only include successful messages (where Failed is 0)
-        success_df = df[df['Failed'] == 0]
-
-        # Calculate summary statistics only for successful messages
-        if not success_df.empty:
-            summary = {
-                'Min (ms)': round(success_df['Delay'].min(), 3),
-                'Max (ms)': round(success_df['Delay'].max(), 3),
-                'Average (ms)': round(success_df['Delay'].mean(), 3),
-                'Median (ms)': round(success_df['Delay'].median(), 3)
-            }
-        else:
-            summary = {'Min (ms)': 'N/A', 'Max (ms)': 'N/A', 'Average (ms)': 'N/A', 'Median (ms)': 'N/A'}
+    def generate_summary_statistics(self, conn):
+        if self.histogram is not None and self.histogram.count:
+            return {key: round(value, 3) for key, value in self.histogram.summary().items()}
+        summary = self.delay_statistics(conn)
+        if summary is None:
+            summary = {'Min (ms)': 'N/A', 'Max (ms)': 'N/A', 'Average (ms)': 'N/A'}
+            for percent in PERCENTILES:
+                summary[f'p{percent:g} (ms)'] = 'N/A'
+        return summary
 
+    # Min, max, average and nearest-rank percentiles of the successful delays in SQL, for databases without a histogram
+    # file. One sort ranks the rows for every percentile, as in read_time_buckets. None without successful rows.
+    def delay_statistics(self, conn, percents=PERCENTILES, qos=None):
+        condition, params = "Failed = 0 AND Delay IS NOT NULL" + (" AND Qos = ?" if qos is not None else ""), (() if qos is None else (qos,))
+        percentile_columns = ", ".join("MIN(CASE WHEN DelayRank >= ? * Delays THEN Delay END)" for _ in percents)
+        query = f"""WITH ranked AS (SELECT CAST(Delay AS REAL) AS Delay, ROW_NUMBER() OVER (ORDER BY CAST(Delay AS REAL)) AS DelayRank,
+                                           COUNT(*) OVER () AS Delays FROM results WHERE {condition})
+                    SELECT COUNT(*), MIN(Delay), MAX(Delay), AVG(Delay), {percentile_columns} FROM ranked"""
+        count, low, high, average, *values = conn.execute(query, (*params, *(percent / 100 for percent in percents))).fetchone()
+        if not count:
+            return None
+        summary = {'Min (ms)': round(low, 3), 'Max (ms)': round(high, 3), 'Average (ms)': round(average, 3)}
+        for percent, value in zip(percents, values):
+            summary[f'p{percent:g} (ms)'] = round(value, 3)
+        summary['Count'] = count
         return summary
 
+    # Target rate from the scheduled send times, achieved rate from the actual send times (schedule + lag).
+    def generate_rate_statistics(self, conn, successful_rows):
+        scheduled, first, last, first_sent, last_sent, average_lag, max_lag = conn.execute(
+            """SELECT COUNT(*), MIN(ScheduledSendTime), MAX(ScheduledSendTime), MIN(ScheduledSendTime + SendLag / 1000.0),
+                      MAX(ScheduledSendTime + SendLag / 1000.0), AVG(SendLag), MAX(SendLag) FROM results WHERE ScheduledSendTime IS NOT NULL""").fetchone()
+        if scheduled < 2 or not self.rows_stored(successful_rows):
+            return {'Target rate (msg/s)': 'N/A', 'Achieved rate (msg/s)': 'N/A', 'Avg send lag (ms)': 'N/A', 'Max send lag (ms)': 'N/A'}
+        scheduled_span = last - first
+        actual_span = last_sent - first_sent if last_sent is not None else 0
+        return {
+            'Target rate (msg/s)': round((scheduled - 1) / scheduled_span, 2) if scheduled_span > 0 else 'N/A',
+            'Achieved rate (msg/s)': round((scheduled - 1) / actual_span, 2) if actual_span > 0 else 'N/A',
+            'Avg send lag (ms)': round(average_lag, 3) if average_lag is not None else 'N/A',
+            'Max send lag (ms)': round(max_lag, 3) if max_lag is not None else 'N/A'
+        }
 
-    # Generates a bar chart and a table for delay summary/message succes.
-    def generate_charts_and_tables(self):
-        df = self.read_data()
-        # Assuming 'PublishTime' holds perf_counter values, convert them to strings with 's' suffix to indicate seconds
-        df['FormattedPublishTime'] = df['HighResPublishTime'].astype(float).apply(lambda x: f"{x:.3f}s")
+    # Delivery latency (publish to receive) and publish ack latency (publish to PUBACK/PUBCOMP) per QoS level.
+    def generate_qos_statistics(self, conn):
+        rows = []
+        for qos in range(3):
+            delivery = self.histograms.get(f"delivery_qos_{qos}") if self.histograms is not None else None
+            ack = self.histograms.get(f"publish_ack_qos_{qos}") if self.histograms is not None else None
+            if delivery is not None and (delivery.count or ack.count):
+                rows.append([qos, delivery.count, *self.format_percentiles(delivery), *self.format_percentiles(ack)])
+            elif self.histograms is None:
+                delays = self.delay_statistics(conn, (50, 99), qos)
+                if delays is not None:
+                    rows.append([qos, delays['Count'], delays['p50 (ms)'], delays['p99 (ms)'], 'N/A', 'N/A'])
+        return pd.DataFrame(rows, columns=['QoS', 'Msgs', 'Delivery p50 (ms)', 'Delivery p99 (ms)', 'Ack p50 (ms)', 'Ack p99 (ms)'], dtype=object)
 
+    @staticmethod
+    def format_percentiles(histogram):
+        if not histogram.count:
+            return ['N/A', 'N/A']
+        return [round(histogram.percentile(50), 3), round(histogram.percentile(99), 3)]
+
+    # Bar chart with delay per message, failed messages in red.
+    def plot_message_delays(self, ax_bar, df):
         # Create visible bars for failed messages
         min_height_for_failed = df['Delay'].max() * 0.5  # Minimal height 50% from max to ensure visibility.
-        df['AdjustedDelay'] = df.apply(lambda x: min_height_for_failed if x['Failed'] == 1 else x['Delay'], axis=1)
-
-
-        df['Color'] = df['Failed'].apply(lambda x: 'red' if x else 'green')
-
-        # Create the figure
-        fig = plt.figure(figsize=(14, 6))
-        grid_spec = fig.add_gridspec(2, 3, width_ratios=[3, 1, 1], height_ratios=[1, 1])
-        ax_bar = fig.add_subplot(grid_spec[:, 0])
+        failed = df['Failed'] == 1
+        df['AdjustedDelay'] = df['Delay'].where(~failed, min_height_for_failed)
+        df['Color'] = np.where(failed, 'red', 'green')
 
         sns.barplot(x='MessageIndex', y='AdjustedDelay', hue='Color', data=df, dodge=False, ax=ax_bar, palette={'green': 'green', 'red': 'red'})
         ax_bar.set_title(f'Message Delay Visualization - {self.db_filename}')
@@ -93,22 +161,118 @@ class LoadTestReport:
             # Ensure that x-tick labels do not overlap and are readable
         plt.setp(ax_bar.get_xticklabels(), rotation=45, ha="right", rotation_mode="anchor")
 
-        # Summary statistics
-        summary_stats = pd.DataFrame({
-            'Min (ms)': [round(df['Delay'].min(), 3)],
-            'Max (ms)': [round(df['Delay'].max(), 3)],
-            'Average (ms)': [round(df['Delay'].mean(), 3)],
-            'Median (ms)': [round(df['Delay'].median(), 3)]
+    # Latency distribution from the histogram, used when per-message rows were not stored.
+    def plot_latency_distribution(self, ax_bar):
+        buckets = self.histogram.buckets()
+        upper_bounds = [upper_bound for upper_bound, bucket_count in buckets]
+        counts = [bucket_count for upper_bound, bucket_count in buckets]
+        ax_bar.step(upper_bounds, counts, where='post', color='green')
+        ax_bar.set_xscale('log')
+        ax_bar.set_title(f'Message Delay Distribution - {self.db_filename}')
+        ax_bar.set_xlabel('Delay (ms)')
+        ax_bar.set_ylabel('Messages')
+
+    # Time buckets of the whole results table computed in SQL, same columns as bucket_by_time. The percentiles are
+    # nearest-rank over the successful delays of each bucket, only the bucket aggregates are returned.
+    def read_time_buckets(self, conn):
+        query = """WITH timed AS (SELECT CAST(Delay AS REAL) AS Delay, Failed, COALESCE(ScheduledSendTime, CAST(HighResPublishTime AS REAL)) AS SendTime FROM results),
+                        bounds AS (SELECT Origin, MAX(Span / ?, 1e-6) AS Width FROM (SELECT MIN(SendTime) AS Origin, MAX(SendTime) - MIN(SendTime) AS Span FROM timed)),
+                        bucketed AS (SELECT MIN(IFNULL(CAST((SendTime - Origin) / Width AS INTEGER), 0), ? - 1) AS Bucket, CASE WHEN Failed = 0 THEN Delay END AS Delay, Failed
+                                     FROM timed, bounds),
+                        ranked AS (SELECT Bucket, Delay, Failed, ROW_NUMBER() OVER (PARTITION BY Bucket, Delay IS NULL ORDER BY Delay) AS DelayRank,
+                                          COUNT(Delay) OVER (PARTITION BY Bucket) AS Delays FROM bucketed)
+                   SELECT Bucket, MIN(Delay) AS Min, MIN(CASE WHEN DelayRank >= 0.5 * Delays THEN Delay END) AS P50,
+                          MIN(CASE WHEN DelayRank >= 0.99 * Delays THEN Delay END) AS P99, MAX(Delay) AS Max, SUM(Failed) AS Failed, Bucket * Width AS Time
+                   FROM ranked, bounds GROUP BY Bucket ORDER BY Bucket"""
+        return pd.read_sql_query(query, conn, params=(TIME_BUCKETS, TIME_BUCKETS), index_col='Bucket')
+
+    # Downsample message rows into time buckets: min, p50, p99, max delay and failed count per bucket.
+    def bucket_by_time(self, df):
+        send_time = df['ScheduledSendTime'].fillna(df['HighResPublishTime'])
+        elapsed = send_time - send_time.min()
+        bucket_width = max(elapsed.max() / TIME_BUCKETS, 1e-6)
+        bucket = (elapsed // bucket_width).fillna(0).astype(np.int64).clip(upper=TIME_BUCKETS - 1) # The last message joins the last bucket, as in read_time_buckets.
+        grouped = df['Delay'].groupby(bucket)
+        buckets = pd.DataFrame({
+            'Min': grouped.min(),
+            'P50': grouped.quantile(0.5),
+            'P99': grouped.quantile(0.99),
+            'Max': grouped.max(),
+            'Failed': df['Failed'].groupby(bucket).sum()
         })
+        buckets['Time'] = buckets.index * bucket_width
+        return buckets
+
+    # Latency over time as a min-max band with p50 and p99 lines, buckets with failed messages marked in red.
+    def plot_latency_over_time(self, ax_time, buckets):
+        ax_time.fill_between(buckets['Time'], buckets['Min'], buckets['Max'], color='green', alpha=0.2, label='Min - Max')
+        ax_time.plot(buckets['Time'], buckets['P50'], color='green', label='p50')
+        ax_time.plot(buckets['Time'], buckets['P99'], color='orange', label='p99')
+        failed_buckets = buckets[buckets['Failed'] > 0]
+        if not failed_buckets.empty:
+            ax_time.scatter(failed_buckets['Time'], np.full(len(failed_buckets), np.nanmax(buckets['Max'].to_numpy()) if buckets['Max'].notna().any() else 0),
+                            color='red', marker='v', label='Failed')
+        ax_time.set_title(f'Message Delay over Time - {self.db_filename}')
+        ax_time.set_xlabel('Time from start (s)')
+        ax_time.set_ylabel('Delay (ms)')
+        ax_time.legend(loc='upper left')
+
+    # Latency histogram with the cumulative distribution on a second y-axis.
+    def plot_latency_histogram(self, ax_hist, conn):
+        if self.histogram is not None and self.histogram.count:
+            buckets = self.histogram.buckets()
+            upper_bounds = np.array([upper_bound for upper_bound, bucket_count in buckets])
+            counts = np.array([bucket_count for upper_bound, bucket_count in buckets])
+        else:
+            low, high = conn.execute("SELECT MIN(CAST(Delay AS REAL)), MAX(CAST(Delay AS REAL)) FROM results WHERE Failed = 0 AND Delay IS NOT NULL").fetchone()
+            if low is None:
+                return
+            bins = np.geomspace(max(low, 1e-3), max(high, 2e-3), 100)
+            counts = np.zeros(len(bins) - 1, dtype=np.int64)
+            # Chunked, so only one chunk of delays is in memory at a time.
+            for chunk in pd.read_sql_query("SELECT CAST(Delay AS REAL) AS Delay FROM results WHERE Failed = 0 AND Delay IS NOT NULL", conn, chunksize=READ_CHUNK_SIZE):
+                counts += np.histogram(chunk['Delay'].to_numpy(), bins=bins)[0]
+            upper_bounds = bins[1:]
+        ax_hist.step(upper_bounds, counts, where='post', color='green')
+        ax_hist.set_xscale('log')
+        ax_hist.set_xlabel('Delay (ms)')
+        ax_hist.set_ylabel('Messages')
+        ax_cdf = ax_hist.twinx()
+        ax_cdf.plot(upper_bounds, np.cumsum(counts) / counts.sum() * 100, color='blue')
+        ax_cdf.set_ylabel('Cumulative (%)')
+        ax_cdf.set_ylim(0, 100)
+
+    # Generates a bar chart and a table for delay summary/message succes.
+    def generate_charts_and_tables(self):
+        conn = sqlite3.connect(self.db_path)
+        rows, failed_messages, successful_rows = self.read_totals(conn)
+
+        # Create the figure
+        fig = plt.figure(figsize=(14, 8))
+        grid_spec = fig.add_gridspec(4, 3, width_ratios=[3, 1, 1], height_ratios=[1, 1, 1, 1])
+        if not self.rows_stored(successful_rows):
+            self.plot_latency_distribution(fig.add_subplot(grid_spec[:, 0]))
+        elif rows > LARGE_RUN_THRESHOLD:
+            self.plot_latency_over_time(fig.add_subplot(grid_spec[:3, 0]), self.read_time_buckets(conn))
+            self.plot_latency_histogram(fig.add_subplot(grid_spec[3, 0]), conn)
+        else:
+            self.plot_message_delays(fig.add_subplot(grid_spec[:, 0]), self.read_data())
+
+        # Summary statistics
+        summary_stats = pd.DataFrame({key: [value] for key, value in self.generate_summary_statistics(conn).items() if key != 'Count'})
 
         # Calculate the summary statistics including success rate
+        successful_messages = self.histogram.count if self.histogram is not None else successful_rows
+        total_messages = successful_messages + failed_messages
         success_stats = pd.DataFrame({
-            'Msg success': [len(df) - df['Failed'].sum()],
-            'Msg failed': [df['Failed'].sum()],
-            'Total msgs': [len(df)],
-            'Success rate (%)': [round((1 - df['Failed'].mean()) * 100, 2)]
+            'Msg success': [successful_messages],
+            'Msg failed': [failed_messages],
+            'Total msgs': [total_messages],
+            'Success rate (%)': [round(successful_messages / total_messages * 100, 2) if total_messages else 'N/A']
         })
 
+        rate_stats = pd.DataFrame({key: [value] for key, value in self.generate_rate_statistics(conn, successful_rows).items()})
+
         # Place tables on the right side of the bar chart
         ax_table1 = fig.add_subplot(grid_spec[0, 1:])
         ax_table1.axis('off')
@@ -116,7 +280,7 @@ class LoadTestReport:
                                  colLabels=summary_stats.columns,
                                  loc='center')
         table1.auto_set_font_size(False)
-        table1.set_fontsize(10)
+        table1.set_fontsize(8)
         table1.scale(1, 2)
 
         ax_table2 = fig.add_subplot(grid_spec[1, 1:])
@@ -128,7 +292,420 @@ class LoadTestReport:
         table2.set_fontsize(10)
         table2.scale(1, 2)
 
+        ax_table3 = fig.add_subplot(grid_spec[2, 1:])
+        ax_table3.axis('off')
+        table3 = ax_table3.table(cellText=rate_stats.values,
+                                 colLabels=rate_stats.columns,
+                                 loc='center')
+        table3.auto_set_font_size(False)
+        table3.set_fontsize(10)
+        table3.scale(1, 2)
+
+        qos_stats = self.generate_qos_statistics(conn)
+        conn.close()
+        ax_table4 = fig.add_subplot(grid_spec[3, 1:])
+        ax_table4.axis('off')
+        if not qos_stats.empty:
+            table4 = ax_table4.table(cellText=qos_stats.values,
+                                     colLabels=qos_stats.columns,
+                                     loc='center')
+            table4.auto_set_font_size(False)
+            table4.set_fontsize(8)
+            table4.scale(1, 2)
+
         plt.tight_layout()
 
         # Save the entire figure
-        plt.savefig(f'{self.db_filename}_report.png')
\ No newline at end of file
+        plt.savefig(f'{self.db_filename}_report.png')
+        plt.close(fig)
+
+    # Report of a connection storm run (--storm-connections), saved as <db>_connections_report.png.
+    # Connect latency (start to CONNACK) per attempt over time with failed attempts in red, the distribution of every
+    # phase from the histogram file, and tables with phase percentiles, success rate and failures by CONNACK code or error.
+
+STORM_PHASE_COLUMNS = {"transport": "TransportMs", "tls_handshake": "TlsHandshakeMs", "connack": "ConnackMs",
+                       "connect_total": "ConnectTotalMs", "suback": "SubackMs"}
+
+
+class ConnectionStormReport(LoadTestReport):
+    def read_data(self):
+        conn = sqlite3.connect(self.db_path)
+        df = pd.read_sql_query("SELECT * FROM connections ORDER BY ConnectionIndex", conn)
+        conn.close()
+        return df
+
+    # Percentiles per phase from the histogram file, or from the stored rows without it.
+    def generate_phase_statistics(self, df):
+        rows = []
+        for phase, column in STORM_PHASE_COLUMNS.items():
+            histogram = self.histograms.get(phase) if self.histograms is not None else None
+            if histogram is not None and histogram.count:
+                rows.append([phase, histogram.count, *(round(histogram.percentile(percent), 3) for percent in (50, 90, 99)), round(histogram.max / 1000, 3)])
+            elif self.histograms is None and df[column].notna().any():
+                values = df[column].dropna()
+                rows.append([phase, len(values), *(round(values.quantile(percent / 100), 3) for percent in (50, 90, 99)), round(values.max(), 3)])
+        return pd.DataFrame(rows, columns=['Phase', 'Count', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'Max (ms)'], dtype=object)
+
+    # Attempts without an error and with CONNACK code 0 are successful.
+    def generate_outcome_statistics(self, df):
+        failed = df['Error'].notna() | (df['ReturnCode'].fillna(-1) != 0)
+        start = df['ScheduledTime'] + df['StartLag'].fillna(0) / 1000
+        span = start.max() - start.min() if len(df) > 1 else 0
+        return pd.DataFrame({
+            'Attempts': [len(df)],
+            'Successful': [int((~failed).sum())],
+            'Failed': [int(failed.sum())],
+            'Success (%)': [round((~failed).sum() / len(df) * 100, 2)],
+            'Rate (conn/s)': [round((len(df) - 1) / span, 2) if span > 0 else 'N/A'],
+            'Max lag (ms)': [round(df['StartLag'].max(), 3)]
+        }, dtype=object), failed
+
+    def generate_failure_statistics(self, df, failed):
+        outcome = df['Error'].fillna('CONNACK ' + df['ReturnCode'].fillna(-1).astype(int).astype(str))
+        counts = outcome[failed].value_counts()
+        return pd.DataFrame({'Failure': counts.index, 'Count': counts.values}, dtype=object)
+
+    def plot_connect_latency(self, ax_time, df, failed):
+        start = df['ScheduledTime'] + df['StartLag'].fillna(0) / 1000
+        ax_time.scatter(start[~failed], df.loc[~failed, 'ConnectTotalMs'], s=4, color='green', label='CONNACK', rasterized=True)
+        if df['SubackMs'].notna().any():
+            ax_time.scatter(start[~failed], df.loc[~failed, 'SubackMs'], s=4, color='orange', label='SUBACK', rasterized=True)
+        if failed.any():
+            top = np.nanmax(df['ConnectTotalMs'].to_numpy()) if df['ConnectTotalMs'].notna().any() else 1
+            ax_time.scatter(start[failed], np.full(int(failed.sum()), top), color='red', marker='v', label='Failed')
+        ax_time.set_title(f'Connect Latency over Time - {self.db_filename}')
+        ax_time.set_xlabel('Time from start (s)')
+        ax_time.set_ylabel('Latency (ms)')
+        ax_time.legend(loc='upper left')
+
+    def plot_phase_distributions(self, ax_hist):
+        for phase in STORM_PHASE_COLUMNS:
+            histogram = self.histograms.get(phase) if self.histograms is not None else None
+            if histogram is not None and histogram.count:
+                buckets = histogram.buckets()
+                ax_hist.step([upper_bound for upper_bound, bucket_count in buckets], [bucket_count for upper_bound, bucket_count in buckets],
+                             where='post', label=phase)
+        ax_hist.set_xscale('log')
+        ax_hist.set_xlabel('Latency (ms)')
+        ax_hist.set_ylabel('Connections')
+        if ax_hist.lines:
+            ax_hist.legend(loc='upper right', fontsize=8)
+
+    def generate_charts_and_tables(self):
+        df = self.read_data()
+        if df.empty:
+            print("No connection attempts stored, no report generated.")
+            return
+        outcome_stats, failed = self.generate_outcome_statistics(df)
+        tables = [self.generate_phase_statistics(df), outcome_stats, self.generate_failure_statistics(df, failed)]
+
+        fig = plt.figure(figsize=(14, 8))
+        grid_spec = fig.add_gridspec(3, 3, width_ratios=[3, 1, 1])
+        self.plot_connect_latency(fig.add_subplot(grid_spec[:2, 0]), df, failed)
+        self.plot_phase_distributions(fig.add_subplot(grid_spec[2, 0]))
+        for row, stats in enumerate(tables):
+            ax_table = fig.add_subplot(grid_spec[row, 1:])
+            ax_table.axis('off')
+            if not stats.empty:
+                table = ax_table.table(cellText=stats.values, colLabels=stats.columns, loc='center')
+                table.auto_set_font_size(False)
+                table.set_fontsize(8)
+                table.scale(1, 2)
+
+        plt.tight_layout()
+        plt.savefig(f'{self.db_filename}_connections_report.png')
+        plt.close(fig)
+
+
+    # Report of a scenario run (--scenario), saved as <db>_scenario_report.png.
+    # p50 and p99 delivery latency per topic group and per subscription from the histogram file, and a table with
+    # published, expected, delivered, missing and duplicate messages and the delivered messages per published message.
+
+class ScenarioReport(LoadTestReport):
+    def read_data(self):
+        conn = sqlite3.connect(self.db_path)
+        df = pd.read_sql_query("SELECT * FROM scenario_groups ORDER BY Kind DESC, Name", conn)
+        conn.close()
+        return df
+
+    def add_latency(self, df):
+        for column, percent in (('p50 (ms)', 50), ('p99 (ms)', 99)):
+            values = []
+            for kind, name in zip(df['Kind'], df['Name']):
+                histogram = self.histograms.get(f"{kind}_{name}") if self.histograms is not None else None
+                values.append(round(histogram.percentile(percent), 3) if histogram is not None and histogram.count else np.nan)
+            df[column] = values
+        return df
+
+    def plot_group_latency(self, ax_bar, df):
+        labels = [f"{kind}: {name}" for kind, name in zip(df['Kind'], df['Name'])]
+        positions = np.arange(len(df))
+        ax_bar.barh(positions - 0.2, df['p50 (ms)'], height=0.4, color='green', label='p50')
+        ax_bar.barh(positions + 0.2, df['p99 (ms)'], height=0.4, color='orange', label='p99')
+        ax_bar.set_yticks(positions)
+        ax_bar.set_yticklabels(labels)
+        ax_bar.invert_yaxis()
+        ax_bar.set_title(f'Delivery Latency per Topic Group and Subscription - {self.db_filename}')
+        ax_bar.set_xlabel('Delay (ms)')
+        ax_bar.legend(loc='lower right')
+
+    def generate_charts_and_tables(self):
+        df = self.add_latency(self.read_data())
+        if df.empty:
+            return
+        fig = plt.figure(figsize=(14, 8))
+        grid_spec = fig.add_gridspec(2, 1, height_ratios=[3, 2])
+        self.plot_group_latency(fig.add_subplot(grid_spec[0]), df)
+
+        table_df = df.astype(object).where(df.notna(), '')
+        table_df['Published'] = [int(value) if value != '' else '' for value in table_df['Published']]
+        table_df['Amplification'] = [round(value, 2) if value != '' else '' for value in table_df['Amplification']]
+        ax_table = fig.add_subplot(grid_spec[1])
+        ax_table.axis('off')
+        table = ax_table.table(cellText=table_df.values, colLabels=table_df.columns, loc='center')
+        table.auto_set_font_size(False)
+        table.set_fontsize(8)
+        table.auto_set_column_width(list(range(len(table_df.columns))))
+        table.scale(1, 1.5)
+
+        plt.tight_layout()
+        plt.savefig(f'{self.db_filename}_scenario_report.png')
+        plt.close(fig)
+
+
+    # Report of a message size and rate sweep (--sweep-sizes), saved as <db>_sweep_report.png.
+    # Delivered against offered MB/s for every step, one line per payload size over the rates, with p99 latency on a
+    # second axis and saturated steps marked, and a table of the steps.
+
+class SweepReport(LoadTestReport):
+    def read_data(self):
+        conn = sqlite3.connect(self.db_path)
+        df = pd.read_sql_query("SELECT * FROM sweep_steps ORDER BY Step", conn)
+        conn.close()
+        return df
+
+    def plot_throughput(self, ax_rate, df):
+        ax_latency = ax_rate.twinx()
+        for size, steps in df.groupby('Size'):
+            line, = ax_rate.plot(steps['OfferedMBPerSecond'], steps['MBPerSecond'], marker='o', label=f'{format_size(size)} delivered')
+            ax_latency.plot(steps['OfferedMBPerSecond'], steps['P99'], linestyle=':', color=line.get_color())
+        saturated = df[df['Saturated'] == 1]
+        if not saturated.empty:
+            ax_rate.scatter(saturated['OfferedMBPerSecond'], saturated['MBPerSecond'], color='red', marker='x', s=80, zorder=3, label='Saturated')
+        limits = [df['OfferedMBPerSecond'].min(), df['OfferedMBPerSecond'].max()]
+        ax_rate.plot(limits, limits, color='grey', linewidth=0.8, linestyle='--', label='Offered')
+        ax_rate.set_xscale('log')
+        ax_rate.set_yscale('log')
+        ax_rate.set_title(f'Delivered Throughput per Step - {self.db_filename}')
+        ax_rate.set_xlabel('Offered (MB/s)')
+        ax_rate.set_ylabel('Delivered (MB/s)')
+        ax_latency.set_ylabel('p99 latency (ms), dotted')
+        ax_rate.legend(loc='upper left', fontsize=8)
+
+    def generate_charts_and_tables(self):
+        df = self.read_data()
+        if df.empty:
+            return
+        fig = plt.figure(figsize=(14, 8))
+        grid_spec = fig.add_gridspec(2, 1, height_ratios=[3, 2])
+        self.plot_throughput(fig.add_subplot(grid_spec[0]), df)
+
+        table_df = pd.DataFrame({
+            'Step': df['Step'],
+            'Size': [format_size(size) for size in df['Size']],
+            'Payload (B)': df['PayloadBytes'],
+            'Rate (msg/s)': [f"{rate:g}" for rate in df['TargetRate']],
+            'Delivered (msg/s)': df['MsgsPerSecond'].round(2),
+            'MB/s': df['MBPerSecond'].round(3),
+            'Offered MB/s': df['OfferedMBPerSecond'].round(3),
+            'Lost': df['Lost'],
+            'p50 (ms)': df['P50'].round(3),
+            'p99 (ms)': df['P99'].round(3),
+            'Saturated': np.where(df['Saturated'] == 1, 'yes', '')
+        }, dtype=object)
+        ax_table = fig.add_subplot(grid_spec[1])
+        ax_table.axis('off')
+        table = ax_table.table(cellText=table_df.fillna('N/A').values, colLabels=table_df.columns, loc='center')
+        table.auto_set_font_size(False)
+        table.set_fontsize(8)
+        table.scale(1, 1.3)
+
+        plt.tight_layout()
+        plt.savefig(f'{self.db_filename}_sweep_report.png')
+        plt.close(fig)
+
+
+    # Report of a run with --stage-timing, saved as <db>_stages_report.png.
+    # p50 and p99 of every stage of the message path from the histogram file on a log axis, and a table with the
+    # stage percentiles and each stage's share of the average delay. Queue and store come after the delay is measured.
+
+STAGE_DESCRIPTIONS = {"encode": "Payload encoding", "publish": "publish() and client queue",
+                      "transit": "Socket, network, broker, read loop", "decode": "Payload decoding",
+                      "queue": "Result queue wait (after delay)", "store": "Database insert (after delay)"}
+DELAY_STAGES = ("encode", "publish", "transit", "decode")
+
+
+class StageReport(LoadTestReport):
+    def read_data(self):
+        rows = []
+        delivery_average = self.histogram.mean() if self.histogram is not None and self.histogram.count else None
+        for stage, description in STAGE_DESCRIPTIONS.items():
+            histogram = self.histograms.get(f"stage_{stage}") if self.histograms is not None else None
+            if histogram is None or not histogram.count:
+                continue
+            share = histogram.mean() / delivery_average * 100 if stage in DELAY_STAGES and delivery_average else None
+            rows.append([stage, description, histogram.count, histogram.mean(), histogram.percentile(50),
+                         histogram.percentile(99), histogram.max / 1000, share])
+        return pd.DataFrame(rows, columns=['Stage', 'Description', 'Count', 'Average (ms)', 'p50 (ms)', 'p99 (ms)', 'Max (ms)', 'Share of delay (%)'])
+
+    def plot_stage_latency(self, ax_bar, df):
+        positions = np.arange(len(df))
+        ax_bar.barh(positions - 0.2, df['p50 (ms)'], height=0.4, color='green', label='p50')
+        ax_bar.barh(positions + 0.2, df['p99 (ms)'], height=0.4, color='orange', label='p99')
+        ax_bar.set_yticks(positions)
+        ax_bar.set_yticklabels(df['Stage'])
+        ax_bar.invert_yaxis()
+        ax_bar.set_xscale('log')
+        ax_bar.set_title(f'Latency per Stage of the Message Path - {self.db_filename}')
+        ax_bar.set_xlabel('Duration (ms)')
+        ax_bar.legend(loc='lower right')
+
+    def generate_charts_and_tables(self):
+        df = self.read_data()
+        if df.empty:
+            return
+        fig = plt.figure(figsize=(14, 8))
+        grid_spec = fig.add_gridspec(2, 1, height_ratios=[3, 2])
+        self.plot_stage_latency(fig.add_subplot(grid_spec[0]), df)
+
+        table_df = df.astype(object)
+        for column in ['Average (ms)', 'p50 (ms)', 'p99 (ms)', 'Max (ms)']:
+            table_df[column] = [round(value, 4) for value in df[column]]
+        table_df['Share of delay (%)'] = [round(value, 1) if pd.notna(value) else '' for value in df['Share of delay (%)']]
+        ax_table = fig.add_subplot(grid_spec[1])
+        ax_table.axis('off')
+        table = ax_table.table(cellText=table_df.values, colLabels=table_df.columns, loc='center')
+        table.auto_set_font_size(False)
+        table.set_fontsize(8)
+        table.auto_set_column_width(list(range(len(table_df.columns))))
+        table.scale(1, 1.5)
+
+        plt.tight_layout()
+        plt.savefig(f'{self.db_filename}_stages_report.png')
+        plt.close(fig)
+
+
+    # Report of a run with lost connections, saved as <db>_recovery_report.png.
+    # Latency over time with every outage (disconnect to reconnect) shaded red and its recovery window (--recovery-window
+    # after the reconnect) orange, a table that separates steady state from recovery latency and failures, and the outages.
+
+class RecoveryReport(LoadTestReport):
+    def read_data(self):
+        conn = sqlite3.connect(self.db_path)
+        df = pd.read_sql_query("""SELECT MessageIndex, ClientId, CAST(HighResPublishTime AS REAL) AS HighResPublishTime, CAST(Delay AS REAL) AS Delay,
+                                        Failed, ScheduledSendTime, SendLag, Qos FROM results ORDER BY COALESCE(ScheduledSendTime, HighResPublishTime)""", conn)
+        events = pd.read_sql_query("SELECT * FROM connection_events ORDER BY HighResTime", conn)
+        conn.close()
+        return df, events
+
+    # One row per outage: a disconnect and the next reconnect of the same client. Without a reconnect it lasts to the end.
+    def outages(self, events):
+        rows = []
+        for client_id, client_events in events.groupby('ClientId'):
+            for event in client_events.itertuples():
+                if event.Event == 'disconnect':
+                    rows.append({'ClientId': client_id, 'Disconnected': event.EventDateTimeUTC[:19], 'Start': event.HighResTime,
+                                 'Reconnect': np.inf, 'RecoveryUntil': np.inf, 'Downtime (s)': np.nan, 'Attempts': np.nan, 'Reason': event.Reason})
+                elif event.Event == 'reconnect' and rows and rows[-1]['ClientId'] == client_id and rows[-1]['Reconnect'] == np.inf:
+                    rows[-1].update({'Reconnect': event.HighResTime, 'RecoveryUntil': event.RecoveryUntil,
+                                     'Downtime (s)': event.DurationMs / 1000, 'Attempts': event.Attempts})
+        return pd.DataFrame(rows).sort_values('Start').reset_index(drop=True)
+
+    # Messages scheduled (or sent) inside an outage or its recovery window of their own client.
+    def recovery_mask(self, df, outages):
+        send_time = df['ScheduledSendTime'].fillna(df['HighResPublishTime'])
+        mask = pd.Series(False, index=df.index)
+        for outage in outages.itertuples():
+            mask |= (df['ClientId'] == outage.ClientId) & (send_time >= outage.Start) & (send_time <= outage.RecoveryUntil)
+        return mask
+
+    # Received and latency from the steady_state and recovery histograms, failed messages from the stored rows.
+    def generate_period_statistics(self, df, mask):
+        rows = []
+        for period, name, period_rows in (('Steady state', 'steady_state', df[~mask]), ('Recovery', 'recovery', df[mask])):
+            histogram = self.histograms.get(name) if self.histograms is not None else None
+            failed = int(period_rows['Failed'].sum())
+            if histogram is not None and histogram.count:
+                rows.append([period, histogram.count, failed, *(round(value, 3) for value in (histogram.mean(), histogram.percentile(50),
+                                                                                              histogram.percentile(99), histogram.max / 1000))])
+            else:
+                delays = period_rows['Delay'].dropna()
+                rows.append([period, len(delays), failed, *((round(value, 3) for value in (delays.mean(), delays.quantile(0.5), delays.quantile(0.99), delays.max()))
+                                                            if len(delays) else ['N/A'] * 4)])
+        return pd.DataFrame(rows, columns=['Period', 'Received', 'Failed', 'Average (ms)', 'p50 (ms)', 'p99 (ms)', 'Max (ms)'])
+
+    # Outages and recovery windows on the time axis of plot_latency_over_time.
+    def plot_outages(self, ax_time, df, outages):
+        send_time = df['ScheduledSendTime'].fillna(df['HighResPublishTime'])
+        origin = send_time.min()
+        end = max(send_time.max(), outages['Start'].max()) - origin
+        for number, outage in enumerate(outages.itertuples()):
+            ax_time.axvspan(outage.Start - origin, min(outage.Reconnect - origin, end), color='red', alpha=0.2, label='Outage' if number == 0 else None)
+            if outage.Reconnect != np.inf:
+                ax_time.axvspan(outage.Reconnect - origin, min(outage.RecoveryUntil - origin, end), color='orange', alpha=0.2, label='Recovery' if number == 0 else None)
+        ax_time.legend(loc='upper left')
+
+    def generate_charts_and_tables(self):
+        df, events = self.read_data()
+        if events.empty:
+            return
+        outages = self.outages(events)
+        mask = self.recovery_mask(df, outages)
+        fig = plt.figure(figsize=(14, 8))
+        grid_spec = fig.add_gridspec(2, 2, height_ratios=[3, 2])
+        ax_time = fig.add_subplot(grid_spec[0, :])
+        if self.rows_stored(int((df['Failed'] == 0).sum())) and df['Delay'].notna().any():
+            self.plot_latency_over_time(ax_time, self.bucket_by_time(df))
+            self.plot_outages(ax_time, df, outages)
+        else:
+            ax_time.axis('off')
+            ax_time.set_title(f'Outages - {self.db_filename}')
+            ax_time.text(0.5, 0.5, 'Message rows were not stored (--store-rows false), latency over time is not available.', ha='center', va='center')
+
+        outage_table = outages[['ClientId', 'Disconnected', 'Downtime (s)', 'Attempts', 'Reason']].head(10).astype(object)
+        outage_table['Downtime (s)'] = [round(value, 3) if pd.notna(value) else 'Not reconnected' for value in outages['Downtime (s)'].head(10)]
+        outage_table['Attempts'] = [int(value) if pd.notna(value) else '' for value in outages['Attempts'].head(10)]
+        tables = [(self.generate_period_statistics(df, mask), 'Steady State and Recovery'), (outage_table, f'Outages ({len(outages)})')]
+        for column, (table_df, title) in enumerate(tables):
+            ax_table = fig.add_subplot(grid_spec[1, column])
+            ax_table.axis('off')
+            table = ax_table.table(cellText=table_df.values, colLabels=table_df.columns, loc='center')
+            table.auto_set_font_size(False)
+            table.set_fontsize(8)
+            table.auto_set_column_width(list(range(len(table_df.columns))))
+            table.scale(1, 1.5)
+            ax_table.set_title(title)
+
+        plt.tight_layout()
+        plt.savefig(f'{self.db_filename}_recovery_report.png')
+        plt.close(fig)
+
+# Every report the database has data for: the connection storm report for a storm run, otherwise the message
+# report, plus the per-group report for a scenario run, the per-step report for a sweep, the stage report with --stage-timing
+# and the recovery report when connections were lost.
+def generate_reports(db_path):
+    conn = sqlite3.connect(db_path)
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    storm = "connections" in tables and conn.execute("SELECT COUNT(*) FROM connections").fetchone()[0] > 0
+    conn.close()
+    if storm:
+        ConnectionStormReport(db_path).generate_charts_and_tables()
+        return
+    LoadTestReport(db_path).generate_charts_and_tables()
+    if "scenario_groups" in tables:
+        ScenarioReport(db_path).generate_charts_and_tables()
+    if "sweep_steps" in tables:
+        SweepReport(db_path).generate_charts_and_tables()
+    StageReport(db_path).generate_charts_and_tables() # Nothing without stage histograms.
+    if "connection_events" in tables:
+        RecoveryReport(db_path).generate_charts_and_tables()
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import sqlite3
+from LatencyHistogram import HistogramSet, histogram_path, PERCENTILES
+logger = logging.getLogger(__name__)
+
+    # Optional consolidated store of many runs (--history-db), next to the per-run results files.
+    # runs:        one row per run with label, broker, start and end time, the configuration as JSON and totals.
+    # run_latency: latency aggregates of every histogram of a run (delivery, per QoS, publish ack, round trip).
+    # run_results: the per-message rows of every run, indexed by run.
+    # compare() computes latency percentile and throughput deltas between two runs and flags regressions,
+    # so broker versions can be gated in CI.
+
+SECRET_ARGUMENTS = ("username", "password")
+LATENCY_COLUMNS = ["Min (ms)", "Max (ms)", "Average (ms)"] + [f"p{percent:g} (ms)" for percent in PERCENTILES]
+
+
+# "p99.9 (ms)" -> "P99_9", SQLite column names without spaces and dots.
+def column_name(key):
+    return key.split(" ")[0].replace(".", "_").capitalize()
+
+
+class RunHistory:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.create_tables()
+
+    def create_tables(self):
+        latency_columns = ", ".join(f"{column_name(key)} REAL" for key in LATENCY_COLUMNS)
+        with self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS runs (
+                                 RunId INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 Label TEXT,
+                                 Broker TEXT,
+                                 StartTimeUTC TEXT,
+                                 EndTimeUTC TEXT,
+                                 Config TEXT,
+                                 ResultsFile TEXT,
+                                 Received INTEGER,
+                                 Failed INTEGER,
+                                 MsgsPerSecond REAL)""")
+            self.conn.execute(f"""CREATE TABLE IF NOT EXISTS run_latency (
+                                  RunId INTEGER REFERENCES runs(RunId),
+                                  Metric TEXT,
+                                  Count INTEGER,
+                                  {latency_columns},
+                                  PRIMARY KEY (RunId, Metric))""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS run_results (
+                                 RunId INTEGER REFERENCES runs(RunId),
+                                 ClientId TEXT,
+                                 MessageIndex INTEGER,
+                                 PublishDateTimeUTC TEXT,
+                                 Delay REAL,
+                                 Failed INTEGER,
+                                 ScheduledSendTime REAL,
+                                 SendLag REAL,
+                                 Qos INTEGER)""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_run_results_run ON run_results (RunId, ClientId, MessageIndex)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_label ON runs (Label, RunId)")
+
+    # Store a finished run. Its results database must be flushed and its histogram file written.
+    def record_run(self, args, results_file, start_time, end_time, label=None):
+        histograms = self.read_histograms(results_file)
+        delivery = histograms.get("delivery")
+        source = sqlite3.connect(results_file)
+        try:
+            failed, first_publish, last_receive = source.execute(
+                "SELECT COALESCE(SUM(Failed), 0), MIN(CAST(HighResPublishTime AS REAL)), MAX(CAST(HighResSubscribeTime AS REAL)) FROM results").fetchone()
+        finally:
+            source.close()
+        # Receive rate from the stored rows, or over the whole run when only failed messages were stored.
+        duration = (last_receive - first_publish) if first_publish is not None and last_receive is not None else (end_time - start_time).total_seconds()
+        msgs_per_second = delivery.count / duration if duration > 0 else None
+        config = {key: value for key, value in vars(args).items() if key not in SECRET_ARGUMENTS}
+        with self.conn:
+            cursor = self.conn.execute(
+                """INSERT INTO runs (Label, Broker, StartTimeUTC, EndTimeUTC, Config, ResultsFile, Received, Failed, MsgsPerSecond)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (label, f"{args.protocol}://{args.host}:{args.port}", start_time.isoformat(timespec='seconds'),
+                 end_time.isoformat(timespec='seconds'), json.dumps(config, default=str), os.path.abspath(results_file),
+                 delivery.count, failed, msgs_per_second))
+            run_id = cursor.lastrowid
+            for name in histograms.names():
+                summary = histograms.get(name).summary()
+                if summary:
+                    self.conn.execute(f"""INSERT INTO run_latency (RunId, Metric, Count, {', '.join(column_name(key) for key in LATENCY_COLUMNS)})
+                                          VALUES (?, ?, ?, {', '.join('?' for key in LATENCY_COLUMNS)})""",
+                                      (run_id, name, histograms.get(name).count, *(summary[key] for key in LATENCY_COLUMNS)))
+        self.conn.execute("ATTACH DATABASE ? AS source", (results_file,)) # Not allowed inside a transaction.
+        try:
+            with self.conn:
+                self.conn.execute("""INSERT INTO run_results (RunId, ClientId, MessageIndex, PublishDateTimeUTC, Delay, Failed, ScheduledSendTime, SendLag, Qos)
+                                     SELECT ?, ClientId, MessageIndex, PublishDateTimeUTC, CAST(Delay AS REAL), Failed, ScheduledSendTime, SendLag, Qos
+                                     FROM source.results""", (run_id,))
+        finally:
+            self.conn.execute("DETACH DATABASE source")
+        return run_id
+
+    def read_histograms(self, results_file):
+        path = histogram_path(results_file)
+        try:
+            return HistogramSet.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Could not read latency histograms {path}: {e}")
+            return HistogramSet()
+
+    # Run ID from an ID or a label (latest run with that label). None selects the latest run.
+    def resolve_run(self, run, before=None):
+        if run is None:
+            sql, params = "SELECT RunId FROM runs WHERE (? IS NULL OR RunId < ?) ORDER BY RunId DESC LIMIT 1", (before, before)
+        elif str(run).isdigit():
+            sql, params = "SELECT RunId FROM runs WHERE RunId = ?", (int(run),)
+        else:
+            sql, params = "SELECT RunId FROM runs WHERE Label = ? ORDER BY RunId DESC LIMIT 1", (run,)
+        row = self.conn.execute(sql, params).fetchone()
+        return row[0] if row else None
+
+    def run_info(self, run_id):
+        row = self.conn.execute("SELECT RunId, Label, Broker, StartTimeUTC, Received, Failed, MsgsPerSecond FROM runs WHERE RunId = ?",
+                                (run_id,)).fetchone()
+        return dict(zip(["RunId", "Label", "Broker", "StartTimeUTC", "Received", "Failed", "Msgs/s"], row))
+
+    def latency(self, run_id, metric="delivery"):
+        row = self.conn.execute(f"SELECT {', '.join(column_name(key) for key in LATENCY_COLUMNS)} FROM run_latency WHERE RunId = ? AND Metric = ?",
+                                (run_id, metric)).fetchone()
+        return dict(zip(LATENCY_COLUMNS, row)) if row else {}
+
+    # Latency histograms recorded for a run, for example delivery, publish_ack_qos_1 or stage_transit.
+    def metrics(self, run_id):
+        return [row[0] for row in self.conn.execute("SELECT Metric FROM run_latency WHERE RunId = ? ORDER BY Metric", (run_id,))]
+
+    # One row per compared value: baseline, candidate, change in percent and whether it breaches its threshold.
+    # Latency regresses when it grows by more than max_latency_increase percent, throughput when it drops by
+    # more than max_throughput_decrease percent.
+    def compare(self, baseline_id, candidate_id, metric="delivery", percentiles=("p50 (ms)", "p99 (ms)"),
+                max_latency_increase=10.0, max_throughput_decrease=10.0):
+        rows = []
+        baseline_latency = self.latency(baseline_id, metric)
+        candidate_latency = self.latency(candidate_id, metric)
+        for key in LATENCY_COLUMNS:
+            rows.append(comparison_row(key, baseline_latency.get(key), candidate_latency.get(key),
+                                       max_latency_increase if key in percentiles else None, higher_is_worse=True))
+        baseline, candidate = self.run_info(baseline_id), self.run_info(candidate_id)
+        rows.append(comparison_row("Msgs/s", baseline["Msgs/s"], candidate["Msgs/s"], max_throughput_decrease, higher_is_worse=False))
+        for key in ("Received", "Failed"):
+            rows.append(comparison_row(key, baseline[key], candidate[key], None, higher_is_worse=key == "Failed"))
+        return rows
+
+    def close(self):
+        self.conn.close()
+
+
+def comparison_row(name, baseline, candidate, threshold, higher_is_worse):
+    change = None
+    if baseline is not None and candidate is not None and baseline != 0:
+        change = (candidate - baseline) / abs(baseline) * 100
+    worse_by = None if change is None else (change if higher_is_worse else -change)
+    return {
+        "Metric": name,
+        "Baseline": baseline,
+        "Candidate": candidate,
+        "Change (%)": change,
+        "Threshold (%)": threshold,
+        "Regression": threshold is not None and worse_by is not None and worse_by > threshold,
+    }
+
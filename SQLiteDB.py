@@ -2,21 +2,41 @@ import datetime
 import logging
 import sqlite3
 import sys
+import threading
+import time
+from queue import Queue, Empty
 from dotenv import load_dotenv
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 # Every run in application creates a new database.
-# Table contains message index, publish datetime, high-res. published time, high-res. received time, calculated message delay and failed true/false.
+# Table contains message index, client ID, publish datetime, high-res. published time, high-res. received time, calculated message delay and failed true/false.
+# Scheduled send time and send lag (ms behind the open-loop schedule) are stored also for failed messages.
+# With batch_size > 1 results are queued and written by a single writer thread with executemany,
+# one transaction per batch_size rows or per flush_interval seconds, whichever comes first.
+# Worker processes of a multi-process fan-out write their own shard database, merged into the run database at the end.
+RESULT_INSERT_SQL = '''INSERT INTO results (MessageIndex, ClientId, PublishDateTimeUTC, HighResPublishTime, HighResSubscribeTime, Delay, Failed, ScheduledSendTime, SendLag, Qos)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
 
 class SQLiteDB:
-    def __init__(self):
+    def __init__(self, batch_size=1, flush_interval=0.5, journal_mode="WAL", synchronous="NORMAL", status_interval=0.5, db_file=None):
         timestamp =  datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.db_file = f'mqtt_testeri_results_{timestamp}.sqlite' # Add timestamp to file name.
+        self.db_file = db_file or f'mqtt_testeri_results_{timestamp}.sqlite' # Add timestamp to file name.
+        self.lock = threading.Lock() # Results are inserted from several client threads.
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.status_interval = status_interval # Minimum seconds between status line updates, None for no status line.
+        self.last_status_time = 0.0
         self.conn = self.create_connection()
+        self.configure_connection(journal_mode, synchronous)
         self.create_table()
         self.last_publish_index = None
         self.last_result_index = None
+        self.events_table_created = False
+        self.write_queue = None
+        self.writer_thread = None
+        if self.batch_size > 1:
+            self.start_writer()
 
     def create_connection(self):
         try:
@@ -27,18 +47,31 @@ class SQLiteDB:
             logging.error(f"The error '{e}' occurred while connecting to database.")
             return None
         
+    # Journal mode and synchronous level trade durability for insert speed.
+    def configure_connection(self, journal_mode, synchronous):
+        try:
+            self.conn.execute(f"PRAGMA journal_mode={journal_mode};")
+            self.conn.execute(f"PRAGMA synchronous={synchronous};")
+        except sqlite3.Error as e:
+            logging.error(f"Error configuring database connection: {e}")
+
     # Create publish and results tables  
     def create_table(self):
         try:
             c = self.conn.cursor()
             c.execute("BEGIN;")
             c.execute("""CREATE TABLE IF NOT EXISTS results (
-                        MessageIndex INTEGER PRIMARY KEY,
+                        MessageIndex INTEGER,
+                        ClientId TEXT,
                         PublishDateTimeUTC TEXT,
                         HighResPublishTime TEXT,
                         HighResSubscribeTime TEXT,
                         Delay REAL,
-                        Failed INTEGER DEFAULT 0
+                        Failed INTEGER DEFAULT 0,
+                        ScheduledSendTime REAL,
+                        SendLag REAL,
+                        Qos INTEGER,
+                        PRIMARY KEY (ClientId, MessageIndex)
                     );""")
             self.conn.commit()
             logging.info("Table creation successful")
@@ -46,30 +79,297 @@ class SQLiteDB:
             self.conn.rollback()
             logging.error(f"Error creating tables: {e}")
 
-    def insert_result(self, message_index, publish_date_time_utc, publish_time, subscribe_time, delay, failed=False):
-        sql = '''INSERT INTO results (MessageIndex, PublishDateTimeUTC, HighResPublishTime, HighResSubscribeTime, Delay, Failed) VALUES (?, ?, ?, ?, ?, ?)'''
+    # Connection storm attempts (--storm-connections), one row per connection. Phase times in ms, NULL when not reached.
+    def create_connections_table(self):
         try:
-            cur = self.conn.cursor()
-            cur.execute("BEGIN;")           
-            # When failed is True, set time and delay fields to None, which inserts NULL in the database
-            if failed:
-                publish_time = None
-                subscribe_time = None
-                delay = None           
-            # Convert delay to a formatted string if it's not None
-            formatted_delay = f"{float(delay):.4f}" if delay is not None else None
-            # Execute SQL with all necessary values, including the 'Failed' flag
-            cur.execute(sql, (message_index, publish_date_time_utc, publish_time, subscribe_time, formatted_delay, int(failed)))
-            self.conn.commit()
-            self.last_result_index = message_index
-            self.update_status()
+            with self.lock:
+                self.conn.execute("""CREATE TABLE IF NOT EXISTS connections (
+                                     ConnectionIndex INTEGER PRIMARY KEY,
+                                     ClientId TEXT,
+                                     ScheduledTime REAL,
+                                     StartLag REAL,
+                                     TransportMs REAL,
+                                     TlsHandshakeMs REAL,
+                                     ConnackMs REAL,
+                                     ConnectTotalMs REAL,
+                                     SubackMs REAL,
+                                     ReturnCode INTEGER,
+                                     Error TEXT
+                                 );""")
+                self.conn.commit()
         except sqlite3.Error as e:
-            self.conn.rollback()
-            logging.error(f"Error inserting into results table: {e}, Last successful MessageIndex: {message_index}")
+            logging.error(f"Error creating connections table: {e}")
+
+    def insert_connections(self, rows):
+        sql = """INSERT INTO connections (ConnectionIndex, ClientId, ScheduledTime, StartLag, TransportMs, TlsHandshakeMs, ConnackMs,
+                                          ConnectTotalMs, SubackMs, ReturnCode, Error)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+        with self.lock:
+            try:
+                self.conn.executemany(sql, rows)
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                logging.error(f"Error inserting into connections table: {e}")
+
+    # Totals per topic group and subscription of a scenario run (--scenario).
+    def create_scenario_table(self):
+        try:
+            with self.lock:
+                self.conn.execute("""CREATE TABLE IF NOT EXISTS scenario_groups (
+                                     Kind TEXT,
+                                     Name TEXT PRIMARY KEY,
+                                     Pattern TEXT,
+                                     Clients INTEGER,
+                                     Published INTEGER,
+                                     Expected INTEGER,
+                                     Delivered INTEGER,
+                                     Missing INTEGER,
+                                     Duplicates INTEGER,
+                                     Amplification REAL
+                                 );""")
+                self.conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error creating scenario_groups table: {e}")
+
+    def insert_scenario_groups(self, rows):
+        with self.lock:
+            try:
+                self.conn.executemany("INSERT INTO scenario_groups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                logging.error(f"Error inserting into scenario_groups table: {e}")
+
+    # One row per step of a message size and rate sweep (--sweep-sizes). Rates in msgs/s and MB/s, latency in ms.
+    def create_sweep_table(self):
+        try:
+            with self.lock:
+                self.conn.execute("""CREATE TABLE IF NOT EXISTS sweep_steps (
+                                     Step INTEGER PRIMARY KEY,
+                                     Size INTEGER,
+                                     PayloadBytes INTEGER,
+                                     TargetRate REAL,
+                                     Sent INTEGER,
+                                     Received INTEGER,
+                                     Lost INTEGER,
+                                     MsgsPerSecond REAL,
+                                     MBPerSecond REAL,
+                                     OfferedMBPerSecond REAL,
+                                     P50 REAL,
+                                     P99 REAL,
+                                     Saturated INTEGER
+                                 );""")
+                self.conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error creating sweep_steps table: {e}")
+
+    def insert_sweep_step(self, step):
+        with self.lock:
+            try:
+                self.conn.execute(f"INSERT INTO sweep_steps ({', '.join(step)}) VALUES ({', '.join('?' for column in step)})", tuple(step.values()))
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                logging.error(f"Error inserting into sweep_steps table: {e}")
+
+    # Unexpected disconnects and reconnects of the clients. Times are perf_counter seconds like HighResPublishTime,
+    # a reconnect has the downtime in ms, the connection attempts and the end of its recovery window.
+    def create_connection_events_table(self):
+        try:
+            with self.lock:
+                self.conn.execute("""CREATE TABLE IF NOT EXISTS connection_events (
+                                     ClientId TEXT,
+                                     Event TEXT,
+                                     EventDateTimeUTC TEXT,
+                                     HighResTime REAL,
+                                     DurationMs REAL,
+                                     ReturnCode INTEGER,
+                                     Reason TEXT,
+                                     Attempts INTEGER,
+                                     RecoveryUntil REAL
+                                 );""")
+                self.conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Error creating connection_events table: {e}")
+
+    # Written right away, events are rare. The table is created with the first event.
+    def insert_connection_event(self, client_id, event, high_res_time, duration=None, return_code=None, reason=None, attempts=None, recovery_until=None):
+        if not self.events_table_created:
+            self.create_connection_events_table()
+            self.events_table_created = True
+        event_time_utc = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+        with self.lock:
+            try:
+                self.conn.execute("INSERT INTO connection_events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  (client_id, event, event_time_utc, high_res_time, duration, return_code, reason, attempts, recovery_until))
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                logging.error(f"Error inserting into connection_events table: {e}")
+
+    def insert_result(self, message_index, publish_date_time_utc, publish_time, subscribe_time, delay, failed=False, client_id=None,
+                      scheduled_time=None, send_lag=None, qos=None):
+        row = self.prepare_row(message_index, publish_date_time_utc, publish_time, subscribe_time, delay, failed, client_id, scheduled_time, send_lag, qos)
+        write_queue = self.write_queue
+        if write_queue is not None:
+            write_queue.put(row)
+        else:
+            self.write_rows([row])
+
+    # Build the row tuple for the results table.
+    def prepare_row(self, message_index, publish_date_time_utc, publish_time, subscribe_time, delay, failed, client_id, scheduled_time, send_lag, qos):
+        # When failed is True, set time and delay fields to None, which inserts NULL in the database
+        if failed:
+            publish_time = None
+            subscribe_time = None
+            delay = None
+        # Convert delay to a formatted string if it's not None
+        formatted_delay = f"{float(delay):.4f}" if delay is not None else None
+        return (message_index, client_id, publish_date_time_utc, publish_time, subscribe_time, formatted_delay, int(failed), scheduled_time, send_lag, qos)
+
+    # Insert rows in one transaction. When the batch fails the rows are inserted one at a time, so one bad row
+    # (e.g. a duplicate ClientId and MessageIndex) loses only itself.
+    def write_rows(self, rows):
+        with self.lock:
+            if self.conn is None:
+                logging.error(f"Database connection is closed, dropped {len(rows)} results.")
+                return
+            try:
+                cur = self.conn.cursor()
+                cur.execute("BEGIN;")
+                cur.executemany(RESULT_INSERT_SQL, rows)
+                self.conn.commit()
+                self.last_result_index = rows[-1][0]
+                self.update_status()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                if len(rows) == 1:
+                    logging.error(f"Error inserting into results table: {e}, Last successful MessageIndex: {self.last_result_index}")
+                else:
+                    logging.debug(f"Batch insert of {len(rows)} results failed ({e}), inserting them one at a time.")
+                    self.write_rows_singly(rows)
+                    self.update_status()
+
+    # Insert rows one per transaction and log the rows that fail. Called with the lock held.
+    def write_rows_singly(self, rows):
+        for row in rows:
+            try:
+                self.conn.execute(RESULT_INSERT_SQL, row)
+                self.conn.commit()
+                self.last_result_index = row[0]
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                logging.error(f"Error inserting MessageIndex {row[0]} of client {row[1]} into results table: {e}")
+
+    def start_writer(self):
+        self.write_queue = Queue()
+        self.writer_thread = threading.Thread(target=self.writer_loop, name="SQLiteWriter", daemon=True)
+        self.writer_thread.start()
+
+    # Writer thread: collect rows until the batch is full or the flush window ends, then write them.
+    def writer_loop(self):
+        running = True
+        while running:
+            item = self.write_queue.get()
+            batch = []
+            handled = 1
+            if item is None:
+                running = False
+            else:
+                batch.append(item)
+            deadline = time.monotonic() + self.flush_interval
+            while running and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.write_queue.get(timeout=remaining)
+                except Empty:
+                    break
+                handled += 1
+                if item is None:
+                    running = False
+                else:
+                    batch.append(item)
+            if batch:
+                self.write_rows(batch)
+            for _ in range(handled):
+                self.write_queue.task_done()
+
+    # Results waiting for the writer thread.
+    def queue_depth(self):
+        write_queue = self.write_queue
+        return write_queue.qsize() if write_queue is not None else 0
+
+    # Block until every queued result has been written.
+    def flush(self):
+        write_queue = self.write_queue
+        if write_queue is not None:
+            write_queue.join()
+        if self.last_result_index is not None:
+            self.update_status(force=True)
+
+    # Copy the results and connection events of a worker shard database into this database.
+    def merge_results(self, shard_file):
+        self.flush()
+        shard = sqlite3.connect(shard_file)
+        try:
+            has_events = shard.execute("SELECT 1 FROM sqlite_master WHERE name = 'connection_events'").fetchone() is not None
+        finally:
+            shard.close()
+        if has_events:
+            self.create_connection_events_table()
+        with self.lock:
+            try:
+                self.conn.execute("ATTACH DATABASE ? AS shard", (shard_file,)) # Not allowed inside a transaction.
+                try:
+                    with self.conn:
+                        self.conn.execute("INSERT INTO results SELECT * FROM shard.results")
+                        if has_events:
+                            self.conn.execute("INSERT INTO connection_events SELECT * FROM shard.connection_events")
+                finally:
+                    self.conn.execute("DETACH DATABASE shard")
+            except sqlite3.Error as e:
+                logging.error(f"Error merging results of {shard_file}: {e}")
 
+    # Per-client (or aggregate) latency and throughput for fan-out runs.
+    # Throughput is received messages divided by the time from the first publish to the last receive.
+    def client_statistics(self, per_client=True):
+        group_by = "GROUP BY ClientId ORDER BY ClientId" if per_client else ""
+        sql = f"""SELECT {'ClientId' if per_client else "'ALL'"},
+                        SUM(CASE WHEN Failed = 0 THEN 1 ELSE 0 END),
+                        SUM(Failed),
+                        MIN(CAST(Delay AS REAL)),
+                        AVG(CAST(Delay AS REAL)),
+                        MAX(CAST(Delay AS REAL)),
+                        MIN(CAST(HighResPublishTime AS REAL)),
+                        MAX(CAST(HighResSubscribeTime AS REAL))
+                 FROM results {group_by}"""
+        statistics = []
+        with self.lock:
+            rows = self.conn.execute(sql).fetchall()
+        for client_id, received, failed, min_delay, avg_delay, max_delay, first_publish, last_receive in rows:
+            duration = (last_receive - first_publish) if first_publish is not None and last_receive is not None else None
+            statistics.append({
+                "ClientId": client_id,
+                "Received": received or 0,
+                "Failed": failed or 0,
+                "Min (ms)": min_delay,
+                "Average (ms)": avg_delay,
+                "Max (ms)": max_delay,
+                "Msgs/s": received / duration if duration else None,
+            })
+        return statistics
 
     # Updates message index on one line during the run without spamming.
-    def update_status(self):
+    def update_status(self, force=False):
+        if self.status_interval is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_status_time < self.status_interval:
+            return
+        self.last_status_time = now
         sys.stdout.write('\r\033[K')  # Move to the beginning and clear the line
         message = f"Latest Result Insert: MessageIndex {self.last_result_index}. "
         sys.stdout.write(message)
@@ -81,7 +381,14 @@ class SQLiteDB:
         sys.stdout.flush()
         logger.error(f"{error_message}, Last successful MessageIndex: {last_index - 1}. " )
 
+    # Write all queued results, stop the writer thread and close the database. Safe to call more than once.
     def close_connection(self):
+        if self.writer_thread is not None:
+            self.write_queue.put(None)
+            self.writer_thread.join()
+            self.writer_thread = None
+            self.write_queue = None
         if self.conn:
             self.conn.close()
+            self.conn = None
             logging.info("Database connection closed.")
\ No newline at end of file
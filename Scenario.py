@@ -0,0 +1,111 @@
+import itertools
+import json
+import os
+import re
+from paho.mqtt.client import topic_matches_sub
+
+    # Workload definition for topic fan-in / fan-out tests (--scenario), a JSON or YAML file:
+    #
+    #   {"duration": 60,
+    #    "topics": [{"name": "temp", "pattern": "site/{site:10}/line/{line:4}/temp", "publishers": 1, "rate": 2, "qos": 0}],
+    #    "subscriptions": [{"name": "all-temps", "filter": "site/+/line/+/temp", "count": 3, "qos": 1},
+    #                      {"name": "site-0", "filter": "site/0/#"}]}
+    #
+    # {name:N} in a pattern expands to the levels 0 ... N-1, so the example is a tree of 40 topics. Every topic has
+    # "publishers" publisher clients sending "rate" msgs/s each, every subscription is "count" clients with the same filter.
+    # Topics and filters are relative to --topic. A message is expected once by every subscriber whose filter matches
+    # its topic, so the delivered messages per published message show the fan-out amplification of each topic group.
+
+PLACEHOLDER = re.compile(r"\{(\w+):(\d+)\}")
+
+
+# "a/{x:2}/b/{y:2}" -> ["a/0/b/0", "a/0/b/1", "a/1/b/0", "a/1/b/1"]
+def expand_pattern(pattern):
+    placeholders = PLACEHOLDER.findall(pattern)
+    if not placeholders:
+        return [pattern]
+    topics = []
+    for values in itertools.product(*(range(int(count)) for name, count in placeholders)):
+        levels = iter(values)
+        topics.append(PLACEHOLDER.sub(lambda match: str(next(levels)), pattern))
+    return topics
+
+
+def validate_filter(topic_filter):
+    levels = topic_filter.split("/")
+    for position, level in enumerate(levels):
+        if "#" in level and (level != "#" or position != len(levels) - 1):
+            raise ValueError(f"'#' must be a whole last level of the filter: {topic_filter}")
+        if "+" in level and level != "+":
+            raise ValueError(f"'+' must be a whole level of the filter: {topic_filter}")
+
+
+class TopicGroup:
+    def __init__(self, name, pattern, publishers=1, rate=None, qos=0):
+        self.name = name
+        self.pattern = pattern
+        self.topics = expand_pattern(pattern)
+        self.publishers = publishers # Publisher clients per topic.
+        self.rate = rate # Msgs/s per publisher, None uses --rate.
+        self.qos = qos
+        if any(character in pattern for character in "+#"):
+            raise ValueError(f"Topic pattern {pattern} must not contain wildcards, they belong in subscription filters.")
+        if publishers < 1 or (rate is not None and rate <= 0) or qos not in (0, 1, 2):
+            raise ValueError(f"Topic group {name}: publishers must be at least 1, rate above 0 and qos 0, 1 or 2.")
+
+
+class SubscriptionGroup:
+    def __init__(self, name, topic_filter, count=1, qos=0):
+        self.name = name
+        self.filter = topic_filter
+        self.count = count # Subscriber clients with this filter.
+        self.qos = qos
+        validate_filter(topic_filter)
+        if count < 1 or qos not in (0, 1, 2):
+            raise ValueError(f"Subscription {name}: count must be at least 1 and qos 0, 1 or 2.")
+
+    def matches(self, topic):
+        return topic_matches_sub(self.filter, topic)
+
+
+class Scenario:
+    def __init__(self, topic_groups, subscription_groups, duration=None):
+        self.topic_groups = topic_groups
+        self.subscription_groups = subscription_groups
+        self.duration = duration
+        if not topic_groups or not subscription_groups:
+            raise ValueError("A scenario needs at least one topic group and one subscription.")
+        names = [group.name for group in topic_groups + subscription_groups]
+        if len(set(names)) != len(names):
+            raise ValueError("Topic group and subscription names must be unique.")
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as scenario_file:
+            if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ValueError("YAML scenarios need PyYAML (pip install pyyaml), or use a JSON scenario file.")
+                data = yaml.safe_load(scenario_file)
+            else:
+                data = json.load(scenario_file)
+        return cls.from_dict(data)
+
+    @classmethod
+    def from_dict(cls, data):
+        try:
+            topic_groups = [TopicGroup(topic.get("name", topic["pattern"]), topic["pattern"], int(topic.get("publishers", 1)),
+                                       topic.get("rate"), int(topic.get("qos", 0))) for topic in data.get("topics", [])]
+            subscription_groups = [SubscriptionGroup(subscription.get("name", subscription["filter"]), subscription["filter"],
+                                                     int(subscription.get("count", 1)), int(subscription.get("qos", 0)))
+                                   for subscription in data.get("subscriptions", [])]
+        except KeyError as e:
+            raise ValueError(f"Scenario entry without {e}.")
+        return cls(topic_groups, subscription_groups, data.get("duration"))
+
+    def describe(self):
+        topics = sum(len(group.topics) for group in self.topic_groups)
+        publishers = sum(len(group.topics) * group.publishers for group in self.topic_groups)
+        subscribers = sum(group.count for group in self.subscription_groups)
+        return f"{topics} topics in {len(self.topic_groups)} groups, {publishers} publishers, {subscribers} subscribers"
@@ -0,0 +1,112 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+logger = logging.getLogger(__name__)
+
+    # One background thread that expires message timeouts, no matter how many messages are in flight.
+    # Deadlines are kept in a heap. Cancelled entries stay in the heap and are skipped when they reach the top,
+    # the heap is compacted when most of it is cancelled entries.
+    # Expired entries are collected in batches and their callbacks are run outside the lock.
+
+# Returned by schedule(). Has the same cancel() as threading.Timer so callers can treat it like one.
+class TimeoutHandle:
+    __slots__ = ('scheduler', 'deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, scheduler, deadline, callback, args):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+
+class TimeoutScheduler:
+    def __init__(self, resolution=0.01):
+        self.resolution = resolution # Minimum sleep between wake-ups, expiries within this window are handled as one batch.
+        self.heap = []
+        self.condition = threading.Condition()
+        self.sequence = itertools.count() # Tie-breaker for equal deadlines.
+        self.cancelled_count = 0
+        self.running = False
+        self.thread = None
+
+    # Number of timeouts that are still pending.
+    def __len__(self):
+        with self.condition:
+            return len(self.heap) - self.cancelled_count
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name="TimeoutScheduler", daemon=True)
+        self.thread.start()
+
+    # Call callback(*args) after delay seconds unless the returned handle is cancelled first.
+    def schedule(self, delay, callback, *args):
+        handle = TimeoutHandle(self, time.monotonic() + delay, callback, args)
+        with self.condition:
+            heapq.heappush(self.heap, (handle.deadline, next(self.sequence), handle))
+            if self.heap[0][2] is handle:
+                self.condition.notify() # New earliest deadline, wake up the scheduler thread.
+        return handle
+
+    def cancel(self, handle):
+        with self.condition:
+            if handle.cancelled:
+                return
+            handle.cancelled = True
+            self.cancelled_count += 1
+            if self.cancelled_count > 1024 and self.cancelled_count * 2 > len(self.heap):
+                self.compact()
+
+    # Drop cancelled entries from the heap. Called with the lock held.
+    def compact(self):
+        self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+        heapq.heapify(self.heap)
+        self.cancelled_count = 0
+
+    # Scheduler thread: sleep until the earliest deadline and expire everything that is due.
+    def run(self):
+        while True:
+            expired = []
+            with self.condition:
+                while self.running:
+                    now = time.monotonic()
+                    if self.heap and self.heap[0][0] <= now:
+                        break
+                    wait_time = self.heap[0][0] - now if self.heap else None
+                    if wait_time is not None:
+                        wait_time = max(wait_time, self.resolution)
+                    self.condition.wait(wait_time)
+                if not self.running:
+                    break
+                now = time.monotonic()
+                while self.heap and self.heap[0][0] <= now:
+                    handle = heapq.heappop(self.heap)[2]
+                    if handle.cancelled:
+                        self.cancelled_count -= 1
+                    else:
+                        handle.cancelled = True # A late cancel() is a no-op.
+                        expired.append(handle)
+
+            for handle in expired:
+                try:
+                    handle.callback(*handle.args)
+                except Exception as e:
+                    logging.error(f"Timeout callback failed: {e}")
+
+    # Stop the scheduler thread. Pending timeouts are dropped.
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,98 @@
+import pytest
+from InFlightTracker import InFlightTracker, InFlightMessage
+
+
+def send(tracker, *message_indices):
+    for message_index in message_indices:
+        tracker.add(message_index, InFlightMessage(f"sent {message_index}"))
+
+
+def test_window_must_be_a_multiple_of_eight():
+    for window in (0, 4, 12):
+        with pytest.raises(ValueError):
+            InFlightTracker(window)
+
+
+def test_first_delivery_duplicate_and_late():
+    tracker = InFlightTracker(8)
+    send(tracker, 1, 2, 3)
+    assert tracker.receive(1).publish_datetime == "sent 1"
+    assert tracker.receive(1) is None
+    assert tracker.time_out(2).publish_datetime == "sent 2"
+    assert tracker.time_out(1) is None # Already delivered.
+    assert tracker.receive(2) is None
+    assert tracker.counters() == {"received": 1, "timed_out": 1, "in_flight": 1, "duplicates": 1, "late": 1, "reordered": 0}
+
+
+def test_reordered_arrival():
+    tracker = InFlightTracker(8)
+    send(tracker, 1, 2, 3)
+    tracker.receive(3)
+    tracker.receive(1)
+    tracker.receive(2)
+    assert tracker.reordered == 2
+    assert tracker.received == 3
+
+
+def test_ring_wrap_around_clears_reused_slots():
+    tracker = InFlightTracker(8)
+    send(tracker, *range(1, 9))
+    tracker.receive(1)
+    tracker.time_out(2)
+    send(tracker, 9, 10) # Slots of 1 and 2 are reused, the window starts at 3.
+    assert tracker.base == 3
+    assert tracker.receive(9).publish_datetime == "sent 9" # Not a duplicate of 1.
+    tracker.time_out(10)
+    tracker.receive(10)
+    assert tracker.late == 1 # 10 timed out, the timeout of 2 is forgotten.
+    tracker.receive(9)
+    assert tracker.duplicates == 1
+    tracker.receive(1) # Below the window.
+    tracker.receive(2)
+    assert tracker.duplicates == 3
+
+
+def test_jump_past_the_whole_window_resets_the_bitmaps():
+    tracker = InFlightTracker(8)
+    send(tracker, 1, 2)
+    tracker.receive(1)
+    tracker.time_out(2)
+    send(tracker, 100)
+    assert tracker.base == 93
+    assert not any(tracker.received_bits) and not any(tracker.timed_out_bits)
+    assert tracker.receive(100) is not None
+
+
+def test_outstanding_message_stays_tracked_when_the_window_passes_it():
+    tracker = InFlightTracker(8)
+    send(tracker, *range(1, 20))
+    assert tracker.in_flight == 19
+    assert tracker.receive(1).publish_datetime == "sent 1"
+    assert tracker.receive(1) is None
+    assert tracker.duplicates == 1
+
+
+def test_expect_tracks_unseen_sends():
+    tracker = InFlightTracker(8)
+    tracker.expect(5)
+    assert tracker.in_flight == 5 and tracker.highest_sent == 5
+    tracker.expect(3) # Already expected.
+    assert tracker.in_flight == 5
+
+
+def test_drain_returns_missing_in_order_and_marks_them_late():
+    tracker = InFlightTracker(8)
+    send(tracker, 3, 1, 2)
+    tracker.receive(2)
+    assert [message_index for message_index, message in tracker.drain()] == [1, 3]
+    assert tracker.in_flight == 0
+    tracker.receive(3)
+    assert tracker.late == 1
+
+
+def test_discard_forgets_a_message():
+    tracker = InFlightTracker(8)
+    send(tracker, 1)
+    assert tracker.discard(1) is not None
+    tracker.receive(1)
+    assert tracker.counters()["received"] == 0 and tracker.duplicates == 0 and tracker.late == 0
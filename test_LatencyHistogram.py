@@ -0,0 +1,99 @@
+import math
+import random
+import pytest
+from LatencyHistogram import LatencyHistogram, HistogramSet, histogram_path
+
+
+def test_values_below_two_half_ranges_are_exact():
+    histogram = LatencyHistogram()
+    for value in range(256):
+        index = histogram.bucket_index(value)
+        assert index == value
+        assert histogram.bucket_value(index) == value
+
+
+def test_bucket_boundaries():
+    histogram = LatencyHistogram()
+    # 256 is the first value with a 2 microsecond bucket: 256 and 257 share one, 258 starts the next.
+    assert histogram.bucket_index(256) == histogram.bucket_index(257)
+    assert histogram.bucket_index(258) == histogram.bucket_index(257) + 1
+    for value in (255, 256, 257, 511, 512, 1023, 1024, 10 ** 6, 2 ** 40 + 12345):
+        index = histogram.bucket_index(value)
+        upper = histogram.bucket_value(index)
+        assert value <= upper
+        assert index == 0 or histogram.bucket_value(index - 1) < value # Upper bound of the bucket below is under the value.
+        assert upper - value < value / histogram.half_bucket_count + 1
+
+
+def test_percentile_relative_error():
+    random.seed(1)
+    values = sorted(random.lognormvariate(0, 2) for _ in range(20000))
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    for percent in (1, 50, 90, 99, 99.9, 100):
+        exact = round(values[max(math.ceil(percent / 100 * len(values)) - 1, 0)] * 1000) / 1000
+        assert histogram.percentile(percent) == pytest.approx(exact, rel=0.01, abs=0.001)
+
+
+def test_percentile_is_nearest_rank_and_capped_at_max():
+    histogram = LatencyHistogram()
+    for value_ms in (0.1, 0.2, 0.3, 0.4): # Exact buckets.
+        histogram.record(value_ms)
+    assert histogram.percentile(25) == 0.1
+    assert histogram.percentile(26) == 0.2
+    assert histogram.percentile(100) == 0.4
+    histogram = LatencyHistogram()
+    histogram.record(1000.001) # The upper bound of its bucket is above the value.
+    assert histogram.percentile(100) == 1000.001
+
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    assert histogram.mean() is None
+    assert histogram.summary() == {}
+
+
+def test_merge_equals_recording_into_one():
+    random.seed(2)
+    values = [random.expovariate(0.5) for _ in range(5000)]
+    combined, first, second = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for value in values:
+        combined.record(value)
+    for value in values[:1000]:
+        first.record(value)
+    for value in values[1000:]:
+        second.record(value)
+    first.merge(second)
+    assert first.to_dict() == combined.to_dict()
+    empty = LatencyHistogram()
+    empty.merge(combined)
+    assert empty.to_dict() == combined.to_dict()
+    combined.merge(LatencyHistogram())
+    assert combined.min == empty.min and combined.max == empty.max
+
+
+def test_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        LatencyHistogram().merge(LatencyHistogram(sub_bucket_bits=6))
+
+
+def test_negative_values_record_as_zero():
+    histogram = LatencyHistogram()
+    histogram.record(-0.5)
+    assert histogram.min == 0
+    assert histogram.percentile(50) == 0.0
+
+
+def test_histogram_set_round_trip(tmp_path):
+    histograms = HistogramSet()
+    histograms.get("delivery").record(1.5)
+    histograms.get("delivery_qos_1").record(2.5, count=3)
+    path = histogram_path(str(tmp_path / "results.sqlite"))
+    assert path.endswith("results.hdr.json")
+    histograms.save(path)
+    loaded = HistogramSet.load(path)
+    assert loaded.names() == ["delivery", "delivery_qos_1"]
+    assert loaded.get("delivery_qos_1").count == 3
+    assert loaded.to_dict() == histograms.to_dict()
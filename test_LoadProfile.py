@@ -0,0 +1,73 @@
+import argparse
+import pytest
+from LoadProfile import LoadProfile
+
+
+def send_times(profile):
+    return [offset for message_index, offset in profile.schedule()]
+
+
+def gaps(times):
+    return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+def test_constant_schedule():
+    schedule = list(LoadProfile(rate=100.0, message_count=5).schedule())
+    assert [message_index for message_index, offset in schedule] == [1, 2, 3, 4, 5]
+    assert [offset for message_index, offset in schedule] == pytest.approx([0.0, 0.01, 0.02, 0.03, 0.04])
+
+
+def test_ramp_gaps_shrink_until_the_target_rate():
+    profile = LoadProfile("ramp", rate=100.0, message_count=200, start_rate=10.0, ramp_up=1.0)
+    times = send_times(profile)
+    ramp_gaps = [gap for time, gap in zip(times, gaps(times)) if time < 1.0]
+    assert all(later <= earlier for earlier, later in zip(ramp_gaps, ramp_gaps[1:]))
+    assert ramp_gaps[0] == pytest.approx(0.1)
+    assert all(gap == pytest.approx(0.01) for time, gap in zip(times, gaps(times)) if time >= 1.0)
+    assert profile.rate_at(0.5) == pytest.approx(55.0)
+
+
+def test_step_rate_rises_every_step_up_to_the_rate():
+    profile = LoadProfile("step", rate=30.0, message_count=10, start_rate=10.0, step_rate=10.0, step_duration=1.0)
+    assert [profile.rate_at(t) for t in (0.0, 0.99, 1.0, 2.5, 10.0)] == [10.0, 10.0, 20.0, 30.0, 30.0]
+    times = send_times(LoadProfile("step", rate=30.0, duration=3.0, start_rate=10.0, step_rate=10.0, step_duration=1.0))
+    # The gap after every send is 1 / the rate at that send.
+    assert gaps(times) == pytest.approx([1.0 / profile.rate_at(time) for time in times[:-1]])
+    assert {round(gap, 6) for gap in gaps(times)} == {0.1, 0.05, round(1 / 30, 6)}
+
+
+def test_spike_window():
+    profile = LoadProfile("spike", rate=10.0, duration=3.0, spike_rate=100.0, spike_start=1.0, spike_duration=1.0)
+    assert [profile.rate_at(t) for t in (0.5, 1.0, 1.5, 2.0)] == [10.0, 100.0, 100.0, 10.0]
+    times = send_times(profile)
+    assert gaps(times) == pytest.approx([1.0 / profile.rate_at(time) for time in times[:-1]])
+    assert 85 <= sum(1 for time in times if 1.0 <= time < 2.0) <= 100
+    assert times[-1] < 3.0
+
+
+def test_soak_runs_for_the_duration_not_the_message_count():
+    times = send_times(LoadProfile("soak", rate=50.0, message_count=10, duration=2.0))
+    assert len(times) == 100
+    assert times[-1] < 2.0
+
+
+def test_invalid_profiles():
+    with pytest.raises(ValueError):
+        LoadProfile("burst")
+    with pytest.raises(ValueError):
+        LoadProfile(rate=0)
+    with pytest.raises(ValueError):
+        LoadProfile("soak")
+    with pytest.raises(ValueError):
+        LoadProfile("step", step_rate=None)
+    with pytest.raises(ValueError):
+        LoadProfile("spike", spike_rate=100.0, spike_duration=0.0)
+
+
+def test_from_args_uses_the_interval_without_rate():
+    args = argparse.Namespace(profile="constant", rate=None, interval=0.5, message_count=3, duration=None, start_rate=1.0, ramp_up=0.0,
+                              step_rate=None, step_duration=10.0, spike_rate=None, spike_start=0.0, spike_duration=0.0)
+    assert LoadProfile.from_args(args).rate == 2.0
+    args.interval = 0
+    with pytest.raises(ValueError):
+        LoadProfile.from_args(args)
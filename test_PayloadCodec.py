@@ -0,0 +1,80 @@
+import pytest
+from PayloadCodec import BinaryPayloadCodec, JSONPayloadCodec, create_codec, parse_size, format_size, data_length_for_payload, payload_size
+
+
+# The payload as a subscriber receives it from paho.
+def received(payload):
+    return payload.encode() if isinstance(payload, str) else bytes(payload)
+
+
+@pytest.mark.parametrize("payload_format", ["json", "binary"])
+def test_encode_decode_round_trip(payload_format):
+    codec = create_codec(payload_format, "client-123", 256)
+    payload, send_time, publish_datetime = codec.encode(42)
+    message_index, decoded_send_time, decoded_publish_datetime, sender = codec.decode(received(payload))
+    assert message_index == 42
+    assert decoded_send_time == send_time
+    assert decoded_publish_datetime == publish_datetime
+    assert sender == codec.client_key
+
+
+@pytest.mark.parametrize("payload_format", ["json", "binary"])
+def test_return_payload_round_trip(payload_format):
+    codec = create_codec(payload_format, "client-123", 64)
+    payload = codec.encode(7)[0]
+    receive_time, original = codec.decode_return(received(codec.return_payload(received(payload), 12.5)))
+    assert receive_time == 12.5
+    assert codec.decode(original)[0] == 7
+
+
+def test_binary_payload_is_padded_to_the_data_length():
+    assert len(BinaryPayloadCodec("c", 1024).encode(1)[0]) == 1024
+    assert len(BinaryPayloadCodec("c", 0).encode(1)[0]) == BinaryPayloadCodec.HEADER.size
+
+
+def test_binary_client_ids_with_a_common_prefix_stay_distinct():
+    prefix = "x" * 30
+    first, second = BinaryPayloadCodec(f"{prefix}-1", 0), BinaryPayloadCodec(f"{prefix}-2", 0)
+    assert first.decode(second.encode(1)[0])[3] != first.client_key
+
+
+def test_binary_rejects_client_ids_longer_than_the_header_field():
+    BinaryPayloadCodec("x" * BinaryPayloadCodec.CLIENT_ID_BYTES, 0)
+    with pytest.raises(ValueError):
+        BinaryPayloadCodec("x" * (BinaryPayloadCodec.CLIENT_ID_BYTES + 1), 0)
+    with pytest.raises(ValueError):
+        BinaryPayloadCodec("ä" * 17, 0) # 34 bytes encoded.
+
+
+def test_json_data_field_has_the_data_length():
+    codec = JSONPayloadCodec("c", 300)
+    assert len(codec.data) == 300
+    assert codec.encode(1)[0].endswith(codec.data + '"}')
+
+
+@pytest.mark.parametrize("value, size", [("512", 512), ("64KB", 65536), ("64kb", 65536), ("1.5K", 1536), ("2 MB", 2 * 1024 ** 2), (100, 100)])
+def test_parse_size(value, size):
+    assert parse_size(value) == size
+
+
+@pytest.mark.parametrize("value", ["", "KB", "-1", "1GB", "1 K B"])
+def test_parse_size_rejects_invalid_sizes(value):
+    with pytest.raises(ValueError):
+        parse_size(value)
+
+
+def test_format_size():
+    assert [format_size(size) for size in (55, 1024, 1536, 1024 ** 2)] == ["55 B", "1 KB", "1.5 KB", "1 MB"]
+
+
+@pytest.mark.parametrize("payload_format", ["json", "binary"])
+@pytest.mark.parametrize("size", [1024, 65536])
+def test_data_length_for_payload_gives_the_whole_payload_size(payload_format, size):
+    client_id = "sweep-step1-123"
+    data_length = data_length_for_payload(payload_format, client_id, size)
+    assert abs(payload_size(payload_format, client_id, data_length) - size) <= 2 # Json header fields vary with the send time.
+
+
+def test_data_length_for_payload_below_the_header():
+    assert data_length_for_payload("json", "c", 10) == 0
+    assert payload_size("binary", "c", data_length_for_payload("binary", "c", 10)) == BinaryPayloadCodec.HEADER.size
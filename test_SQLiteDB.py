@@ -0,0 +1,33 @@
+import sqlite3
+from SQLiteDB import SQLiteDB
+
+
+def result_row(db, index, client_id="c1"):
+    return db.prepare_row(index, "2024-05-01 12:00:00", "1.0", "1.001", 1.0, False, client_id, None, None, 0)
+
+
+def stored_indexes(db):
+    db.flush()
+    with sqlite3.connect(db.db_file) as conn:
+        return [row[0] for row in conn.execute("SELECT MessageIndex FROM results ORDER BY MessageIndex")]
+
+
+def test_duplicate_key_in_batch_keeps_other_rows(tmp_path):
+    db = SQLiteDB(status_interval=None, db_file=str(tmp_path / "results.sqlite"))
+    try:
+        db.write_rows([result_row(db, 1)])
+        db.write_rows([result_row(db, index) for index in (2, 1, 3, 4)])
+        assert stored_indexes(db) == [1, 2, 3, 4]
+        assert db.last_result_index == 4
+    finally:
+        db.close_connection()
+
+
+def test_batched_writer_keeps_rows_around_duplicate(tmp_path):
+    db = SQLiteDB(batch_size=100, flush_interval=0.05, status_interval=None, db_file=str(tmp_path / "results.sqlite"))
+    try:
+        for index in (1, 2, 2, 3):
+            db.insert_result(index, "2024-05-01 12:00:00", "1.0", "1.001", 1.0, client_id="c1", qos=0)
+        assert stored_indexes(db) == [1, 2, 3]
+    finally:
+        db.close_connection()
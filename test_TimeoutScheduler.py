@@ -0,0 +1,94 @@
+import threading
+import time
+from TimeoutScheduler import TimeoutScheduler
+
+
+def wait_for(event, timeout=2.0):
+    assert event.wait(timeout), "Timeout callback did not run."
+
+
+def test_expires_in_deadline_order():
+    scheduler = TimeoutScheduler(resolution=0.001)
+    scheduler.start()
+    expired = []
+    done = threading.Event()
+    try:
+        scheduler.schedule(0.03, expired.append, 3)
+        scheduler.schedule(0.01, expired.append, 1)
+        scheduler.schedule(0.02, expired.append, 2)
+        scheduler.schedule(0.04, done.set)
+        wait_for(done)
+        assert expired == [1, 2, 3]
+        assert len(scheduler) == 0
+    finally:
+        scheduler.stop()
+
+
+def test_cancelled_timeout_does_not_run():
+    scheduler = TimeoutScheduler(resolution=0.001)
+    scheduler.start()
+    expired = []
+    done = threading.Event()
+    try:
+        handle = scheduler.schedule(0.01, expired.append, "cancelled")
+        scheduler.schedule(0.02, done.set)
+        assert len(scheduler) == 2
+        handle.cancel()
+        handle.cancel() # A second cancel is counted once.
+        assert len(scheduler) == 1
+        wait_for(done)
+        assert expired == []
+        assert scheduler.cancelled_count == 0 # Skipped when it reached the top of the heap.
+    finally:
+        scheduler.stop()
+
+
+def test_cancel_after_expiry_is_a_no_op():
+    scheduler = TimeoutScheduler(resolution=0.001)
+    scheduler.start()
+    done = threading.Event()
+    try:
+        handle = scheduler.schedule(0.0, done.set)
+        wait_for(done)
+        handle.cancel()
+        assert scheduler.cancelled_count == 0
+        assert len(scheduler) == 0
+    finally:
+        scheduler.stop()
+
+
+def test_compacts_when_most_entries_are_cancelled():
+    scheduler = TimeoutScheduler() # Not started, nothing expires during the test.
+    handles = [scheduler.schedule(60, lambda: None) for _ in range(3000)]
+    for handle in handles[:1025]:
+        handle.cancel()
+    assert len(scheduler.heap) == 3000 # Under half of the heap is cancelled.
+    for handle in handles[1025:1501]:
+        handle.cancel()
+    assert len(scheduler.heap) == 1499
+    assert scheduler.cancelled_count == 0
+    assert len(scheduler) == 1499
+    assert all(not entry[2].cancelled for entry in scheduler.heap)
+    assert scheduler.heap[0][2] is handles[1501]
+
+
+def test_failing_callback_does_not_stop_the_scheduler():
+    scheduler = TimeoutScheduler(resolution=0.001)
+    scheduler.start()
+    done = threading.Event()
+    try:
+        scheduler.schedule(0.0, lambda: 1 / 0)
+        scheduler.schedule(0.01, done.set)
+        wait_for(done)
+    finally:
+        scheduler.stop()
+
+
+def test_stop_drops_pending_timeouts():
+    scheduler = TimeoutScheduler(resolution=0.001)
+    scheduler.start()
+    expired = []
+    scheduler.schedule(0.05, expired.append, 1)
+    scheduler.stop()
+    time.sleep(0.1)
+    assert expired == []